@@ -3,8 +3,32 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 import io # Import io for handling uploaded files
+import os
+import sys
+import re
+import math
+import json
+import hashlib
+import logging
+import bisect
+import heapq
+import csv
+import gzip
+import codecs
+import functools
+import collections
+import importlib.util
+import argparse
+import threading
+import html
+import time
+import tempfile
+import concurrent.futures
+import numpy as np
 import folium
+from folium.plugins import HeatMap
 from streamlit_folium import st_folium
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import plotly.graph_objects as go
 
 st.set_page_config(page_title="Combined Data Dashboards", layout="wide")
@@ -12,19 +36,631 @@ st.title("📊 Combined Data Dashboards")
 
 # --- Common Functions (Used by one or both sections) ---
 
-@st.cache_data # Cache preprocessing for performance
-def preprocess(df):
-    """Cleans DataFrame columns to be lowercase, snake_case, and alpha-numeric."""
-    if df is None or df.empty: # Add check for None input
-         return pd.DataFrame() # Return empty DataFrame for consistency
+# Per-dataset caches that build on a loaded frame are bounded: enough entries for every brand tab in a
+# few weighting/segment states, without keeping every combination ever viewed alive for the server's life
+DATASET_CACHE_MAX_ENTRIES = 32
+# Per-column results (value counts, block counts) are small but numerous: a dataset has hundreds of columns
+COLUMN_CACHE_MAX_ENTRIES = 4096
+
+_NON_SNAKE_CHARS = re.compile(r'[^a-z0-9_]')
+
+@functools.lru_cache(maxsize=8192)
+def _normalise_header(header):
+    """Lowercase, strip and replace anything that isn't a-z, 0-9 or '_' with '_'."""
+    return _NON_SNAKE_CHARS.sub('_', header.strip().lower())
+
+@functools.lru_cache(maxsize=256)
+def normalise_column_names(headers):
+    """Maps a header signature (tuple of raw headers) to unique snake_case names.
+
+    Memoised per signature, so re-reading a file with the same schema is a dict lookup.
+    Headers that collapse onto the same name keep it for the first occurrence and get
+    '_2', '_3', ... suffixes afterwards, so frames never carry duplicate columns.
+    """
+    names = [_normalise_header(header) for header in headers]
+    taken = set(names)
+    seen = set()
+    unique_names = []
+    for name in names:
+        if name in seen:
+            suffix = 2
+            while f"{name}_{suffix}" in taken:
+                suffix += 1
+            name = f"{name}_{suffix}"
+            taken.add(name)
+        seen.add(name)
+        unique_names.append(name)
+    return tuple(unique_names)
+
+_AGE_RANGE = re.compile(r'^(\d+)\s*(?:-|–|—|to)\s*(\d+)(?:\s*(?:years?|yrs?|y/?o))?$')
+_AGE_OPEN_ENDED = re.compile(r'^(\d+)\s*(?:\+|and above|& above|above|or older|and over)(?:\s*(?:years?|yrs?))?$')
+_MISSING_LABELS = {'', 'nan', 'none', 'n/a', 'na', '<na>'}
+
+@functools.lru_cache(maxsize=65536)
+def harmonise_category(label):
+    """Maps a raw category label to a canonical one ('female ' -> 'Female', '18 to 24' -> '18-24').
+
+    Returns None for missing/blank answers. Memoised per unique label.
+    """
+    text = " ".join(str(label).split())
+    lowered = text.lower()
+    if lowered in _MISSING_LABELS:
+        return None
+    if lowered in CATEGORY_SYNONYMS:
+        return CATEGORY_SYNONYMS[lowered]
+    age_range = _AGE_RANGE.match(lowered)
+    if age_range:
+        return f"{age_range.group(1)}-{age_range.group(2)}"
+    open_ended = _AGE_OPEN_ENDED.match(lowered)
+    if open_ended:
+        return f"{open_ended.group(1)}+"
+    return text if any(ch.isupper() for ch in text) else text.title()
+
+def harmonise_series(series):
+    """Harmonises a column's labels, mapping each unique value once (factorise, map, take)."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    mapped = np.array([harmonise_category(value) for value in uniques] + [None], dtype=object)
+    return pd.Series(mapped[codes], index=series.index, name=series.name) # code -1 picks the trailing None
+
+def _brand_key(label):
+    """Lowercase letters and digits only ('K.F.C ' -> 'kfc', "Mc Donald's" -> 'mcdonalds')."""
+    return re.sub(r'[^0-9a-z]', '', str(label).lower())
+
+def _trigrams(key):
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+@functools.lru_cache(maxsize=1)
+def _brand_ngram_index():
+    """(alias key -> brand, trigram -> alias keys, alias key -> trigrams) built once from BRAND_ALIASES."""
+    aliases = {_brand_key(alias): brand for brand, spellings in BRAND_ALIASES.items() for alias in [brand] + spellings}
+    alias_trigrams = {key: _trigrams(key) for key in aliases}
+    postings = collections.defaultdict(set)
+    for key, grams in alias_trigrams.items():
+        for gram in grams:
+            postings[gram].add(key)
+    return aliases, postings, alias_trigrams
+
+@functools.lru_cache(maxsize=65536)
+def canonical_brand(label):
+    """Maps a free-text brand mention to its canonical brand ('kfc ', 'K.F.C', 'Kentucky' -> 'KFC').
+
+    Exact alias spellings are a dict lookup; otherwise only aliases sharing a trigram with the
+    answer (blocking) are scored, and the best Dice similarity at or above BRAND_MATCH_THRESHOLD
+    wins. Unmatched answers come back with their whitespace tidied. Memoised per unique label.
+    """
+    text = " ".join(str(label).split())
+    key = _brand_key(text)
+    aliases, postings, alias_trigrams = _brand_ngram_index()
+    if key in aliases:
+        return aliases[key]
+    if len(key) < 4: # Too short to match fuzzily without false positives
+        return text
+    grams = _trigrams(key)
+    shared = collections.Counter(alias for gram in grams for alias in postings.get(gram, ()))
+    best_score, best_alias = 0.0, None
+    for alias, overlap in shared.items():
+        score = 2 * overlap / (len(grams) + len(alias_trigrams[alias]))
+        if score > best_score:
+            best_score, best_alias = score, alias
+    return aliases[best_alias] if best_score >= BRAND_MATCH_THRESHOLD else text
+
+def canonicalise_brand_columns(df):
+    """Canonicalises the brand-mention columns of a freshly parsed frame in place (each unique answer mapped once)."""
+    for col in df.columns:
+        if not column_spec_matches(col, BRAND_MENTION_COLUMNS) or not pd.api.types.is_string_dtype(df[col]):
+            continue
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=True)
+        mapped = np.array([canonical_brand(value) for value in uniques] + [None], dtype=object)
+        df[col] = pd.Series(mapped[codes], index=df.index, dtype=df[col].dtype) # code -1 picks the trailing None
+    return df
 
-    # Convert column names to string type to handle potential non-string headers
-    df.columns = df.columns.astype(str)
-    df.columns = df.columns.str.strip().str.lower().str.replace(r'[^a-z0-9_]', '_', regex=True)
+@functools.lru_cache(maxsize=None)
+def _likert_lookup(scale):
+    """Lowercased label -> position on a Likert scale."""
+    labels = LIKERT_SCALES[scale]
+    lookup = {label.lower(): i for i, label in enumerate(labels)}
+    lookup.update({wording: labels.index(label) for wording, label in LIKERT_SYNONYMS.get(scale, {}).items()})
+    return lookup
+
+def encode_likert_columns(df):
+    """Re-encodes Likert-labelled columns of a freshly parsed frame as ordered categoricals, in place.
+
+    A text column is Likert if all its answers are points of one LIKERT_SCALES scale (at least two
+    distinct points); the codes are the scale positions, so scores are plain integer arithmetic.
+    """
+    for col in df.columns:
+        if not pd.api.types.is_string_dtype(df[col]):
+            continue
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=True)
+        keys = [" ".join(str(value).split()).lower() for value in uniques]
+        for scale in LIKERT_SCALES:
+            lookup = _likert_lookup(scale)
+            positions = [lookup.get(key, -1 if key in _MISSING_LABELS else None) for key in keys]
+            if None in positions or len({pos for pos in positions if pos >= 0}) < 2:
+                continue
+            scale_codes = np.array(positions + [-1], dtype=np.int8)[codes] # code -1 picks the trailing -1
+            df[col] = pd.Categorical.from_codes(scale_codes, categories=LIKERT_SCALES[scale], ordered=True)
+            break
     return df
 
-def pie_chart(data, label_col, value_col, title):
-    """Generates and displays an Altair pie chart."""
+def align_brand_frames(dataframes, dims=None):
+    """Stacks the canonical dimension columns of every brand into one long frame.
+
+    Columns are matched through COLUMN_SYNONYMS (first synonym present wins) and labels are
+    harmonised, so e.g. Panasonic's 'please_select_your_gender' lines up with 'gender'.
+    """
+    dims = list(COLUMN_SYNONYMS) if dims is None else dims
+    parts = []
+    for brand_name, df in dataframes.items():
+        aligned = {}
+        for dim in dims:
+            source_col = next((col for col in COLUMN_SYNONYMS.get(dim, [dim]) if col in df.columns), None)
+            aligned[dim] = harmonise_series(df[source_col]) if source_col else pd.Series(None, index=df.index, dtype=object)
+        part = pd.DataFrame(aligned, index=df.index)
+        part['Brand'] = brand_name
+        part['Weight'] = df[WEIGHT_COLUMN].to_numpy() if WEIGHT_COLUMN in df.columns else 1.0
+        parts.append(part.reset_index(drop=True))
+    if not parts:
+        return pd.DataFrame(columns=dims + ['Brand', 'Weight'])
+    return pd.concat(parts, ignore_index=True)
+
+@st.cache_data(show_spinner=False, max_entries=DATASET_CACHE_MAX_ENTRIES)
+def cross_brand_share_matrices(brands_key, _dataframes):
+    """Share of respondents per category, Brand x Category, for every canonical dimension.
+
+    Each dimension is one crosstab over the stacked frame of all brands, so adding brands adds
+    rows rather than per-brand loops. Shares are weighted when the frames carry respondent weights.
+    brands_key (brand names + dataset fingerprints) keys the cache.
+    """
+    aligned = align_brand_frames(_dataframes)
+    matrices = {}
+    for dim in COLUMN_SYNONYMS:
+        answered = aligned[dim].notna()
+        if not answered.any():
+            continue
+        matrices[dim] = pd.crosstab(aligned.loc[answered, 'Brand'], aligned.loc[answered, dim],
+                                    values=aligned.loc[answered, 'Weight'], aggfunc='sum',
+                                    normalize='index').fillna(0.0)
+    return matrices
+
+# --- Survey weights (weight column or raking to target margins) ---
+WEIGHT_COLUMN = '_weight' # Added to weighted frames; every count sums it instead of counting rows
+WEIGHTING_MODES = ["Unweighted", "Weight column", "Rake to targets"]
+
+def rake_weights(df, targets, max_iter=50, tol=1e-6):
+    """Raking weights (iterative proportional fitting) matching target shares per dimension.
+
+    targets maps canonical dimensions to {harmonised category: share}. Each pass rescales the
+    weights of one dimension's categories to their target totals with a bincount, so the cost
+    is O(rows) per dimension. Respondents with a missing or untargeted answer keep their weight.
+    Returns weights normalised to a mean of 1.
+    """
+    weights = np.ones(len(df))
+    margins = []
+    for dim, shares in targets.items():
+        source_col = next((col for col in COLUMN_SYNONYMS.get(dim, [dim]) if col in df.columns), None)
+        if source_col is None:
+            continue
+        codes, uniques = pd.factorize(harmonise_series(df[source_col]), use_na_sentinel=True)
+        share = np.array([shares.get(value, np.nan) for value in uniques], dtype=float)
+        targeted = codes >= 0
+        targeted[targeted] = ~np.isnan(share[codes[targeted]])
+        if not targeted.any():
+            continue
+        # Renormalise the targets over the categories this dataset actually has
+        present = np.bincount(codes[targeted], minlength=len(share)) > 0
+        share = np.where(present, share, np.nan) / np.nansum(share[present])
+        margins.append((codes[targeted], share, targeted))
+    for _ in range(max_iter):
+        max_change = 0.0
+        for codes, share, targeted in margins:
+            targeted_weights = weights[targeted]
+            current = np.bincount(codes, weights=targeted_weights, minlength=len(share))
+            present = current > 0
+            factor = np.ones(len(share))
+            factor[present] = share[present] * targeted_weights.sum() / current[present]
+            weights[targeted] = targeted_weights * factor[codes]
+            max_change = max(max_change, float(np.abs(factor[present] - 1.0).max()))
+        if max_change < tol:
+            break
+    return weights / weights.mean() if len(weights) else weights
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_weighting_targets(path, mtime_ns):
+    """Target shares from the targets JSON file, with categories harmonised (mtime_ns keys the cache).
+
+    Raises ValueError if the file isn't a {dimension: {category: share}} object or a share is not
+    a finite, non-negative number.
+    """
+    with open(path, encoding="utf-8") as targets_file:
+        raw_targets = json.load(targets_file)
+    if not isinstance(raw_targets, dict):
+        raise ValueError("targets must be a JSON object of {dimension: {category: share}}")
+    targets = {}
+    for dim, shares in raw_targets.items():
+        if not isinstance(shares, dict):
+            raise ValueError(f"targets for '{dim}' must be an object of {{category: share}}")
+        targets[dim] = {}
+        for category, share in shares.items():
+            if isinstance(share, bool) or not isinstance(share, (int, float)) or not math.isfinite(share) or share < 0:
+                raise ValueError(f"target share for '{dim}' / '{category}' must be a non-negative number, got {share!r}")
+            if harmonise_category(category) is not None:
+                targets[dim][harmonise_category(category)] = float(share)
+    return targets
+
+@st.cache_resource(show_spinner=False, max_entries=DATASET_CACHE_MAX_ENTRIES)
+def survey_weights(fingerprint, mode, targets_key, _df, _targets):
+    """Respondent weights for one dataset and weighting mode, or None if the mode does not apply."""
+    if mode == "Weight column":
+        weight_col = next((col for col in WEIGHT_COLUMNS if col in _df.columns), None)
+        if weight_col is None:
+            return None
+        weights = pd.to_numeric(_df[weight_col], errors='coerce').fillna(0.0).clip(lower=0.0).to_numpy(dtype=float)
+        return weights if weights.any() else None
+    if mode == "Rake to targets" and _targets:
+        return rake_weights(_df, _targets)
+    return None
+
+def apply_weighting(df, mode, targets=None):
+    """df with respondent weights in WEIGHT_COLUMN for the chosen mode; the result gets its own fingerprint."""
+    if mode == "Unweighted" or df.empty:
+        return df
+    targets_key = json.dumps(targets, sort_keys=True) if mode == "Rake to targets" else ""
+    weights = survey_weights(dataset_fingerprint(df), mode, targets_key, df, targets)
+    if weights is None:
+        return df
+    weighted_df = df.assign(**{WEIGHT_COLUMN: weights})
+    weighted_df.attrs = {**df.attrs, 'fingerprint': hashlib.sha1(
+        f"{dataset_fingerprint(df)}|{mode}|{targets_key}".encode("utf-8")).hexdigest()[:16]}
+    return weighted_df
+
+# --- Segment filter (one demographic selection applied to every brand tab) ---
+SEGMENT_DIMENSIONS = ['gender', 'age_group', 'income', 'region']
+
+class SegmentBitmaps:
+    """Packed row bitmaps, one per harmonised category of each segment dimension.
+
+    Built once per dataset; a selection is answered with bitwise ORs within a dimension and
+    ANDs across dimensions over the packed bytes, then unpacked into a row mask.
+    """
+
+    def __init__(self, df, dims=SEGMENT_DIMENSIONS):
+        self.n_rows = len(df)
+        self.bitmaps = {}
+        for dim in dims:
+            source_col = next((col for col in COLUMN_SYNONYMS.get(dim, [dim]) if col in df.columns), None)
+            if source_col is None:
+                continue
+            codes, uniques = pd.factorize(harmonise_series(df[source_col]), use_na_sentinel=True)
+            self.bitmaps[dim] = {value: np.packbits(codes == i) for i, value in enumerate(uniques)}
+
+    def options(self, dim):
+        """Harmonised categories present for a dimension (empty if the dataset lacks it)."""
+        return sorted(self.bitmaps.get(dim, {}))
+
+    def mask(self, selection):
+        """Boolean row mask for {dim: [categories]}, or None if nothing selected applies here.
+
+        Dimensions the dataset does not have are skipped rather than filtering everything out.
+        """
+        combined = None
+        for dim, values in selection.items():
+            if not values or dim not in self.bitmaps:
+                continue
+            dim_bits = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+            for value in values:
+                if value in self.bitmaps[dim]:
+                    dim_bits |= self.bitmaps[dim][value]
+            combined = dim_bits if combined is None else combined & dim_bits
+        if combined is None:
+            return None
+        return np.unpackbits(combined, count=self.n_rows).astype(bool)
+
+@st.cache_resource(show_spinner=False, max_entries=DATASET_CACHE_MAX_ENTRIES)
+def segment_bitmaps(fingerprint, _df):
+    """Builds the segment bitmaps once per dataset."""
+    return SegmentBitmaps(_df)
+
+def apply_segment_filter(df, selection):
+    """Rows of df in the selected segment, with a caption; the subset gets its own fingerprint."""
+    if df.empty:
+        return df
+    bitmaps = segment_bitmaps(dataset_fingerprint(df), df)
+    mask = bitmaps.mask(selection)
+    if mask is None:
+        return df
+    segment_df = df[mask]
+    applied = {dim: sorted(values) for dim, values in selection.items() if values and dim in bitmaps.bitmaps}
+    selection_key = json.dumps(applied, sort_keys=True)
+    segment_df.attrs = {**df.attrs, 'fingerprint': hashlib.sha1(
+        f"{dataset_fingerprint(df)}|{selection_key}".encode("utf-8")).hexdigest()[:16]}
+    st.caption("🎯 Segment: " + "; ".join(
+        f"{dim.replace('_', ' ').title()} = {', '.join(values)}" for dim, values in applied.items()
+    ) + f" ({len(segment_df):,} of {len(df):,} respondents)")
+    return segment_df
+
+# --- Response cube (respondent counts pre-aggregated by segment dimensions x answer) ---
+class ResponseCube:
+    """Counts (or weighted totals) per (segment dimensions x answer) for a dataset's key questions.
+
+    Each question is grouped once; distributions and crosstabs are roll-ups of those counts
+    (summing out the other dimensions) instead of rescans of the rows. Answers are labelled
+    like count_values (stripped strings, 'nan' for missing); dimension categories are harmonised.
+    """
+
+    def __init__(self, df, questions, dims=SEGMENT_DIMENSIONS):
+        self.n_rows = len(df)
+        dim_columns = {}
+        for dim in dims:
+            source_col = next((col for col in COLUMN_SYNONYMS.get(dim, [dim]) if col in df.columns), None)
+            if source_col is not None:
+                dim_columns[dim] = harmonise_series(df[source_col]).fillna('nan').to_numpy()
+        self.dims = list(dim_columns)
+        # Weighted frames sum respondent weights; unweighted ones count each respondent once
+        self.weighted = WEIGHT_COLUMN in df.columns
+        weights = df[WEIGHT_COLUMN].to_numpy() if self.weighted else np.ones(self.n_rows, dtype=np.int64)
+        self.weight_total = float(weights.sum())
+        self.tables = {}
+        for question in questions:
+            if question not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[question], use_na_sentinel=True)
+            labels = np.array([str(value).strip() for value in uniques] + ['nan'], dtype=object)[codes]
+            grouped = pd.DataFrame({**dim_columns, 'answer': labels, 'weight': weights})
+            self.tables[question] = grouped.groupby(self.dims + ['answer'], sort=False)['weight'].sum()
+
+    def rollup(self, question, by=()):
+        """Counts of a question's answers, kept only by the given dimensions.
+
+        With no dimensions this is the question's distribution (sorted by count, like count_values);
+        with dimensions it is a long crosstab indexed by (*by, answer).
+        """
+        counts = self.tables[question].groupby(level=list(by) + ['answer'], sort=False).sum()
+        if counts.dtype.kind == 'f':
+            counts = counts.round(2)
+        if not by:
+            counts = counts.sort_values(ascending=False)
+            counts.index.name = question
+        counts.name = 'count'
+        return counts
+
+    def base(self):
+        """Respondent count (or weight total) the counts are out of."""
+        return round(self.weight_total, 2) if self.weighted else self.n_rows
+
+@st.cache_resource(show_spinner=False, max_entries=DATASET_CACHE_MAX_ENTRIES)
+def response_cube(fingerprint, _df, questions):
+    """Builds the response cube once per dataset and question set."""
+    return ResponseCube(_df, questions)
+
+def overall_response_cube(brand_name, df):
+    """Cube of the Overall tab's questions for one brand: demographics plus its representative metric."""
+    questions = tuple(col for col in OVERALL_DEMOGRAPHIC_COLUMNS + [BRAND_REPRESENTATIVE_METRICS.get(brand_name)]
+                      if col in df.columns)
+    return response_cube(dataset_fingerprint(df), df, questions)
+
+# --- Multi-response blocks ('select all that apply' questions stored as packed bitsets) ---
+# Checkbox blocks have one column per option ('Yes'/blank); slot blocks ('used_platform_1', '_2', ...)
+# hold the chosen option labels. Columns are matched like BRAND_COLUMN_SPECS entries.
+MULTI_RESPONSE_BLOCKS = {
+    'brand_aware': {"prefixes": ['brand_aware_']},
+    'brand_ad_aware': {"prefixes": ['brand_ad_aware_']},
+    'current_phone': {"contains": ['current_phone_']},
+    'hairdryer_brand': {"columns": ['dyson', 'philips', 'laifen', 'khind', 'panasonic', 'dreame', 'xiaomi',
+                                    'revlon', 'vidal_sassoon']},
+    'used_platform': {"contains": ['used_platform'], "slots": True},
+}
+_NEGATIVE_LABELS = {'no', 'tidak', '0', 'false', 'n'}
+
+def multi_response_columns(col_idx, block_spec):
+    """Columns of a multi-response block, in dataset order; every listed matcher must agree."""
+    matches = None
+    for key, lookup in (("prefixes", col_idx.startswith), ("suffixes", col_idx.endswith),
+                        ("contains", col_idx.containing)):
+        if key in block_spec:
+            found = {col for pattern in block_spec[key] for col in lookup(pattern)}
+            matches = found if matches is None else matches & found
+    if "columns" in block_spec:
+        found = set(col_idx.existing(block_spec["columns"]))
+        matches = found if matches is None else matches & found
+    return [col for col in col_idx.columns if col in (matches or ())]
+
+class MultiResponseBlock:
+    """One 'select all that apply' question as packed bitsets: one bit per respondent per option.
+
+    Options are the block's columns (checkbox blocks) or the distinct labels across its columns
+    (slot blocks). Counts and pairwise co-occurrence are popcounts over the packed bytes;
+    weighted frames unpack once and take weighted sums instead. Checkbox blocks also pack which
+    answers were given at all, so blocks with an explicit 'No' can leave blanks out of the base.
+    """
+
+    def __init__(self, df, columns, slots=False):
+        self.n_rows = len(df)
+        answers = df[columns]
+        self.answered_bits = None
+        if slots:
+            uniques = pd.unique(answers.to_numpy().ravel())
+            present = [value for value in uniques
+                       if not pd.isna(value) and str(value).strip().lower() not in _MISSING_LABELS]
+            labels = {}
+            for value in present:
+                labels.setdefault(str(value).strip(), []).append(value)
+            self.options = sorted(labels)
+            selected = np.column_stack([answers.isin(labels[option]).any(axis=1).to_numpy()
+                                        for option in self.options]) if self.options else np.zeros((self.n_rows, 0), dtype=bool)
+        else:
+            self.options = list(columns)
+            ticked, answered = zip(*(self._ticked(answers[col]) for col in columns))
+            selected = np.column_stack(ticked)
+            self.answered_bits = np.packbits(np.column_stack(answered), axis=0)
+        self.bits = np.packbits(selected, axis=0)  # (ceil(rows / 8), options)
+        self.weights = df[WEIGHT_COLUMN].to_numpy(dtype=float) if WEIGHT_COLUMN in df.columns else None
+
+    @staticmethod
+    def _ticked(column):
+        """(ticked, answered) masks of one checkbox column.
+
+        Numeric columns are ticked where non-zero; text columns unless the answer is missing, a
+        negative label ('No', 'Tidak') or a zero written as text ('0.0'). Answered is any
+        non-missing answer, ticked or not.
+        """
+        if pd.api.types.is_numeric_dtype(column):
+            values = pd.to_numeric(column, errors='coerce')
+            return values.fillna(0).ne(0).to_numpy(), values.notna().to_numpy()
+        codes, uniques = pd.factorize(column, use_na_sentinel=True)
+        labels = pd.Index(uniques).astype(str).str.strip().str.lower()
+        answered = ~labels.isin(_MISSING_LABELS)
+        ticked = answered & ~labels.isin(_NEGATIVE_LABELS) & ~(pd.to_numeric(pd.Series(uniques), errors='coerce') == 0).to_numpy()
+        # code -1 (missing) picks the trailing False
+        return (np.append(np.asarray(ticked, dtype=bool), False)[codes],
+                np.append(np.asarray(answered, dtype=bool), False)[codes])
+
+    def selected(self):
+        """Boolean (respondents x options) matrix."""
+        return np.unpackbits(self.bits, axis=0, count=self.n_rows).astype(bool)
+
+    def base(self):
+        """Respondent count (or weight total) the counts are out of."""
+        return self.n_rows if self.weights is None else round(float(self.weights.sum()), 2)
+
+    def counts(self):
+        """Respondents selecting each option, sorted by count."""
+        if self.weights is None:
+            counts = np.bitwise_count(self.bits).sum(axis=0, dtype=np.int64)
+        else:
+            counts = (self.weights @ self.selected()).round(2)
+        return pd.Series(counts, index=pd.Index(self.options, name='option'), name='count').sort_values(ascending=False)
+
+    def co_occurrence(self):
+        """Respondents selecting both options, for every pair (the diagonal is the option's own count)."""
+        if self.weights is None:
+            both = np.bitwise_count(self.bits[:, :, None] & self.bits[:, None, :]).sum(axis=0, dtype=np.int64)
+        else:
+            selected = self.selected().astype(float)
+            both = ((selected * self.weights[:, None]).T @ selected).round(2)
+        return pd.DataFrame(both, index=self.options, columns=self.options)
+
+@st.cache_resource(show_spinner=False, max_entries=DATASET_CACHE_MAX_ENTRIES)
+def multi_response_blocks(fingerprint, _df):
+    """Detects the dataset's multi-response blocks and packs them once per dataset."""
+    col_idx = column_index(_df)
+    blocks = {}
+    for name, block_spec in MULTI_RESPONSE_BLOCKS.items():
+        columns = multi_response_columns(col_idx, block_spec)
+        if columns:
+            blocks[name] = MultiResponseBlock(_df, columns, slots=block_spec.get("slots", False))
+    return blocks
+
+def multi_response_block(df, name):
+    """The named multi-response block of df, or None if the dataset does not have it."""
+    return multi_response_blocks(dataset_fingerprint(df), df).get(name)
+
+def ticked_counts(block, option):
+    """Selected / not selected counts of one option, shaped like count_values output for pie charts."""
+    selected = block.counts()[option]
+    return pd.DataFrame({'Response': ['Yes', 'Not selected'], 'Count': [selected, block.base() - selected]})
+
+def co_occurrence_chart(block, options, label, title, strip=''):
+    """Heatmap of respondents selecting both options of each pair (strip is removed from option names)."""
+    st.subheader(title)
+    both = block.co_occurrence().loc[options, options]
+    both.index = both.columns = [re.sub(strip, '', option).replace('_', ' ').strip().title() for option in options]
+    both_long = both.rename_axis(label).reset_index().melt(id_vars=label, var_name=f"Also {label}", value_name='Respondents')
+    heatmap = alt.Chart(both_long).mark_rect().encode(
+        x=alt.X(f"Also {label}:N", sort=list(both.columns)),
+        y=alt.Y(f"{label}:N", sort=list(both.index)),
+        color=alt.Color('Respondents:Q', scale=alt.Scale(scheme='blues')),
+        tooltip=[label, f"Also {label}", 'Respondents']
+    )
+    labels = heatmap.mark_text(baseline='middle').encode(text='Respondents:Q', color=alt.value('black'))
+    st.altair_chart((heatmap + labels).properties(title=title), use_container_width=True)
+    st.caption("Each cell counts respondents who selected both; the diagonal is each option's own total.")
+
+class ColumnIndex:
+    """Per-dataset index of column names for resolving column groups without rescanning df.columns.
+
+    Prefix lookups use a sorted copy of the names (bisect), substring and suffix lookups are
+    memoised per pattern, and all results keep the dataset's original column order.
+    """
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self._positions = {col: i for i, col in enumerate(self.columns)}
+        self._sorted = sorted(self.columns)
+        self._memo = {}
+
+    def __contains__(self, col):
+        return col in self._positions
+
+    def _in_order(self, matches):
+        return [col for col in sorted(matches, key=self._positions.__getitem__)]
+
+    def startswith(self, prefix):
+        """Columns starting with prefix."""
+        key = ('prefix', prefix)
+        if key not in self._memo:
+            start = bisect.bisect_left(self._sorted, prefix)
+            stop = bisect.bisect_left(self._sorted, prefix + '\U0010ffff')
+            self._memo[key] = self._in_order(self._sorted[start:stop])
+        return list(self._memo[key])
+
+    def endswith(self, suffix):
+        """Columns ending with suffix."""
+        key = ('suffix', suffix)
+        if key not in self._memo:
+            self._memo[key] = [col for col in self.columns if col.endswith(suffix)]
+        return list(self._memo[key])
+
+    def containing(self, *substrings):
+        """Columns containing any of the substrings."""
+        key = ('contains',) + substrings
+        if key not in self._memo:
+            self._memo[key] = [col for col in self.columns if any(sub in col for sub in substrings)]
+        return list(self._memo[key])
+
+    def existing(self, candidates):
+        """The candidate columns that exist in the dataset, in the candidates' order."""
+        return [col for col in candidates if col in self._positions]
+
+@functools.lru_cache(maxsize=64)
+def _column_index_for(columns):
+    return ColumnIndex(columns)
+
+def column_index(df):
+    """Returns the (memoised) ColumnIndex for a DataFrame's columns."""
+    return _column_index_for(tuple(df.columns))
+
+# Most categories a chart shows before the rest are folded into an "Other" bar/slice
+BAR_CHART_MAX_CATEGORIES = 20
+PIE_CHART_MAX_CATEGORIES = 15
+OTHER_LABEL = 'Other'
+
+def top_n_with_other(data, label_col, value_col, n, other_label=OTHER_LABEL):
+    """The n largest rows of data by value_col (largest first), with the rest summed into one "Other" row.
+
+    Uses a partial selection (argpartition), so only the n kept rows are sorted. An existing
+    "Other" row is folded into the remainder. Data with at most n rows is returned unchanged.
+    """
+    if len(data) <= n:
+        return data
+    values = pd.to_numeric(data[value_col], errors='coerce').fillna(0).to_numpy()
+    candidates = np.where(data[label_col].astype(str).to_numpy() == other_label, -np.inf, values)
+    keep = np.argpartition(-candidates, n - 1)[:n]
+    keep = keep[np.argsort(-values[keep], kind='stable')]
+    rest = np.ones(len(data), dtype=bool)
+    rest[keep] = False
+    top = data.iloc[keep]
+    other = pd.DataFrame({label_col: [other_label], value_col: [values[rest].sum()]})
+    return pd.concat([top, other], ignore_index=True)
+
+def other_caption(data, n, what):
+    """Notes how many categories a capped chart or table folded into "Other" (no-op if none were)."""
+    if len(data) > n:
+        st.caption(f"Showing the top {n} {what}; the other {len(data) - n:,} are grouped as '{OTHER_LABEL}'.")
+
+def pie_chart(data, label_col, value_col, title, max_categories=PIE_CHART_MAX_CATEGORIES):
+    """Generates and displays an Altair pie chart (small slices beyond max_categories become "Other")."""
     st.subheader(title)
     # Ensure data is not empty and required columns exist
     if not data.empty and label_col in data.columns and value_col in data.columns:
@@ -32,6 +668,8 @@ def pie_chart(data, label_col, value_col, title):
         data[value_col] = pd.to_numeric(data[value_col], errors='coerce').fillna(0)
         # Filter out rows where the value column is effectively zero after coercion
         data_to_plot = data[data[value_col] > 0].copy()
+        other_caption(data_to_plot, max_categories, "categories")
+        data_to_plot = top_n_with_other(data_to_plot, label_col, value_col, max_categories)
 
         if not data_to_plot.empty:
             chart = alt.Chart(data_to_plot).mark_arc(innerRadius=50).encode(
@@ -46,8 +684,8 @@ def pie_chart(data, label_col, value_col, title):
         st.info(f"Not enough valid data columns ({label_col}, {value_col}) or data to plot pie chart for '{title}'.")
 
 
-def bar_chart(data, label_col, value_col, title, sort_order='-y'):
-    """Generates and displays an Altair bar chart."""
+def bar_chart(data, label_col, value_col, title, sort_order='-y', max_categories=BAR_CHART_MAX_CATEGORIES):
+    """Generates and displays an Altair bar chart (bars beyond max_categories are folded into "Other")."""
     st.subheader(title)
     # Ensure data is not empty and required columns exist
     if not data.empty and label_col in data.columns and value_col in data.columns:
@@ -55,6 +693,11 @@ def bar_chart(data, label_col, value_col, title, sort_order='-y'):
         data[value_col] = pd.to_numeric(data[value_col], errors='coerce').fillna(0)
          # Filter out rows where the value column is effectively zero after coercion
         data_to_plot = data[data[value_col] > 0].copy()
+        if len(data_to_plot) > max_categories:
+            other_caption(data_to_plot, max_categories, "categories")
+            data_to_plot = top_n_with_other(data_to_plot, label_col, value_col, max_categories)
+            if sort_order == '-y':
+                sort_order = list(data_to_plot[label_col]) # Largest first, "Other" last
 
         if not data_to_plot.empty:
             # Use readable title for axis labels
@@ -73,6 +716,1441 @@ def bar_chart(data, label_col, value_col, title, sort_order='-y'):
     else:
         st.info(f"Not enough valid data columns ({label_col}, {value_col}) or data to plot bar chart for '{title}'.")
 
+# --- Proportion statistics (confidence intervals and significance for 'Yes' shares) ---
+_ERFC = np.vectorize(math.erfc, otypes=[float])
+
+def _contiguous_groups(group_labels):
+    """(order, starts, labels) that sort columns so every group is a contiguous run for reduceat."""
+    group_labels = np.asarray(group_labels, dtype=object)
+    order = np.argsort(group_labels, kind='stable')
+    sorted_labels = group_labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    return order, starts, pd.Index(sorted_labels[starts], name='Group')
+
+def _share_stats(yes_total, base, effective_n, groups, weighted, z):
+    """Wilson intervals and pairwise two-proportion z-tests for per-group 'Yes' totals out of base."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = yes_total / base
+        # Wilson score interval
+        denominator = 1 + z ** 2 / effective_n
+        centre = (share + z ** 2 / (2 * effective_n)) / denominator
+        half_width = z * np.sqrt(share * (1 - share) / effective_n + z ** 2 / (4 * effective_n ** 2)) / denominator
+        # Pairwise two-proportion z-tests (pooled), all pairs by broadcasting
+        pooled = (share[:, None] * effective_n[:, None] + share[None, :] * effective_n[None, :]) / (effective_n[:, None] + effective_n[None, :])
+        se = np.sqrt(pooled * (1 - pooled) * (1 / effective_n[:, None] + 1 / effective_n[None, :]))
+        p_values = _ERFC(np.abs((share[:, None] - share[None, :]) / se) / math.sqrt(2))
+    np.fill_diagonal(p_values, np.nan)
+
+    stats = pd.DataFrame({
+        'Yes Count': yes_total.round(2) if weighted else yes_total.astype(int),
+        'Base': base.round(2) if weighted else base.astype(int),
+        'Share': share,
+        'CI Low': np.clip(centre - half_width, 0, 1),
+        'CI High': np.clip(centre + half_width, 0, 1),
+    }, index=groups)
+    # Flag groups whose share differs significantly from the leading group
+    leader = int(np.nanargmax(share)) if np.isfinite(share).any() else None
+    stats['Differs From Leader'] = (p_values[leader] < 0.05) if leader is not None else False
+    return stats, pd.DataFrame(p_values, index=groups, columns=groups)
+
+def yes_share_stats(df, cols, group_labels, z=1.96, checkbox=None):
+    """'Yes' share per group of columns, with Wilson intervals and pairwise tests, for a whole section at once.
+
+    A respondent is 'Yes' for a group if any of its columns says yes, and answered if any column
+    is non-missing. Checkbox sections (only 'Yes' or blank, inferred when checkbox is None) have
+    no explicit 'No', so every respondent is in the base, as in MultiResponseBlock.base().
+    Weighted frames sum the weights and use the Kish effective base for the intervals. Returns
+    (stats, p_values): stats is indexed by group, p_values holds the pairwise two-proportion
+    z-test p-values between groups.
+    """
+    answers = df[cols]
+    uniques = pd.unique(answers.to_numpy().ravel())
+    yes_labels = [value for value in uniques if str(value).strip().lower() == 'yes']
+    missing_labels = [value for value in uniques if pd.isna(value) or str(value).strip().lower() in _MISSING_LABELS]
+    if checkbox is None:
+        checkbox = len(yes_labels) + len(missing_labels) == len(uniques)
+    yes = answers.isin(yes_labels).to_numpy()
+    answered = np.ones(yes.shape, dtype=bool) if checkbox else ~answers.isin(missing_labels).to_numpy()
+
+    # Reduce each group's columns with a logical OR
+    order, starts, groups = _contiguous_groups(group_labels)
+    yes = np.logical_or.reduceat(yes[:, order], starts, axis=1)
+    answered = np.logical_or.reduceat(answered[:, order], starts, axis=1)
+
+    weights = df[WEIGHT_COLUMN].to_numpy(dtype=float) if WEIGHT_COLUMN in df.columns else np.ones(len(df))
+    base = weights @ answered
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effective_n = base ** 2 / ((weights ** 2) @ answered)
+    return _share_stats(weights @ yes, base, effective_n, groups, WEIGHT_COLUMN in df.columns, z)
+
+def block_share_stats(block, group_labels, z=1.96):
+    """yes_share_stats for a checkbox MultiResponseBlock, from its packed bits (group_labels per option).
+
+    Groups OR their options' bytes; unweighted counts are popcounts. Blocks with no explicit
+    unticked answer are checkbox questions, so their base is every respondent.
+    """
+    order, starts, groups = _contiguous_groups(group_labels)
+    ticked = np.bitwise_or.reduceat(block.bits[:, order], starts, axis=1)
+    checkbox = not np.any(block.answered_bits & ~block.bits)
+    answered = None if checkbox else np.bitwise_or.reduceat(block.answered_bits[:, order], starts, axis=1)
+    if block.weights is None:
+        yes_total = np.bitwise_count(ticked).sum(axis=0, dtype=np.int64)
+        base = (np.full(len(groups), block.n_rows, dtype=np.int64) if checkbox
+                else np.bitwise_count(answered).sum(axis=0, dtype=np.int64))
+        effective_n = base.astype(float)
+    else:
+        ticked = np.unpackbits(ticked, axis=0, count=block.n_rows).astype(float)
+        answered = (np.ones_like(ticked) if checkbox
+                    else np.unpackbits(answered, axis=0, count=block.n_rows).astype(float))
+        yes_total = block.weights @ ticked
+        base = block.weights @ answered
+        with np.errstate(divide='ignore', invalid='ignore'):
+            effective_n = base ** 2 / ((block.weights ** 2) @ answered)
+    return _share_stats(yes_total, base, effective_n, groups, block.weights is not None, z)
+
+# --- Likert scoring (mean, top-2-box and net scores for a block of rating items) ---
+def rating_scale(series):
+    """(lowest, highest) point of the rating scale a numeric column's answers lie on, or None if it isn't a rating.
+
+    Answers must be whole numbers from 0 up to at most the largest of RATING_SCALE_TOPS, with at
+    least RATING_SCALE_MIN_DISTINCT distinct values; counts, amounts and 0/1 flags are not ratings.
+    """
+    values = pd.to_numeric(series, errors='coerce').dropna().unique()
+    if len(values) < RATING_SCALE_MIN_DISTINCT or (values != np.round(values)).any() or values.min() < 0:
+        return None
+    top = next((top for top in RATING_SCALE_TOPS if values.max() <= top), None)
+    return None if top is None else (0 if values.min() == 0 else 1, top)
+
+def likert_columns(df, cols):
+    """The columns that can be scored as Likert items: encoded Likert scales or numeric ratings (see rating_scale)."""
+    return [col for col in cols if (isinstance(df[col].dtype, pd.CategoricalDtype) and df[col].cat.ordered)
+            or (pd.api.types.is_numeric_dtype(df[col]) and rating_scale(df[col]) is not None)]
+
+def unscored_ratings_caption(df, cols, scored_cols):
+    """Notes numeric columns left out of a Likert summary because they don't look like a rating scale."""
+    unscored = [col for col in cols if col not in scored_cols and pd.api.types.is_numeric_dtype(df[col])]
+    if unscored:
+        scales = ", ".join(str(top) for top in RATING_SCALE_TOPS[:-1]) + f" or {RATING_SCALE_TOPS[-1]}"
+        st.caption(f"Not scored as ratings (answers aren't whole numbers on a {scales}-point scale): "
+                   + ", ".join(col.replace('_', ' ').title() for col in unscored))
+
+def likert_summary(df, cols, labels):
+    """Mean score, top-2-box, bottom-2-box and net score (top minus bottom) for every Likert column at once.
+
+    Answers are stacked into one (respondents x items) matrix of scale positions (-1 unanswered);
+    every score is then a single matrix product with the respondent weights. Returns a frame
+    indexed by label, sorted by top-2-box share.
+    """
+    codes, points, lowest = [], [], []
+    for col in cols:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            codes.append(df[col].cat.codes.to_numpy())
+            points.append(len(df[col].cat.categories))
+            lowest.append(1)
+        else:
+            low, high = rating_scale(df[col])
+            ratings = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+            codes.append(np.where(np.isnan(ratings), -1, np.nan_to_num(ratings) - low).astype(np.int64))
+            points.append(high - low + 1)
+            lowest.append(low)
+    codes = np.column_stack(codes)
+    points = np.array(points)
+    lowest = np.array(lowest)
+    answered = codes >= 0
+
+    weights = df[WEIGHT_COLUMN].to_numpy(dtype=float) if WEIGHT_COLUMN in df.columns else np.ones(len(df))
+    base = weights @ answered
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (weights @ np.where(answered, codes + lowest, 0)) / base # On each item's own scale
+        top_box = (weights @ (codes >= points - 2)) / base
+        bottom_box = (weights @ (answered & (codes <= 1))) / base
+    summary = pd.DataFrame({
+        'Base': base.round(2) if WEIGHT_COLUMN in df.columns else base.astype(int),
+        'Mean Score': mean,
+        'Scale Points': points,
+        'Top 2 Box': top_box,
+        'Bottom 2 Box': bottom_box,
+        'Net Score': top_box - bottom_box,
+    }, index=pd.Index(labels, name='Item'))
+    return summary[summary['Base'] > 0].sort_values('Top 2 Box', ascending=False)
+
+def likert_summary_chart(summary, label_col, title):
+    """Sorted top-2-box bars for a set of Likert items, labelled with mean scores, plus the score table."""
+    st.subheader(title)
+    if summary.empty:
+        st.info(f"No answered responses to plot for '{title}'.")
+        return
+    data_to_plot = summary.rename_axis(label_col).reset_index()
+    base = alt.Chart(data_to_plot).encode(y=alt.Y(label_col, sort=list(data_to_plot[label_col]), title=label_col))
+    bars = base.mark_bar().encode(
+        x=alt.X('Top 2 Box:Q', title='Top 2 Box', axis=alt.Axis(format='%'), scale=alt.Scale(domain=[0, 1])),
+        tooltip=[label_col, 'Base', alt.Tooltip('Mean Score:Q', format='.2f'), alt.Tooltip('Top 2 Box:Q', format='.1%'),
+                 alt.Tooltip('Bottom 2 Box:Q', format='.1%'), alt.Tooltip('Net Score:Q', format='+.1%')]
+    )
+    means = base.mark_text(align='left', dx=4).encode(x='Top 2 Box:Q', text=alt.Text('Mean Score:Q', format='.2f'))
+    st.altair_chart((bars + means).properties(title=title), use_container_width=True)
+    st.caption("Bars: share in the top two scale points. Labels: mean score. Net score = top 2 box minus bottom 2 box.")
+    st.dataframe(summary.style.format({'Mean Score': '{:.2f}', 'Top 2 Box': '{:.1%}', 'Bottom 2 Box': '{:.1%}',
+                                       'Net Score': '{:+.1%}'}), use_container_width=True)
+
+def share_chart(stats, p_values, label_col, title):
+    """Bar chart of 'Yes' shares with 95% confidence error bars; * marks a significant gap to the leader."""
+    st.subheader(title)
+    data_to_plot = stats[stats['Base'] > 0].rename_axis(label_col).reset_index()
+    if data_to_plot.empty:
+        st.info(f"No answered responses to plot for '{title}'.")
+        return
+    data_to_plot['Flag'] = np.where(data_to_plot['Differs From Leader'], '*', '')
+    base = alt.Chart(data_to_plot).encode(x=alt.X(label_col, sort='-y', title=label_col.replace('_', ' ').title()))
+    bars = base.mark_bar().encode(
+        y=alt.Y('Share:Q', title='Share Saying Yes', axis=alt.Axis(format='%')),
+        tooltip=[label_col, 'Yes Count', 'Base', alt.Tooltip('Share:Q', format='.1%'),
+                 alt.Tooltip('CI Low:Q', format='.1%'), alt.Tooltip('CI High:Q', format='.1%'), 'Differs From Leader']
+    )
+    error_bars = base.mark_rule(color='black').encode(y='CI Low:Q', y2='CI High:Q')
+    flags = base.mark_text(dy=-8, fontSize=16).encode(y='CI High:Q', text='Flag')
+    st.altair_chart((bars + error_bars + flags).properties(title=title), use_container_width=True)
+    st.caption("Error bars: 95% confidence intervals. * = significantly different from the leader (p < 0.05).")
+    with st.expander("Pairwise significance (p-values)"):
+        st.dataframe(p_values.style.format('{:.3f}', na_rep='–'), use_container_width=True)
+
+# --- Dataset Library (server-side brand and billboard files) ---
+# Admins drop CSVs into <library>/brands and <library>/billboards once; users then pick them
+# instead of re-uploading. Parsed frames are kept in <library>/.cache as Parquet files.
+DATASET_LIBRARY_DIR = os.environ.get(
+    "MULTIBRANDING_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
+LIBRARY_CACHE_DIR = os.path.join(DATASET_LIBRARY_DIR, ".cache")
+# Optional raking targets, e.g. {"gender": {"Male": 0.5, "Female": 0.5}, "region": {...}}
+WEIGHTING_TARGETS_FILE = os.path.join(DATASET_LIBRARY_DIR, "weighting_targets.json")
+# Optional administrative boundaries (GeoJSON Polygon/MultiPolygon features) for the billboard choropleth
+BOUNDARIES_FILE = os.path.join(DATASET_LIBRARY_DIR, "boundaries.geojson")
+# Feature properties tried, in order, for an area's name
+BOUNDARY_NAME_PROPERTIES = ['name', 'NAME', 'district', 'DISTRICT', 'shapeName', 'ADM2_EN', 'NAME_2', 'ADM1_EN', 'NAME_1']
+# Bump whenever ingestion (parsing or column naming) changes so stale cache files are ignored
+INGEST_CACHE_VERSION = 5
+
+# Keywords used to match library file names to brands (e.g. 'kfc_2024_wave2.csv' -> KFC)
+BRAND_LIBRARY_KEYWORDS = {
+    "AirAsia": "airasia",
+    "Cheetos": "cheetos",
+    "Mucilion": "mucilion",
+    "RTD Drinks": "rtd",
+    "Fried Chicken": "fried",
+    "Chocolate": "choco",
+    "Phones": "phone",
+    "Coca-Cola": "coca",
+    "Mudah": "mudah",
+    "KFC": "kfc",
+    "Panasonic": "panasonic",
+}
+# Product-category tabs: a file naming a brand as well ('kfc_fried_chicken.csv') belongs to the brand
+LIBRARY_CATEGORY_BRANDS = {"RTD Drinks", "Fried Chicken", "Chocolate", "Phones"}
+
+# --- Column specs (projection pushdown: only these columns are parsed for each tab) ---
+# Names are the preprocessed (snake_case) names; a column is kept if it matches any entry.
+DEMOGRAPHIC_COLUMNS = ['age_group', 'age', 'gender', 'monthly_income', 'household_income',
+                       'monthly_household_incom', 'location', 'city', 'region', 'marital_status',
+                       'children_under_5', 'please_select_the_age_group_based_on_your_age',
+                       'please_select_your_gender']
+
+BRAND_COLUMN_SPECS = {
+    "AirAsia": {"columns": ['seen_airline_ads_billboards', 'brand']},
+    "Cheetos": {"columns": ['seen_snack_ads', 'recall_snack_ads', 'ad_brand_snack', 'ad_slogan_snack',
+                            'preferred_snack_brand', 'likelihood_buy_cheetos', 'feelings_cheetos'],
+                "prefixes": ['familiar_']},
+    "Mucilion": {"columns": ['seen_ad', 'recall_ad', 'ad_brand', 'ad_message', 'purchased_brand'],
+                 "prefixes": ['aware_brand', 'likely_buy_']},
+    "RTD Drinks": {"prefixes": ['brand_aware_', 'brand_ad_aware_', 'hot_weather_purchase']},
+    "Fried Chicken": {"columns": ['recall_fried_chicken_ad', 'ad_fried_chicken_brand'],
+                      "prefixes": ['mind_', 'biggest_', 'tastiest_', 'next_buy_']},
+    "Chocolate": {"columns": ['seen_chocolate_ad'], "prefixes": ['ad_', 'prefer_', 'likely_buy_']},
+    "Phones": {"contains": ['current_phone_', 'next_purchase_', 'recall_ads']},
+    "Coca-Cola": {"prefixes": ['visit_', 'best_choice_', 'enjoy_', 'next_purchase',
+                               'how_often_do_you_use_the_following_media'],
+                  "contains": ['recall', 'advertisement']},
+    "Mudah": {"columns": ['property_automotive_browsing_frequency_past_month',
+                          'likelihood_to_purchase_via_mudah_next_6_months'],
+              "prefixes": ['ad_recall_', 'how_often_do_you_use__'],
+              "contains": ['used_platform'],
+              "suffixes": ['_r1', '_r2', '_r3', '_r4']},
+    "KFC": {"prefixes": ['how_agree_or_disagree_are_you_with_these_following_statements',
+                         'how_often_do_you_use_the_following_media'],
+            "contains": ['age', 'gender', 'income', 'eat_out', 'brand_you_visit_the_most',
+                         'important_to_you_when_choosing', 'recall_seeing_these_ads', 'advertisement_for']},
+    "Panasonic": {"columns": ['dyson', 'philips', 'laifen', 'khind', 'panasonic', 'dreame', 'xiaomi',
+                              'revlon', 'vidal_sassoon'],
+                  "suffixes": ['_likely_to_buy']},
+}
+# Respondent weight columns supplied with weighted panels (first one present is used)
+WEIGHT_COLUMNS = ['weight', 'weights', 'respondent_weight', 'weighting_factor', 'wt']
+
+# Every tab also keeps the demographic and weight columns
+for _spec in BRAND_COLUMN_SPECS.values():
+    _spec["columns"] = DEMOGRAPHIC_COLUMNS + WEIGHT_COLUMNS + _spec.get("columns", [])
+
+# ONE representative key column per brand for the Overall tab (preprocessed names)
+BRAND_REPRESENTATIVE_METRICS = {
+    'AirAsia': 'brand', # Example: Airline Brand Selected
+    'Cheetos': 'preferred_snack_brand', # Example: Preferred Snack Brand
+    'Mucilion': 'purchased_brand', # Example: Purchased Brand
+    'RTD Drinks': 'brand_aware_coca_cola', # Example: Awareness of Coke (Adjust if Coke is not the focus)
+    'Fried Chicken': 'brand_you_visit_the_most', # Example: Most Visited Brand (Check if this column exists after preprocess)
+    'Chocolate': 'prefer_kitkat', # Example: Preference for Kitkat (Adjust if Kitkat is not the focus)
+    'Phones': 'current_phone_samsung', # Example: Own Samsung Phone
+    'Coca-Cola': 'best_choice_softdrink', # Example: Favorite Soft Drink Brand (Check if this column exists after preprocess)
+    'Mudah': 'likelihood_to_purchase_via_mudah_next_6_months', # Example: Purchase Intent (Check if this column exists after preprocess)
+    'KFC': 'brand_you_visit_the_most', # Example: Most Visited Fast Food Brand (Check if this column exists after preprocess)
+    'Panasonic': 'panasonic', # Example: Own Panasonic Hairdryer (Check if this column exists after preprocess)
+}
+
+# Common demographic columns combined across brands in the Overall tab
+OVERALL_DEMOGRAPHIC_COLUMNS = ['age_group', 'gender', 'monthly_income',
+                               'household_income', 'location', 'city', 'region',
+                               'marital_status', 'children_under_5',
+                               'please_select_the_age_group_based_on_your_age', # Panasonic age col
+                               'please_select_your_gender'] # Panasonic gender col
+
+# Equivalent columns across brands, aligned under one canonical name for cross-brand comparison
+COLUMN_SYNONYMS = {
+    'age_group': ['age_group', 'please_select_the_age_group_based_on_your_age', 'age'],
+    'gender': ['gender', 'please_select_your_gender'],
+    'income': ['monthly_income', 'household_income', 'monthly_household_incom'],
+    'location': ['location', 'city'],
+    'region': ['region'],
+    'marital_status': ['marital_status'],
+    'children_under_5': ['children_under_5'],
+}
+
+# Category labels that mean the same thing in different surveys (keys are lowercased)
+CATEGORY_SYNONYMS = {
+    'm': 'Male', 'male': 'Male', 'man': 'Male', 'lelaki': 'Male',
+    'f': 'Female', 'female': 'Female', 'woman': 'Female', 'perempuan': 'Female', 'wanita': 'Female',
+    'y': 'Yes', 'yes': 'Yes', 'ya': 'Yes',
+    'n': 'No', 'no': 'No', 'tidak': 'No',
+}
+
+# Canonical brand names and the spellings respondents type for them; other close misspellings
+# are matched through a character trigram index (see canonical_brand)
+BRAND_ALIASES = {
+    'KFC': ['kfc', 'k.f.c', 'kentucky', 'kentucky fried chicken'],
+    "McDonald's": ["mcdonald's", 'mcdonalds', 'mcd', 'mc donalds', 'macdonalds', 'mekdi'],
+    'Texas Chicken': ['texas chicken', 'texas'],
+    'Marrybrown': ['marrybrown', 'marry brown'],
+    'Burger King': ['burger king'],
+    'Coca-Cola': ['coca-cola', 'coca cola', 'coke'],
+    'Pepsi': ['pepsi'],
+    '100Plus': ['100plus', '100 plus'],
+    'Milo': ['milo'],
+    'Nestum': ['nestum'],
+    'Mucilion': ['mucilion'],
+    'Cheetos': ['cheetos', 'cheeto'],
+    "Lay's": ["lay's", 'lays'],
+    'Pringles': ['pringles'],
+    'Mister Potato': ['mister potato', 'mr potato'],
+    'KitKat': ['kitkat', 'kit kat'],
+    'Cadbury': ['cadbury'],
+    'Samsung': ['samsung'],
+    'Apple': ['apple', 'iphone'],
+    'Xiaomi': ['xiaomi', 'redmi'],
+    'Dyson': ['dyson'],
+    'Philips': ['philips', 'phillips'],
+    'Panasonic': ['panasonic'],
+    'AirAsia': ['airasia', 'air asia'],
+    'Malaysia Airlines': ['malaysia airlines', 'mas'],
+}
+# Free-text brand-mention columns canonicalised at ingestion (matched like BRAND_COLUMN_SPECS entries)
+BRAND_MENTION_COLUMNS = {
+    "columns": ['preferred_snack_brand', 'ad_brand_snack', 'ad_brand', 'purchased_brand', 'brand',
+                'brand_you_visit_the_most', 'ad_fried_chicken_brand'],
+    "prefixes": ['mind_', 'biggest_', 'tastiest_', 'aware_brand', 'familiar_'],
+}
+# Smallest trigram (Dice) similarity for a fuzzy brand match
+BRAND_MATCH_THRESHOLD = 0.7
+
+# Likert scales (lowest to highest) encoded as ordered categoricals at ingestion, with the
+# other wordings respondents' surveys use for each point (keys are lowercased)
+LIKERT_SCALES = {
+    'agreement': ['Strongly Disagree', 'Disagree', 'Neutral', 'Agree', 'Strongly Agree'],
+    'likelihood': ['Very unlikely', 'Unlikely', 'Neutral', 'Likely', 'Very likely'],
+}
+LIKERT_SYNONYMS = {
+    'agreement': {'neither agree nor disagree': 'Neutral', 'somewhat disagree': 'Disagree', 'somewhat agree': 'Agree'},
+    'likelihood': {'neither likely nor unlikely': 'Neutral', 'somewhat unlikely': 'Unlikely', 'somewhat likely': 'Likely',
+                   'extremely unlikely': 'Very unlikely', 'extremely likely': 'Very likely'},
+}
+# Numeric rating columns (e.g. ad impact ratings) are scored on the smallest of these scales their answers
+# fit (1..5, 1..7 or 1..10; from 0 when anyone answered 0). Fewer distinct answers (0/1 flags) aren't ratings.
+RATING_SCALE_TOPS = (5, 7, 10)
+RATING_SCALE_MIN_DISTINCT = 3
+
+def overall_column_spec(brand_name):
+    """Columns the Overall tab needs from one brand: demographics, weights and its representative metric."""
+    synonym_cols = [col for synonyms in COLUMN_SYNONYMS.values() for col in synonyms]
+    return {"columns": OVERALL_DEMOGRAPHIC_COLUMNS + synonym_cols + WEIGHT_COLUMNS + [BRAND_REPRESENTATIVE_METRICS.get(brand_name, '')]}
+
+def column_spec_matches(name, spec):
+    """True if a preprocessed column name is requested by a column spec."""
+    return (name in spec.get("columns", ())
+            or any(name.startswith(prefix) for prefix in spec.get("prefixes", ()))
+            or any(name.endswith(suffix) for suffix in spec.get("suffixes", ()))
+            or any(sub in name for sub in spec.get("contains", ())))
+
+def union_column_spec(*specs):
+    """One spec requesting every column any of specs requests (None if one of them wants every column)."""
+    if any(spec is None for spec in specs):
+        return None
+    union = {}
+    for spec in specs:
+        for kind, values in spec.items():
+            union.setdefault(kind, [])
+            union[kind] += [value for value in values if value not in union[kind]]
+    return union
+
+@functools.lru_cache(maxsize=1)
+def _brand_ingest_specs():
+    """Column spec key -> union of every spec of the brand it belongs to (brand tab and Overall tab)."""
+    by_key = {}
+    for brand_name, brand_spec in BRAND_COLUMN_SPECS.items():
+        specs = (brand_spec, overall_column_spec(brand_name))
+        union = union_column_spec(*specs)
+        for spec in specs:
+            by_key[column_spec_key(spec)] = union
+    return by_key
+
+def ingest_column_spec(spec):
+    """Spec an uploaded file is parsed with: its brand's union spec, so every tab projects from one parse."""
+    if spec is None:
+        return None
+    return _brand_ingest_specs().get(column_spec_key(spec), spec)
+
+def column_spec_key(spec):
+    """Short stable digest of a column spec (None means all columns)."""
+    if spec is None:
+        return "all"
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+
+def list_dataset_library(library_dir=DATASET_LIBRARY_DIR):
+    """Returns the CSV paths available in the library, grouped into 'brands' and 'billboards'."""
+    library = {"brands": [], "billboards": []}
+    for kind in library:
+        kind_dir = os.path.join(library_dir, kind)
+        if os.path.isdir(kind_dir):
+            library[kind] = sorted(
+                os.path.join(kind_dir, name) for name in os.listdir(kind_dir)
+                if name.lower().endswith(".csv")
+            )
+    return library
+
+def library_cache_key(path):
+    """Builds a short key that changes whenever a library file is replaced or edited."""
+    stat = os.stat(path)
+    raw_key = f"{INGEST_CACHE_VERSION}|{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(raw_key.encode("utf-8")).hexdigest()[:16]
+
+def library_brand_for(path):
+    """Brand whose keyword appears in a library file name, or None.
+
+    When several keywords match, the most specific wins: a named brand over a product category,
+    then the longer keyword, then the one earlier in the name.
+    """
+    file_name = os.path.basename(path).lower()
+    matches = [(brand_name in LIBRARY_CATEGORY_BRANDS, -len(keyword), file_name.find(keyword), brand_name)
+               for brand_name, keyword in BRAND_LIBRARY_KEYWORDS.items() if keyword in file_name]
+    return min(matches)[-1] if matches else None
+
+def library_cache_paths(cache_key):
+    """(Parquet, pickle fallback) paths of a library file's on-disk cache entry."""
+    return (os.path.join(LIBRARY_CACHE_DIR, f"{cache_key}.parquet"),
+            os.path.join(LIBRARY_CACHE_DIR, f"{cache_key}.pkl"))
+
+def ingest_library_file(path, spec=None):
+    """Parses a library CSV once and keeps the preprocessed frame in the on-disk columnar cache.
+
+    The full frame is cached; a column spec then only reads the requested Parquet columns.
+    """
+    cache_key = library_cache_key(path)
+    parquet_path, pickle_path = library_cache_paths(cache_key)
+
+    if os.path.exists(parquet_path):
+        columns = None
+        if spec is not None:
+            import pyarrow.parquet as pq # Installed with streamlit
+            columns = [name for name in pq.read_schema(parquet_path).names if column_spec_matches(name, spec)] or None
+        df = pd.read_parquet(parquet_path, columns=columns)
+        df.attrs['parse_engine'] = 'cache'
+    elif os.path.exists(pickle_path):
+        df = select_spec_columns(pd.read_pickle(pickle_path), spec)
+        df.attrs['parse_engine'] = 'cache'
+    else:
+        df = read_csv_projected(path)
+        os.makedirs(LIBRARY_CACHE_DIR, exist_ok=True)
+        # Unique temp name so the warm-up thread and a user session can ingest the same file safely
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            df.to_parquet(parquet_path + tmp_suffix, index=False)
+            os.replace(parquet_path + tmp_suffix, parquet_path)
+        except Exception:
+            # Mixed-type object columns can't always be written as Parquet, fall back to pickle
+            if os.path.exists(parquet_path + tmp_suffix):
+                os.remove(parquet_path + tmp_suffix)
+            df.to_pickle(pickle_path + tmp_suffix)
+            os.replace(pickle_path + tmp_suffix, pickle_path)
+        df = select_spec_columns(df, spec)
+
+    df.attrs['fingerprint'] = f"{cache_key}-{column_spec_key(spec)}"
+    return df
+
+def select_spec_columns(df, spec):
+    """Keeps the columns requested by a spec (all columns if nothing matches)."""
+    if spec is None:
+        return df
+    selected = [col for col in df.columns if column_spec_matches(col, spec)]
+    return df[selected] if selected else df
+
+# Multi-threaded Arrow CSV parsing when pyarrow is installed (it ships with streamlit)
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# Bytes read from the start of a file to detect its encoding, delimiter and header row
+SNIFF_BYTES = 64 * 1024
+SNIFF_DELIMITERS = ",;\t|"
+
+def _decode_sample(sample):
+    """Detects the encoding of a byte sample and returns (encoding, text)."""
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig", sample[len(codecs.BOM_UTF8):].decode("utf-8", errors="ignore")
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16", sample[:len(sample) // 2 * 2].decode("utf-16", errors="ignore")
+    # UTF-16 without a BOM: ASCII text leaves every other byte zero
+    if len(sample) >= 4 and sample[1::2].count(0) > len(sample) // 4:
+        return "utf-16-le", sample[:len(sample) // 2 * 2].decode("utf-16-le", errors="ignore")
+    if len(sample) >= 4 and sample[0::2].count(0) > len(sample) // 4:
+        return "utf-16-be", sample[:len(sample) // 2 * 2].decode("utf-16-be", errors="ignore")
+    try:
+        # A full-size sample may end inside a multi-byte character; the incremental decoder holds back
+        # an incomplete lead sequence there. A shorter sample is the whole file, so it must decode fully.
+        return "utf-8", codecs.getincrementaldecoder("utf-8")().decode(sample, final=len(sample) < SNIFF_BYTES)
+    except UnicodeDecodeError:
+        return "cp1252", sample.decode("cp1252", errors="replace")
+
+def sniff_csv_format(sample):
+    """Detects encoding, delimiter and header row from the first bytes of a CSV.
+
+    Returns read_csv keyword arguments: encoding, sep and skiprows (preamble lines before the
+    header, i.e. lines before the first one with the usual number of fields).
+    """
+    encoding, text = _decode_sample(sample)
+    lines = text.splitlines()[:50]
+    if len(sample) >= SNIFF_BYTES and len(lines) > 1:
+        lines = lines[:-1] # The last line of a truncated sample may be cut off
+    non_empty = [line for line in lines if line.strip()]
+
+    sep = ","
+    if non_empty:
+        try:
+            sep = csv.Sniffer().sniff("\n".join(non_empty[:20]), delimiters=SNIFF_DELIMITERS).delimiter
+        except csv.Error:
+            # Fall back to the candidate that splits the most lines into the most fields
+            sep = max(SNIFF_DELIMITERS, key=lambda d: sum(line.count(d) for line in non_empty[:20]))
+            if not any(sep in line for line in non_empty):
+                sep = ","
+
+    skiprows = 0
+    if non_empty:
+        field_counts = [len(next(csv.reader([line], delimiter=sep))) if line.strip() else 0 for line in lines]
+        # Most common field count (ties go to the wider row, preambles are usually narrow)
+        typical = max(collections.Counter(count for count in field_counts if count).items(),
+                      key=lambda item: (item[1], item[0]))[0]
+        if typical > 1:
+            skiprows = next(i for i, count in enumerate(field_counts) if count == typical)
+
+    return {"encoding": encoding, "sep": sep, "skiprows": skiprows}
+
+def read_csv_fast(buffer, usecols=None, **read_kwargs):
+    """Reads a CSV with the pyarrow engine, falling back to pandas' C parser.
+
+    Returns (DataFrame, engine name). Malformed files that pyarrow rejects are re-read with
+    the C parser, so its error (the one users have always seen) is what gets raised.
+    usecols must be column names here; the pyarrow engine doesn't take positions.
+    """
+    if PYARROW_AVAILABLE:
+        try:
+            return pd.read_csv(buffer, engine="pyarrow", usecols=usecols, **read_kwargs), "pyarrow"
+        except Exception:
+            if hasattr(buffer, "seek"):
+                buffer.seek(0)
+    return pd.read_csv(buffer, usecols=usecols, **read_kwargs), "c"
+
+def read_csv_projected(buffer, spec=None):
+    """Reads a CSV parsing only the columns a spec asks for, with snake_case names from normalise_column_names().
+
+    The engine that parsed the file is recorded in df.attrs['parse_engine'].
+    """
+    if not hasattr(buffer, "seek"):
+        with open(buffer, "rb") as f:
+            return read_csv_projected(f, spec)
+
+    # Detect encoding, delimiter and header row from the first few KB so the full parse
+    # succeeds first time (no failed full read followed by a retry)
+    csv_format = sniff_csv_format(buffer.read(SNIFF_BYTES))
+    buffer.seek(0)
+
+    # Name columns from the header row as pandas' C parser sees it (duplicates mangled to 'q.1'),
+    # so every engine and every projection produces the same snake_case names
+    header = pd.read_csv(buffer, nrows=0, **csv_format)
+    buffer.seek(0)
+    raw_names = [str(col) for col in header.columns]
+    names = normalise_column_names(tuple(raw_names))
+    keep = list(range(len(names)))
+    if spec is not None:
+        keep = [i for i, name in enumerate(names) if column_spec_matches(name, spec)] or keep
+
+    # Mangled duplicate names aren't in the file, so pyarrow rejects them and the C parser takes over
+    usecols = [raw_names[i] for i in keep] if len(keep) < len(names) else None
+    df, engine = read_csv_fast(buffer, usecols=usecols, **csv_format)
+    if df.empty:
+        return pd.DataFrame()
+    df.columns = [names[i] for i in keep]
+    canonicalise_brand_columns(df)
+    encode_likert_columns(df)
+    df.attrs['parse_engine'] = engine
+    df.attrs['csv_format'] = csv_format
+    return df
+
+def parse_engine_label(df):
+    """Human-readable note on how a loaded frame was parsed."""
+    engine = df.attrs.get('parse_engine', 'c')
+    label = {
+        'pyarrow': "pyarrow engine (multi-threaded)",
+        'c': "pandas C engine",
+        'cache': "dataset library cache",
+    }.get(engine, engine)
+    # Mention anything the sniffer detected that isn't plain comma-separated UTF-8
+    csv_format = df.attrs.get('csv_format') or {}
+    details = []
+    if csv_format.get('encoding', 'utf-8') != 'utf-8':
+        details.append(csv_format['encoding'])
+    if csv_format.get('sep', ',') != ',':
+        details.append(f"'{csv_format['sep']}'-delimited".replace("'\t'", "tab"))
+    if csv_format.get('skiprows'):
+        details.append(f"header on line {csv_format['skiprows'] + 1}")
+    return f"{label} ({', '.join(details)})" if details else label
+
+@st.cache_data(show_spinner=False, max_entries=DATASET_CACHE_MAX_ENTRIES)
+def load_library_csv(path, cache_key, spec=None):
+    """Loads a library dataset (cache_key invalidates the entry when the file changes)."""
+    return ingest_library_file(path, spec)
+
+@st.cache_data(show_spinner=False, max_entries=DATASET_CACHE_MAX_ENTRIES)
+def parse_uploaded_csv(file_bytes, file_name, parse_spec=None):
+    """Parses and preprocesses an uploaded CSV once per file and ingest spec (see ingest_column_spec)."""
+    return read_csv_projected(io.BytesIO(file_bytes), parse_spec)
+
+@st.cache_data(show_spinner=False, max_entries=DATASET_CACHE_MAX_ENTRIES)
+def load_uploaded_csv(file_bytes, file_name, spec=None):
+    """An uploaded CSV's preprocessed frame with a column spec's columns, keyed on its content and spec.
+
+    The file is parsed with the union of its brand's specs and projected from there, so the brand
+    tab, the Overall tab and the segment filter don't each parse it again.
+    """
+    df = select_spec_columns(parse_uploaded_csv(file_bytes, file_name, ingest_column_spec(spec)), spec)
+    df.attrs['fingerprint'] = f"{hashlib.sha1(file_bytes).hexdigest()[:16]}-{column_spec_key(spec)}"
+    return df
+
+def load_dataset(source, spec=None):
+    """Returns the preprocessed DataFrame for an uploaded file or a library file path.
+
+    spec (see BRAND_COLUMN_SPECS) limits parsing to the columns a tab needs; None loads all.
+    """
+    if isinstance(source, str):
+        return load_library_csv(source, library_cache_key(source), spec)
+    return load_uploaded_csv(source.getvalue(), source.name, spec)
+
+def dataset_display_name(source):
+    """File name of an uploaded file or library path, for messages and 'source_file'."""
+    return os.path.basename(source) if isinstance(source, str) else source.name
+
+def dataset_fingerprint(df):
+    """Returns the content fingerprint stored on a loaded frame (hashing it once if missing)."""
+    fingerprint = df.attrs.get('fingerprint')
+    if fingerprint is None:
+        row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        fingerprint = hashlib.sha1(row_hashes.tobytes() + "|".join(df.columns).encode("utf-8")).hexdigest()[:16]
+        df.attrs['fingerprint'] = fingerprint
+    return fingerprint
+
+# --- Value-count index (shared by every chart section) ---
+@st.cache_data(show_spinner=False, max_entries=COLUMN_CACHE_MAX_ENTRIES)
+def _cached_value_counts(fingerprint, col, _series, _weights=None):
+    """Counts a column once per dataset; keyed on the dataset fingerprint, not the data."""
+    # Count raw values first (fast hashing), then fold the few unique labels into stripped strings
+    if _weights is None:
+        raw_counts = _series.value_counts(dropna=False, sort=False)
+        raw_counts = raw_counts[raw_counts > 0] # Likert categoricals also list unused scale points
+    else:
+        raw_counts = _weights.groupby(_series, dropna=False, sort=False).sum()
+    labels = ['nan' if pd.isna(value) else str(value).strip() for value in raw_counts.index]
+    counts = raw_counts.groupby(pd.Index(labels, dtype=object), sort=False).sum().sort_values(ascending=False)
+    if _weights is not None:
+        counts = counts.round(2)
+    counts.index.name = col
+    counts.name = 'count'
+    return counts
+
+def count_values(df, col):
+    """Value counts of a column as stripped strings ('nan' for missing), sorted by count.
+
+    Weighted frames (see apply_weighting) sum respondent weights instead of counting rows.
+    """
+    weights = df[WEIGHT_COLUMN] if WEIGHT_COLUMN in df.columns else None
+    return _cached_value_counts(dataset_fingerprint(df), col, df[col], weights)
+
+@st.cache_data(show_spinner=False, max_entries=COLUMN_CACHE_MAX_ENTRIES)
+def _cached_block_counts(fingerprint, cols, _answers, _weights=None):
+    """Counts every column of a block at once; keyed on the dataset fingerprint and the column tuple."""
+    # Factorise all cells together, fold the few unique labels into stripped strings, then one bincount
+    # over (column, label) codes instead of melting rows x columns Python strings
+    codes, uniques = pd.factorize(_answers.to_numpy().ravel(), use_na_sentinel=True)
+    # The trailing 'nan' label is also where the missing-value sentinel (-1) lands
+    labels = ['nan' if pd.isna(value) else str(value).strip() for value in uniques] + ['nan']
+    label_codes, label_names = pd.factorize(pd.Index(labels, dtype=object))
+    n_labels = len(label_names)
+    cells = label_codes[codes].reshape(_answers.shape) + n_labels * np.arange(len(cols))
+    weights = None if _weights is None else np.repeat(_weights.to_numpy(dtype=float), len(cols))
+    counts = np.bincount(cells.ravel(), weights=weights, minlength=n_labels * len(cols))
+    counts = pd.Series(counts, index=pd.MultiIndex.from_product([list(cols), list(label_names)], names=['column', 'answer']),
+                       name='count')
+    counts = counts[counts > 0]
+    return counts.round(2) if _weights is not None else counts.astype(np.int64)
+
+def count_block_values(df, cols, drop=('nan',)):
+    """Answer counts per column for a block of columns, as a long (column, answer, count) frame.
+
+    Answers are stripped strings like count_values; labels in drop (compared lower-cased) are left
+    out. Weighted frames sum respondent weights.
+    """
+    weights = df[WEIGHT_COLUMN] if WEIGHT_COLUMN in df.columns else None
+    counts = _cached_block_counts(dataset_fingerprint(df), tuple(cols), df[list(cols)], weights).reset_index()
+    return counts[~counts['answer'].str.lower().isin(drop)].reset_index(drop=True)
+
+def count_block_mentions(df, cols, drop=('nan',)):
+    """Mentions of each answer across a block of columns, sorted by count (like count_values)."""
+    counts = count_block_values(df, cols, drop).groupby('answer', sort=False)['count'].sum().sort_values(ascending=False)
+    counts.name = 'count'
+    return counts
+
+# --- Billboard spatial index ---
+class BillboardSpatialIndex:
+    """Uniform latitude/longitude grid over billboard positions for bounds and radius queries."""
+
+    def __init__(self, lat, lon, cell_deg=0.01):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.cell_deg = cell_deg
+        self.cell_y = np.floor(self.lat / cell_deg).astype(np.int64)
+        self.cell_x = np.floor(self.lon / cell_deg).astype(np.int64)
+        keys = self._cell_keys(self.cell_y, self.cell_x)
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+        if len(self.lat):
+            self.bounds = [[float(self.lat.min()), float(self.lon.min())],
+                           [float(self.lat.max()), float(self.lon.max())]]
+        else:
+            self.bounds = None
+
+    @staticmethod
+    def _cell_keys(cell_y, cell_x):
+        # Pack both cell coordinates into one int64 so each grid cell is a contiguous sorted run
+        return (cell_y << 32) + (cell_x & 0xFFFFFFFF)
+
+    def cell_members(self, cell_y, cell_x):
+        """Row positions of the billboards inside one grid cell."""
+        key = self._cell_keys(np.int64(cell_y), np.int64(cell_x))
+        start, stop = np.searchsorted(self.sorted_keys, [key, key + 1])
+        return self.order[start:stop]
+
+    def query_radius(self, lat, lon, radius_m):
+        """Row positions of the billboards within radius_m metres of a point."""
+        reach_cells = int(np.ceil(radius_m / (111_320.0 * self.cell_deg)))
+        cy, cx = int(np.floor(lat / self.cell_deg)), int(np.floor(lon / self.cell_deg))
+        candidates = np.concatenate([
+            self.cell_members(cy + dy, cx + dx)
+            for dy in range(-reach_cells, reach_cells + 1)
+            for dx in range(-reach_cells, reach_cells + 1)
+        ])
+        distances = haversine_m(lat, lon, self.lat[candidates], self.lon[candidates])
+        return np.sort(candidates[distances <= radius_m])
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres (vectorised over NumPy arrays)."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6_371_000.0 * np.arcsin(np.sqrt(a))
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def billboard_spatial_index(fingerprint, _lat, _lon):
+    """Builds the spatial index once per merged billboard dataset."""
+    return BillboardSpatialIndex(_lat, _lon)
+
+# --- Billboard merge (shared by the Billboard column and the cache warm-up) ---
+def billboard_merge_key(frames):
+    """Fingerprint of a merged billboard selection, built from its per-file fingerprints."""
+    parts = [f"{dataset_fingerprint(df)}:{df['source_file'].iat[0] if len(df) else ''}" for df in frames]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def merge_billboard_frames(merge_key, _frames):
+    """Concatenates billboard files and cleans coordinates, views, reach and reach %."""
+    merged_billboard_df = pd.concat(_frames, ignore_index=True, sort=False)
+
+    # --- Billboard Data Cleaning (after concat) ---
+    # Use preprocessed column names (lowercase, snake_case)
+    lat_col = 'latitude'
+    lon_col = 'longitude'
+    views_col = 'potential_views'
+    reach_col = 'reach'
+
+    if lat_col in merged_billboard_df.columns and lon_col in merged_billboard_df.columns:
+        merged_billboard_df[lat_col] = pd.to_numeric(merged_billboard_df[lat_col], errors='coerce')
+        merged_billboard_df[lon_col] = pd.to_numeric(merged_billboard_df[lon_col], errors='coerce')
+        # Filter rows with invalid lat/lon early
+        merged_billboard_df = merged_billboard_df.dropna(subset=[lat_col, lon_col]).reset_index(drop=True)
+
+        if views_col in merged_billboard_df.columns and reach_col in merged_billboard_df.columns:
+            # Custom cleaning function for potential thousands separators
+            def clean_numeric_string_billboard(val):
+                if pd.isna(val):
+                    return pd.NA
+                # Handle numbers stored as strings like "1,234"
+                return str(val).replace(',', '').replace(' ', '').strip() or pd.NA
+
+            # Apply cleaning to the relevant columns *after* preprocessing
+            merged_billboard_df[views_col] = pd.to_numeric(merged_billboard_df[views_col].apply(clean_numeric_string_billboard), errors='coerce')
+            merged_billboard_df[reach_col] = pd.to_numeric(merged_billboard_df[reach_col].apply(clean_numeric_string_billboard), errors='coerce')
+
+            merged_billboard_df['reach_pct'] = np.nan # New column for percentage (float, so it stays numeric)
+            valid_mask = merged_billboard_df[views_col].notna() & (merged_billboard_df[views_col] != 0) & merged_billboard_df[reach_col].notna()
+            merged_billboard_df.loc[valid_mask, 'reach_pct'] = (merged_billboard_df.loc[valid_mask, reach_col] / merged_billboard_df.loc[valid_mask, views_col]) * 100
+            merged_billboard_df['reach_pct'] = merged_billboard_df['reach_pct'].clip(upper=100) # Cap percentage at 100%
+
+    merged_billboard_df.attrs['fingerprint'] = merge_key
+    return merged_billboard_df
+
+# --- Billboard near-duplicate detection (same board listed by several vendor files) ---
+# Rows within BILLBOARD_DEDUP_RADIUS_M of each other are one board; rows whose normalised
+# reference_id matches are one board if within BILLBOARD_REF_MATCH_RADIUS_M (vendors' coordinates drift)
+BILLBOARD_DEDUP_RADIUS_M = 25
+BILLBOARD_REF_MATCH_RADIUS_M = 250
+# Reference IDs vendors use for "no ID"; like all-zero IDs they never match another board
+_PLACEHOLDER_REFERENCE_IDS = {re.sub(r'[^0-9A-Z]', '', label.upper())
+                              for label in _MISSING_LABELS | {'-', 'null', 'nil', 'tbc', 'tba', 'unknown', 'no id'}}
+
+def normalise_reference_ids(values):
+    """Comparable form of reference IDs ('bb-0012 ' and 'BB12' -> 'BB12'); missing, placeholder
+    ('N/A', 'none', 'TBC') and all-zero IDs become NaN.
+
+    Each unique ID is normalised once, with vectorised string operations.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    keys = (pd.Series(uniques, dtype=str).str.upper()
+            .str.replace(r'[^0-9A-Z]', '', regex=True)
+            .str.replace(r'(?<![0-9])0+(?=[0-9])', '', regex=True)) # Leading zeros of every number
+    keys = keys.mask(keys.isin(_PLACEHOLDER_REFERENCE_IDS) | (keys == '0'))
+    return pd.Series(np.append(keys.to_numpy(dtype=object), np.nan)[codes], index=values.index) # code -1 picks the trailing NaN
+
+def _radius_pairs(lat, lon, radius_m):
+    """Index pairs (i < j) of points within radius_m, from a spatial hash with cells at least radius_m wide."""
+    cell_lat = radius_m / 111_320.0
+    # Longitude degrees shrink towards the poles; widen the cells for the highest latitude present
+    cell_lon = cell_lat / max(np.cos(np.radians(np.abs(lat).max())), 1e-6) if len(lat) else cell_lat
+    cell_y = np.floor(lat / cell_lat).astype(np.int64)
+    cell_x = np.floor(lon / cell_lon).astype(np.int64)
+    keys = BillboardSpatialIndex._cell_keys(cell_y, cell_x)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    cell_y, cell_x = cell_y[order], cell_x[order] # Queries in key order keep the binary searches cache-friendly
+    pairs_i, pairs_j = [], []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            # Each point against every point of one neighbouring cell (a contiguous run of the sorted keys)
+            neighbour_keys = BillboardSpatialIndex._cell_keys(cell_y + dy, cell_x + dx)
+            starts = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+            counts = np.searchsorted(sorted_keys, neighbour_keys, side='right') - starts
+            i = np.repeat(order, counts)
+            j = order[np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())]
+            keep = i < j
+            i, j = i[keep], j[keep]
+            close = haversine_m(lat[i], lon[i], lat[j], lon[j]) <= radius_m
+            pairs_i.append(i[close])
+            pairs_j.append(j[close])
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+def _connected_components(n, i, j):
+    """Component label (smallest member position) of every node of the graph with edges i-j."""
+    labels = np.arange(n)
+    while True:
+        # Hook each edge's larger root onto the smaller one, then compress paths by pointer jumping
+        low = np.minimum(labels[i], labels[j])
+        hooked = labels.copy()
+        np.minimum.at(hooked, labels[i], low)
+        np.minimum.at(hooked, labels[j], low)
+        while not np.array_equal(hooked, hooked[hooked]):
+            hooked = hooked[hooked]
+        if np.array_equal(hooked, labels):
+            return labels
+        labels = hooked
+
+def billboard_duplicate_clusters(df, radius_m=BILLBOARD_DEDUP_RADIUS_M, ref_radius_m=BILLBOARD_REF_MATCH_RADIUS_M):
+    """Cluster label per billboard row: rows of the same physical board share the label of the first of them."""
+    lat = df['latitude'].to_numpy(dtype=float)
+    lon = df['longitude'].to_numpy(dtype=float)
+    i, j = _radius_pairs(lat, lon, radius_m)
+    if 'reference_id' in df.columns:
+        # Pairs within ref_radius_m that share a key, found spatially: the work is bounded by how many
+        # boards lie close together, not by how many rows repeat an ID
+        key_codes, _ = pd.factorize(normalise_reference_ids(df['reference_id']), use_na_sentinel=True)
+        keyed = np.flatnonzero(key_codes >= 0)
+        ref_i, ref_j = _radius_pairs(lat[keyed], lon[keyed], ref_radius_m)
+        same_key = key_codes[keyed[ref_i]] == key_codes[keyed[ref_j]]
+        i, j = np.concatenate([i, keyed[ref_i[same_key]]]), np.concatenate([j, keyed[ref_j[same_key]]])
+    return _connected_components(len(df), i, j)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def dedupe_billboards(fingerprint, radius_m, _df):
+    """Keeps one row per physical billboard (the first listed) and reports the merged clusters.
+
+    Returns (deduplicated frame with 'duplicate_rows' and 'duplicate_sources' columns, clusters
+    table with one row per board listed more than once). The frame gets its own fingerprint.
+    """
+    if 'latitude' not in _df.columns or 'longitude' not in _df.columns or _df.empty:
+        return _df, pd.DataFrame()
+    labels = billboard_duplicate_clusters(_df, radius_m, max(radius_m, BILLBOARD_REF_MATCH_RADIUS_M))
+    cluster_rows = np.bincount(labels, minlength=len(_df))
+    # Source files of each board as a bitmask over the (at most 20) merged files, ORed per cluster
+    source_codes, source_names = pd.factorize(_df['source_file'].astype(str) if 'source_file' in _df.columns
+                                              else pd.Series('', index=_df.index))
+    source_bits = np.zeros(len(_df), dtype=object if len(source_names) > 62 else np.int64)
+    np.bitwise_or.at(source_bits, labels, np.left_shift(1, source_codes).astype(source_bits.dtype))
+
+    keep = labels == np.arange(len(_df))
+    deduped_df = _df[keep].reset_index(drop=True)
+    deduped_df['duplicate_rows'] = cluster_rows[keep]
+    bit_codes, bit_masks = pd.factorize(source_bits[keep])
+    mask_names = [", ".join(sorted(name for code, name in enumerate(source_names) if int(mask) >> code & 1)) for mask in bit_masks]
+    deduped_df['duplicate_sources'] = np.array(mask_names, dtype=object)[bit_codes]
+    deduped_df.attrs = {**_df.attrs, 'fingerprint': hashlib.sha1(
+        f"{fingerprint}|dedupe|{radius_m}".encode("utf-8")).hexdigest()[:16]}
+
+    clusters = deduped_df[deduped_df['duplicate_rows'] > 1]
+    clusters = clusters[[col for col in ['reference_id', 'location', 'latitude', 'longitude', 'duplicate_rows', 'duplicate_sources']
+                         if col in clusters.columns]].sort_values('duplicate_rows', ascending=False, kind='stable')
+    return deduped_df, clusters.reset_index(drop=True)
+
+# --- Administrative boundaries (offline point-in-polygon join of billboards to areas) ---
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_boundaries(path, cache_key):
+    """Polygon features of a GeoJSON boundary file, each named in properties['boundary_name'] (cache_key tracks file changes)."""
+    with open(path, encoding='utf-8') as f:
+        geojson = json.load(f)
+    features = [feature for feature in geojson.get('features', [])
+                if (feature.get('geometry') or {}).get('type') in ('Polygon', 'MultiPolygon')]
+    for number, feature in enumerate(features, start=1):
+        properties = feature['properties'] = feature.get('properties') or {}
+        name = next((properties[key] for key in BOUNDARY_NAME_PROPERTIES if properties.get(key)), f"Area {number}")
+        properties['boundary_name'] = str(name)
+    return {'type': 'FeatureCollection', 'features': features}
+
+def boundaries_cache_key(path=BOUNDARIES_FILE):
+    """Changes whenever the boundary file is replaced or edited ('' if there is none)."""
+    if not os.path.exists(path):
+        return ''
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+class BoundaryIndex:
+    """Edges and bounding boxes of every boundary polygon, for vectorised point-in-polygon joins.
+
+    Each polygon (every part of a MultiPolygon) keeps its rings' edges as flat arrays. Points are
+    prefiltered by the polygon's bounding box (a longitude range of the sorted points, then a
+    latitude mask) and tested with the even-odd rule over all its edges at once, so holes work.
+    """
+
+    # Points x edges tested per block, to bound the size of the crossing matrix
+    BLOCK_CELLS = 4_000_000
+
+    def __init__(self, geojson):
+        self.names = [feature['properties']['boundary_name'] for feature in geojson['features']]
+        self.parts = []
+        for index, feature in enumerate(geojson['features']):
+            geometry = feature['geometry']
+            polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+            for rings in polygons:
+                rings = [np.asarray(ring, dtype=float)[:, :2] for ring in rings if len(ring) >= 3]
+                if not rings:
+                    continue
+                starts = np.concatenate(rings)
+                ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+                bbox = (*rings[0].min(axis=0), *rings[0].max(axis=0)) # (min lon, min lat, max lon, max lat) of the outer ring
+                self.parts.append((index, bbox, starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]))
+
+    @classmethod
+    def _contains(cls, px, py, x1, y1, x2, y2):
+        """Even-odd test of points against one polygon's edges (a ray cast towards +longitude)."""
+        inside = np.zeros(len(px), dtype=bool)
+        block = max(1, cls.BLOCK_CELLS // max(len(x1), 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for start in range(0, len(px), block):
+                bx, by = px[start:start + block, None], py[start:start + block, None]
+                straddles = (y1 > by) != (y2 > by)
+                crosses = straddles & (bx < (x2 - x1) * (by - y1) / (y2 - y1) + x1)
+                inside[start:start + block] = np.count_nonzero(crosses, axis=1) % 2 == 1
+        return inside
+
+    def assign(self, lat, lon):
+        """Index of the boundary containing each point, or -1; where areas overlap the first listed wins."""
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        area = np.full(len(lat), -1, dtype=np.int64)
+        order = np.argsort(lon, kind='stable')
+        sorted_lon = lon[order]
+        for index, (min_lon, min_lat, max_lon, max_lat), x1, y1, x2, y2 in self.parts:
+            candidates = order[np.searchsorted(sorted_lon, min_lon, side='left'):np.searchsorted(sorted_lon, max_lon, side='right')]
+            candidates = candidates[(lat[candidates] >= min_lat) & (lat[candidates] <= max_lat) & (area[candidates] < 0)]
+            if len(candidates):
+                inside = self._contains(lon[candidates], lat[candidates], x1, y1, x2, y2)
+                area[candidates[inside]] = index
+        return area
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def boundary_index(boundaries_key, _geojson):
+    """Builds the polygon edge arrays once per boundary file."""
+    return BoundaryIndex(_geojson)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def billboard_area_summary(fingerprint, boundaries_key, _df, _geojson):
+    """Billboards, total potential views and mean reach % per boundary area (every area listed).
+
+    The table's attrs['outside'] counts billboards that fall in no area.
+    """
+    index = boundary_index(boundaries_key, _geojson)
+    feature = index.assign(_df['latitude'], _df['longitude'])
+    inside = feature >= 0
+    # Features named the same (e.g. the parts of one district split across features) are one area,
+    # so every figure is taken over the billboards of all of its features together
+    name_codes, names = pd.factorize(pd.Index(index.names))
+    area = name_codes[feature[inside]]
+    n_areas = len(names)
+    billboards = np.bincount(area, minlength=n_areas)
+    summary = pd.DataFrame({'Area': names, 'Billboards': billboards})
+    if 'potential_views' in _df.columns:
+        views = pd.to_numeric(_df['potential_views'], errors='coerce').fillna(0).to_numpy(dtype=float)[inside]
+        summary['Total Potential Views'] = np.bincount(area, weights=views, minlength=n_areas)
+    if 'reach_pct' in _df.columns:
+        reach_pct = pd.to_numeric(_df['reach_pct'], errors='coerce').to_numpy(dtype=float)[inside]
+        valid = ~np.isnan(reach_pct)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            summary['Avg. Reach (%)'] = (np.bincount(area[valid], weights=reach_pct[valid], minlength=n_areas)
+                                         / np.bincount(area[valid], minlength=n_areas)).round(2)
+    summary = summary.sort_values('Billboards', ascending=False, kind='stable').reset_index(drop=True)
+    summary.attrs['outside'] = int((~inside).sum())
+    return summary
+
+# --- Billboard selection optimiser (budgeted reach, penalising billboards that share an audience) ---
+OPTIMISER_BUDGET_TYPES = ["Number of billboards", "Total cost"]
+OPTIMISER_OVERLAP_RADIUS_M = 500 # Billboards closer than this share part of their audience
+OPTIMISER_OVERLAP_SHARE = 0.5 # Share of the smaller reach two billboards at the same spot have in common
+
+def billboard_costs(df, cost_col='cost'):
+    """Numeric cost per billboard ('1,234' strings cleaned; NaN where missing or unparseable)."""
+    if cost_col not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    return pd.to_numeric(df[cost_col].astype(str).str.replace(r'[,\s]', '', regex=True), errors='coerce')
+
+def select_billboards(reach, lat, lon, budget, costs=None,
+                      radius_m=OPTIMISER_OVERLAP_RADIUS_M, overlap_share=OPTIMISER_OVERLAP_SHARE):
+    """Lazy-greedy choice of billboards maximising net reach within a count budget (or a cost budget).
+
+    Net reach is the sum of the chosen billboards' reach minus, for every chosen pair within radius_m,
+    overlap_share x (1 - distance / radius_m) x the smaller of the two reaches. Penalties only grow
+    as the selection grows, so a billboard's marginal gain never rises (the objective is submodular):
+    the heap keeps stale gains as upper bounds and only the top one is re-evaluated. With costs the
+    greedy ranks gain per unit cost and skips billboards that no longer fit the remaining budget.
+
+    Returns the chosen positions in pick order and each pick's marginal net reach.
+    """
+    n = len(reach)
+    costs = np.ones(n) if costs is None else np.asarray(costs, dtype=float)
+    if radius_m > 0 and overlap_share > 0:
+        i, j = _radius_pairs(lat, lon, radius_m)
+        weights = overlap_share * (1 - haversine_m(lat[i], lon[i], lat[j], lon[j]) / radius_m) * np.minimum(reach[i], reach[j])
+    else:
+        i = j = np.empty(0, dtype=np.int64)
+        weights = np.empty(0)
+    # Both directions of every pair, grouped by billboard, so a pick updates its neighbours with one slice
+    sources = np.concatenate([i, j])
+    order = np.argsort(sources, kind='stable')
+    neighbours = np.concatenate([j, i])[order]
+    neighbour_weights = np.concatenate([weights, weights])[order]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=n))])
+
+    penalty = np.zeros(n)
+    eligible = np.flatnonzero((reach > 0) & (costs > 0) & (costs <= budget)) # Missing costs compare False
+    heap = [(-r / c, k) for r, c, k in zip(reach[eligible].tolist(), costs[eligible].tolist(), eligible.tolist())]
+    heapq.heapify(heap)
+    remaining = float(budget)
+    chosen, gains = [], []
+    while heap:
+        _, k = heapq.heappop(heap)
+        if costs[k] > remaining:
+            continue # The budget only shrinks, so it will never fit
+        gain = reach[k] - penalty[k]
+        if gain <= 0:
+            continue
+        ratio = gain / costs[k]
+        if heap and ratio < -heap[0][0]:
+            heapq.heappush(heap, (-ratio, k)) # Stale bound; another candidate may now be better
+            continue
+        chosen.append(k)
+        gains.append(gain)
+        remaining -= costs[k]
+        penalty[neighbours[offsets[k]:offsets[k + 1]]] += neighbour_weights[offsets[k]:offsets[k + 1]]
+    return np.array(chosen, dtype=np.int64), np.array(gains, dtype=float)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def billboard_selection_plan(fingerprint, budget_type, budget, radius_m, overlap_share, _df):
+    """Billboards chosen by select_billboards, in pick order, with marginal and cumulative net reach."""
+    reach = pd.to_numeric(_df['reach'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    costs = billboard_costs(_df).to_numpy(dtype=float) if budget_type == "Total cost" else None
+    positions, gains = select_billboards(reach, _df['latitude'].to_numpy(dtype=float), _df['longitude'].to_numpy(dtype=float),
+                                         budget, costs, radius_m, overlap_share)
+    plan = _df.iloc[positions].reset_index(drop=True)
+    plan.insert(0, 'pick_order', np.arange(1, len(plan) + 1))
+    plan['marginal_net_reach'] = gains.round(0)
+    plan['cumulative_net_reach'] = gains.cumsum().round(0)
+    if costs is not None:
+        plan['cumulative_cost'] = costs[positions].cumsum()
+    settings = f"{fingerprint}|{budget_type}|{budget}|{radius_m}|{overlap_share}"
+    plan.attrs = {**_df.attrs, 'fingerprint': hashlib.sha1(settings.encode('utf-8')).hexdigest()[:16]}
+    return plan
+
+# --- Cache warm-up (runs in the background on server start, or via `python app.py --warm-cache`) ---
+_LOGGER = logging.getLogger("multibranding")
+
+def warm_caches(log=_LOGGER.info):
+    """Pre-loads every library dataset: ingestion cache, value-count index, response cubes, multi-response blocks, billboard spatial index and map."""
+    library = list_dataset_library()
+    for path in library["brands"]:
+        try:
+            brand_name = library_brand_for(path)
+            if brand_name is not None:
+                # Warm the projections the brand tab and the Overall tab will ask for
+                overall_response_cube(brand_name, load_dataset(path, overall_column_spec(brand_name)))
+            df = load_dataset(path, BRAND_COLUMN_SPECS.get(brand_name))
+            column_index(df)
+            multi_response_blocks(dataset_fingerprint(df), df)
+            for col in df.columns:
+                count_values(df, col)
+            log(f"Warmed brand dataset {os.path.basename(path)} ({len(df):,} rows)")
+        except Exception as e:
+            log(f"Could not warm {os.path.basename(path)}: {e}")
+
+    billboard_frames = []
+    for path in library["billboards"]:
+        try:
+            df = load_dataset(path)
+            df['source_file'] = os.path.basename(path).replace('.', '_').lower()
+            billboard_frames.append(df)
+        except Exception as e:
+            log(f"Could not warm {os.path.basename(path)}: {e}")
+
+    if billboard_frames:
+        # Warm the "all library billboards" selection, the most common one
+        merged = merge_billboard_frames(billboard_merge_key(billboard_frames), billboard_frames)
+        if 'latitude' in merged.columns and 'longitude' in merged.columns:
+            merged, _ = dedupe_billboards(dataset_fingerprint(merged), BILLBOARD_DEDUP_RADIUS_M, merged)
+        for col in merged.columns:
+            count_values(merged, col)
+        if 'latitude' in merged.columns and 'longitude' in merged.columns:
+            billboard_spatial_index(dataset_fingerprint(merged), merged['latitude'], merged['longitude'])
+            boundaries_key = boundaries_cache_key()
+            boundaries = load_boundaries(BOUNDARIES_FILE, boundaries_key) if boundaries_key else None
+            if len(merged) > HEATMAP_DEFAULT_MIN_ROWS:
+                weight_col = next((col for col in HEATMAP_WEIGHTS.values() if col is None or col in merged.columns))
+                billboard_heatmap(dataset_fingerprint(merged), weight_col, merged, boundaries_key, boundaries)
+            else:
+                billboard_map(dataset_fingerprint(merged), merged, boundaries_key, boundaries)
+        log(f"Warmed merged billboard data ({len(merged):,} rows from {len(billboard_frames)} files)")
+
+def ingest_library(log=_LOGGER.info):
+    """Parses every library CSV that isn't in the on-disk cache yet (the command-line warm-up).
+
+    Only the Parquet files outlive a command-line run, so unlike warm_caches nothing is built in memory.
+    """
+    library = list_dataset_library()
+    for path in library["brands"] + library["billboards"]:
+        try:
+            if any(os.path.exists(cache_path) for cache_path in library_cache_paths(library_cache_key(path))):
+                log(f"Already cached {os.path.basename(path)}")
+                continue
+            df = ingest_library_file(path)
+            log(f"Ingested {os.path.basename(path)} ({len(df):,} rows)")
+        except Exception as e:
+            log(f"Could not ingest {os.path.basename(path)}: {e}")
+
+@st.cache_resource(show_spinner=False)
+def start_cache_warmup():
+    """Starts the warm-up thread once per server process."""
+    thread = threading.Thread(target=warm_caches, name="cache-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# --- Paginated data grid (server-side sort, filter and paging; only the visible page is sent) ---
+DATA_GRID_PAGE_SIZES = [10, 25, 50, 100]
+DATA_GRID_FILE_ORDER = "(file order)"
+
+class DataGridIndex:
+    """Per-dataset sort orders and label codes, so a grid page is a slice of precomputed row positions.
+
+    Each column is factorised and sorted (stable, missing values last) the first time it is used;
+    a filter matches the search text against the column's unique labels, not every row.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._codes = {}
+        self._orders = {}
+
+    def _column_codes(self, col):
+        """(codes ranked in sort order with missing = len(uniques), lowercased unique labels)."""
+        if col not in self._codes:
+            codes, uniques = pd.factorize(self.df[col], use_na_sentinel=True)
+            labels = pd.Index(uniques).astype(str)
+            # Categoricals (e.g. Likert answers) sort in category order, not alphabetically
+            sort_keys = np.asarray(uniques.codes) if isinstance(uniques.dtype, pd.CategoricalDtype) else np.asarray(uniques)
+            try:
+                rank = np.argsort(np.argsort(sort_keys, kind='stable'), kind='stable')
+            except TypeError:
+                # Mixed types don't compare; order them by their text instead
+                rank = np.argsort(np.argsort(np.asarray(labels), kind='stable'), kind='stable')
+            ranked = np.where(codes >= 0, rank[codes] if len(rank) else codes, len(uniques))
+            self._codes[col] = (ranked, codes, labels.str.lower())
+        return self._codes[col]
+
+    def order(self, col, descending=False):
+        """Row positions sorted by a column (missing values last either way)."""
+        key = (col, descending)
+        if key not in self._orders:
+            ranked, codes, labels = self._column_codes(col)
+            if descending:
+                ranked = np.where(codes >= 0, len(labels) - 1 - ranked, len(labels))
+            self._orders[key] = np.argsort(ranked, kind='stable')
+        return self._orders[key]
+
+    def rows(self, sort_col=None, descending=False, filter_col=None, filter_text=""):
+        """Row positions of the grid in display order, after the optional filter."""
+        rows = self.order(sort_col, descending) if sort_col else np.arange(len(self.df))
+        if filter_col and filter_text:
+            _, codes, labels = self._column_codes(filter_col)
+            matched = np.append(np.asarray(labels.str.contains(filter_text.lower(), regex=False), dtype=bool), False)
+            rows = rows[matched[codes[rows]]] # code -1 (missing) picks the trailing False
+        return rows
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def data_grid_index(fingerprint, _df):
+    """One grid index per dataset, shared by every session browsing it."""
+    return DataGridIndex(_df)
+
+def data_grid(df, key):
+    """Paginated preview of a (possibly very large) frame with sorting and a contains-filter on one column."""
+    grid = data_grid_index(dataset_fingerprint(df), df)
+    columns = [str(col) for col in df.columns]
+    sort_col_ui, desc_ui, filter_col_ui, filter_text_ui, page_size_ui = st.columns([2, 1, 2, 2, 1])
+    sort_col = sort_col_ui.selectbox("Sort by", [DATA_GRID_FILE_ORDER] + columns, key=f"{key}_sort")
+    descending = desc_ui.checkbox("Descending", key=f"{key}_descending")
+    filter_col = filter_col_ui.selectbox("Filter column", columns, key=f"{key}_filter_col")
+    filter_text = filter_text_ui.text_input("Contains", key=f"{key}_filter_text").strip()
+    page_size = page_size_ui.selectbox("Rows per page", DATA_GRID_PAGE_SIZES, key=f"{key}_page_size")
+
+    rows = grid.rows(None if sort_col == DATA_GRID_FILE_ORDER else sort_col, descending, filter_col, filter_text)
+    page_count = max(1, math.ceil(len(rows) / page_size))
+    # A narrower filter can leave the remembered page past the end
+    if st.session_state.get(f"{key}_page", 1) > page_count:
+        st.session_state[f"{key}_page"] = page_count
+    page = st.number_input(f"Page (of {page_count:,})", min_value=1, max_value=page_count, step=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    st.dataframe(df.iloc[rows[start:start + page_size]], use_container_width=True)
+    shown = f"Rows {start + 1:,}–{min(start + page_size, len(rows)):,} of {len(rows):,}" if len(rows) else "No matching rows"
+    st.caption(shown + (f" (filtered from {len(df):,})" if filter_text else ""))
+
+# --- Billboard Charts tab options (shared by the tab's selectors and the static report) ---
+BILLBOARD_CHART_TYPES = ["Bar Chart (Counts)", "Pie Chart (Counts)", "Distribution (Views/Reach)", "Gauge (Avg. Reach %)"]
+BILLBOARD_CATEGORY_COLUMNS = ['location', 'country', 'district', 'category', 'media_owner', 'format', 'venue_type', 'schedule', 'source_file']
+BILLBOARD_NUMERIC_COLUMNS = ['potential_views', 'reach', 'reach_pct']
+
+def billboard_chart_choice(label, options, key, choices=None):
+    """A Charts-tab selector; the static report passes its choices in instead of showing the widget."""
+    if choices is not None:
+        return choices.get(key, options[0])
+    return st.selectbox(label, options, key=key)
+
+def billboard_report_variants(merged_df):
+    """Every billboard chart the static report shows (bar counts stand in for the pie charts)."""
+    variants = [{'billboard_chart_selector': "Bar Chart (Counts)", 'billboard_bar_col': col}
+                for col in BILLBOARD_CATEGORY_COLUMNS if col in merged_df.columns]
+    variants += [{'billboard_chart_selector': "Distribution (Views/Reach)", 'billboard_numeric_col': col}
+                 for col in BILLBOARD_NUMERIC_COLUMNS if col in merged_df.columns]
+    variants.append({'billboard_chart_selector': "Gauge (Avg. Reach %)"})
+    return variants
+
+# --- Static report (`python app.py --report report.html`): every tab run headless, charts kept as Vega-Lite ---
+# Set by build_report for the headless run: the billboard Charts tab then renders every variant
+REPORT_MODE = os.environ.get("MULTIBRANDING_REPORT") == "1"
+REPORT_MAX_TABLE_ROWS = 50
+# Messages shown where a chart could not be drawn; the report keeps them visible and lists them in its log
+REPORT_NOTICE_TYPES = ('info', 'warning', 'error')
+
+def _report_elements(node):
+    """Leaf elements under a rendered block, in page order."""
+    for child in (getattr(node, 'children', None) or {}).values():
+        if getattr(child, 'children', None):
+            yield from _report_elements(child)
+        else:
+            yield child
+
+def _report_script_json(value):
+    return json.dumps(value).replace("</", "<\\/") # Safe inside <script>
+
+def _report_element_html(element, element_id):
+    """One rendered element as static HTML (charts become Vega-Lite/Plotly embeds with their data inlined)."""
+    kind = getattr(element, 'type', '')
+    if kind == 'vega_lite_chart':
+        import pyarrow as pa # Installed with streamlit
+        spec = json.loads(element.proto.spec)
+        spec['datasets'] = {
+            dataset.name: json.loads(pa.ipc.open_stream(dataset.data.data).read_all().to_pandas()
+                                     .to_json(orient='records', date_format='iso'))
+            for dataset in element.proto.datasets
+        }
+        return (f'<div class="chart" id="{element_id}"></div><script>vegaEmbed("#{element_id}", '
+                f'{_report_script_json(spec)}, {{mode: "vega-lite", actions: false}});</script>')
+    if kind == 'plotly_chart':
+        figure = json.loads(element.proto.spec)
+        return (f'<div class="chart" id="{element_id}"></div><script>Plotly.newPlot("{element_id}", '
+                f'{_report_script_json(figure.get("data", []))}, {_report_script_json(figure.get("layout", {}))});</script>')
+    if kind in ('header', 'subheader'):
+        tag = 'h3' if kind == 'header' else 'h4'
+        return f'<{tag}>{html.escape(str(element.value))}</{tag}>'
+    if kind == 'markdown':
+        return f'<p>{html.escape(str(element.value)).replace("**", "")}</p>'
+    if kind == 'caption':
+        return f'<p class="caption">{html.escape(str(element.value))}</p>'
+    if kind == 'metric':
+        return f'<div class="metric"><span>{html.escape(str(element.label))}</span><strong>{html.escape(str(element.value))}</strong></div>'
+    if kind == 'dataframe':
+        return element.value.head(REPORT_MAX_TABLE_ROWS).to_html(classes='table', na_rep='', border=0)
+    if kind in REPORT_NOTICE_TYPES:
+        return f'<p class="notice">⚠️ No chart: {html.escape(str(element.value))}</p>'
+    return ''
+
+def _report_scripts(chart_types):
+    """Inline <script> tags with the chart libraries the report uses, so it renders offline.
+
+    Vega, Vega-Lite and vega-embed come as one bundle from vl-convert (Altair's inline renderer);
+    plotly.js ships with the plotly package.
+    """
+    scripts = []
+    if 'vega_lite_chart' in chart_types:
+        try:
+            import vl_convert # Only needed for reports
+        except ImportError as e:
+            raise RuntimeError("The HTML report inlines Vega-Lite from vl-convert: pip install vl-convert-python") from e
+        scripts.append(vl_convert.javascript_bundle())
+    if 'plotly_chart' in chart_types:
+        from plotly.offline import get_plotlyjs
+        scripts.append(get_plotlyjs())
+    return "".join(f'<script type="text/javascript">{script}</script>' for script in scripts)
+
+def build_report(path, log=_LOGGER.info):
+    """Writes every tab (all brands, billboard summary and every billboard chart) to one standalone HTML file.
+
+    The dashboard runs once headless in this process with all library datasets selected, so it
+    goes through the same cached loaders and aggregations as the app; the rendered charts are then
+    converted to embeds in parallel, and the chart libraries are inlined so the file works offline.
+    Sections where a chart could not be drawn show the app's message and are logged. Returns the
+    number of charts written.
+    """
+    from streamlit.testing.v1 import AppTest # Only needed for reports
+    started = time.perf_counter()
+    os.environ["MULTIBRANDING_REPORT"] = "1"
+    os.environ.setdefault("MULTIBRANDING_WARM_CACHE", "0") # The report loads what it needs itself
+    app = AppTest.from_file(os.path.abspath(__file__), default_timeout=600)
+    app.run()
+    if app.exception:
+        raise RuntimeError(f"Dashboard failed while building the report: {app.exception[0].value}")
+
+    sections = []
+    for tab in app.tabs:
+        elements = list(_report_elements(tab))
+        if tab.label == "📍 Data & Map":
+            elements = [element for element in elements if getattr(element, 'type', '') in ('metric', 'dataframe')]
+        sections.append((tab.label, elements))
+
+    # Convert every element (arrow decoding and JSON for charts) in parallel
+    jobs = [(element, f"el-{i}-{j}") for i, (_, elements) in enumerate(sections) for j, element in enumerate(elements)]
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        rendered = iter(list(pool.map(lambda job: _report_element_html(*job), jobs)))
+    section_html = [f'<section id="section-{i}"><h2>{html.escape(title)}</h2>'
+                    + "".join(next(rendered) for _ in elements) + '</section>'
+                    for i, (title, elements) in enumerate(sections)]
+    toc = "".join(f'<li><a href="#section-{i}">{html.escape(title)}</a></li>' for i, (title, _) in enumerate(sections))
+
+    chart_types = [getattr(element, 'type', '') for element, _ in jobs]
+    chart_count = sum(kind in ('vega_lite_chart', 'plotly_chart') for kind in chart_types)
+    for title, elements in sections:
+        for element in elements:
+            if getattr(element, 'type', '') in REPORT_NOTICE_TYPES:
+                log(f"No chart in '{title}': {element.value}")
+    document = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Combined Data Dashboards report</title>
+{_report_scripts(set(chart_types))}
+<style>
+body {{ font-family: sans-serif; margin: 2em auto; max-width: 1100px; }}
+section {{ page-break-before: always; }}
+.chart {{ width: 100%; margin: 1em 0; }}
+.caption {{ color: #666; font-size: 0.9em; }}
+.notice {{ color: #8a6d3b; background: #fcf8e3; padding: 4px 8px; }}
+.metric {{ display: inline-block; margin: 0 2em 1em 0; }} .metric span {{ display: block; color: #666; }}
+.table {{ border-collapse: collapse; font-size: 0.85em; }} .table td, .table th {{ padding: 2px 8px; border-bottom: 1px solid #ddd; }}
+</style></head><body>
+<h1>📊 Combined Data Dashboards</h1>
+<p class="caption">Generated {time.strftime("%Y-%m-%d %H:%M")}. Print this page to PDF for a deck.</p>
+<ul>{toc}</ul>
+{"".join(section_html)}
+</body></html>"""
+    with open(path, "w", encoding="utf-8") as report_file:
+        report_file.write(document)
+    log(f"Wrote {path}: {len(sections)} sections, {chart_count} charts in {time.perf_counter() - started:.1f}s")
+    return chart_count
+
+def run_cli(argv):
+    """Command-line entry point; the in-memory caches only live inside the server process,
+    so from the command line this pre-ingests the library into the on-disk Parquet cache."""
+    parser = argparse.ArgumentParser(prog="app.py", description="Multi-brand dashboard utilities")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help=f"Parse every dataset in the library ({DATASET_LIBRARY_DIR}) into the on-disk cache")
+    parser.add_argument("--report", metavar="PATH",
+                        help="Render every brand tab and the billboard charts from the library into one HTML report")
+    args = parser.parse_args(argv)
+    if args.warm_cache:
+        ingest_library(log=print)
+    if args.report:
+        build_report(args.report, log=print)
+    if args.warm_cache or args.report:
+        return 0
+    parser.print_help()
+    return 1
+
 # Define a helper function to safely format strings for display
 def safe_display_string(value, default_display="N/A"):
     """Converts a value to a display string, handling None/NaN."""
@@ -81,11 +2159,270 @@ def safe_display_string(value, default_display="N/A"):
     # Convert to string and then apply string methods
     return str(value).strip().replace('_', ' ').title()
 
+# --- Billboard map (built once per merged dataset; reruns only re-send it to the browser) ---
+BILLBOARD_MAP_MODES = ["Pins", "Heatmap"]
+# Above this many billboards the map opens as a heatmap (one marker per billboard gets slow to draw)
+HEATMAP_DEFAULT_MIN_ROWS = 5_000
+# Heatmap weights: label -> column (None weighs every billboard equally)
+HEATMAP_WEIGHTS = {"Potential views": 'potential_views', "Reach": 'reach', "Billboard count": None}
+# Grid cells along the longer side of the billboards' extent, i.e. the resolution at the map's initial zoom
+HEATMAP_GRID_CELLS = 160
+HEATMAP_MIN_CELL_DEG = 0.0005 # About 55 m; a tight cluster of billboards is not gridded finer than this
+HEATMAP_SMOOTHING_CELLS = 1.5 # Gaussian kernel sigma, in grid cells
+HEATMAP_MIN_DENSITY = 0.001 # Cells below this share of the peak density are not sent to the browser
+
+def billboard_base_map(fingerprint, df, lat_col='latitude', lon_col='longitude'):
+    """Empty folium map centred on the billboards and zoomed to their bounds."""
+    map_df = df.dropna(subset=[lat_col, lon_col])
+    # Adjust zoom start if needed for a wider view
+    m = folium.Map(location=[map_df[lat_col].mean(), map_df[lon_col].mean()], zoom_start=5)
+
+    # Zoom to the billboards using the cached spatial index bounds
+    spatial_index = billboard_spatial_index(fingerprint, df[lat_col], df[lon_col])
+    if spatial_index.bounds is not None:
+        m.fit_bounds(spatial_index.bounds)
+    return m
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def billboard_map(fingerprint, _merged_df, boundaries_key='', _boundaries=None, plan_key='', _plan=None):
+    """Builds the folium billboard map (markers, popups, bounds) once per merged billboard dataset.
+
+    With a boundary file, billboards per area and mean reach % per area are added as choropleth layers;
+    with an optimiser plan, its billboards are ringed.
+    """
+    lat_col = 'latitude'
+    lon_col = 'longitude'
+    reach_pct_col = 'reach_pct' # Created during Billboard data loading
+    # Filter out rows with invalid Lat/Lon before calculating center and iterating
+    map_df = _merged_df.dropna(subset=[lat_col, lon_col])
+    m = billboard_base_map(fingerprint, _merged_df, lat_col, lon_col)
+
+    def get_marker_color(reach_pct_val):
+        if pd.isna(reach_pct_val):
+            return "gray"
+        elif reach_pct_val >= 75:
+            return "green"
+        elif reach_pct_val >= 40:
+            return "orange"
+        else:
+            return "red"
+
+    # Iterate only over rows with valid Lat/Lon from map_df
+    for _, row in map_df.iterrows():
+
+        # Use the safe_display_string function for potentially missing/non-string data
+        location_raw = row.get('location', row.get('country'))
+        location_display = safe_display_string(location_raw)
+
+        district_raw = row.get('district')
+        district_display = safe_display_string(district_raw)
+
+        reference_id_raw = row.get('reference_id')
+        reference_id_display = safe_display_string(reference_id_raw)
+
+        source_file_raw = row.get('source_file') # Get the preprocessed source file name
+        source_file_display = safe_display_string(source_file_raw, default_display='Unknown File')
+
+        potential_views_display = f"{row.get('potential_views', pd.NA):,.0f}" if pd.notna(row.get('potential_views')) else "N/A"
+        reach_display = f"{row.get('reach', pd.NA):,.0f}" if pd.notna(row.get('reach')) else "N/A"
+        reach_percent_val = row.get(reach_pct_col, pd.NA)
+        reach_percent_display = f"{reach_percent_val:.2f}%" if pd.notna(reach_percent_val) else "N/A"
+
+        tooltip = f"""
+            <strong>File:</strong> {source_file_display}<br>
+            <strong>Location:</strong> {location_display}<br>
+            <strong>District:</strong> {district_display}<br>
+            <strong>Reference ID:</strong> {reference_id_display}<br>
+            <strong>Lat:</strong> {row[lat_col]}<br>
+            <strong>Lon:</strong> {row[lon_col]}<br>
+            <strong>Potential Views:</strong> {potential_views_display}<br>
+            <strong>Reach:</strong> {reach_display}<br>
+            <strong>Reach %:</strong> {reach_percent_display}
+        """
+
+        folium.Marker(
+            location=[row[lat_col], row[lon_col]],
+            popup=folium.Popup(tooltip, max_width=300),
+            icon=folium.Icon(color=get_marker_color(reach_percent_val), icon="info-sign")
+        ).add_to(m)
+
+    add_overlay_layers(m, fingerprint, boundaries_key, _merged_df, _boundaries, _plan)
+    return m
+
+def add_overlay_layers(m, fingerprint, boundaries_key, df, boundaries, plan):
+    """Adds the area choropleths and the optimiser selection, with a layer switcher if there are any."""
+    added_areas = add_area_layers(m, fingerprint, boundaries_key, df, boundaries)
+    added_selection = add_selection_layer(m, plan)
+    if added_areas or added_selection:
+        folium.LayerControl(collapsed=True).add_to(m)
+
+def add_selection_layer(m, plan):
+    """Rings the billboards of an optimiser plan; the tooltips give pick order and marginal net reach."""
+    if plan is None or plan.empty:
+        return False
+    group = folium.FeatureGroup(name=f"Optimised selection ({len(plan):,} billboards)")
+    for pick, lat, lon, gain in zip(plan['pick_order'], plan['latitude'], plan['longitude'], plan['marginal_net_reach']):
+        folium.CircleMarker(
+            location=[lat, lon], radius=10, color='#6a0dad', weight=3, fill=True, fill_opacity=0.3,
+            tooltip=f"Pick #{pick}: +{gain:,.0f} net reach"
+        ).add_to(group)
+    group.add_to(m)
+    return True
+
+def add_area_layers(m, fingerprint, boundaries_key, df, boundaries):
+    """Adds billboards-per-area and mean-reach-per-area choropleth layers (False without a boundary file)."""
+    if boundaries is None or not boundaries['features']:
+        return False
+    summary = billboard_area_summary(fingerprint, boundaries_key, df, boundaries)
+    # Copy the per-area figures into the features so the area tooltips can show them
+    by_area = summary.set_index('Area')
+    features = []
+    for feature in boundaries['features']:
+        name = feature['properties']['boundary_name']
+        properties = {'boundary_name': name, 'billboards': f"{by_area.at[name, 'Billboards']:,}"}
+        if 'Avg. Reach (%)' in by_area.columns:
+            reach_pct = by_area.at[name, 'Avg. Reach (%)']
+            properties['avg_reach_pct'] = f"{reach_pct:.2f}%" if pd.notna(reach_pct) else "N/A"
+        features.append({**feature, 'properties': properties})
+    geojson = {'type': 'FeatureCollection', 'features': features}
+    tooltip_fields = [field for field in ('boundary_name', 'billboards', 'avg_reach_pct') if field in features[0]['properties']]
+    tooltip_aliases = {'boundary_name': 'Area', 'billboards': 'Billboards', 'avg_reach_pct': 'Avg. Reach (%)'}
+
+    layers = [('Billboards', 'Billboards per area', 'YlOrRd', True)]
+    if 'Avg. Reach (%)' in summary.columns:
+        layers.append(('Avg. Reach (%)', 'Avg. reach % per area', 'YlGnBu', False))
+    for value_col, layer_name, fill_color, show in layers:
+        choropleth = folium.Choropleth(
+            geo_data=geojson,
+            data=summary,
+            columns=['Area', value_col],
+            key_on='feature.properties.boundary_name',
+            fill_color=fill_color,
+            fill_opacity=0.5,
+            line_opacity=0.4,
+            nan_fill_opacity=0.1,
+            legend_name=layer_name,
+            name=layer_name,
+            show=show,
+        ).add_to(m)
+        folium.GeoJsonTooltip(fields=tooltip_fields, aliases=[tooltip_aliases[field] for field in tooltip_fields]).add_to(choropleth.geojson)
+    return True
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def billboard_density_grid(fingerprint, weight_col, _df):
+    """Kernel density of billboards (weighted by weight_col) on a grid sized to the billboards' extent.
+
+    Billboards are binned with one bincount, smoothed by a separable Gaussian and returned as
+    [lat, lon, weight] cell centres (weights scaled to 0-1, near-empty cells dropped), so the
+    browser gets at most a few thousand points however many billboards there are.
+    """
+    lat = _df['latitude'].to_numpy(dtype=float)
+    lon = _df['longitude'].to_numpy(dtype=float)
+    weights = (np.ones(len(_df)) if weight_col is None
+               else pd.to_numeric(_df[weight_col], errors='coerce').fillna(0).clip(lower=0).to_numpy(dtype=float))
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    lat, lon, weights = lat[valid], lon[valid], weights[valid]
+    if not len(lat) or not weights.any():
+        return []
+
+    cell_deg = max((max(np.ptp(lat), np.ptp(lon)) / HEATMAP_GRID_CELLS), HEATMAP_MIN_CELL_DEG)
+    pad = int(np.ceil(3 * HEATMAP_SMOOTHING_CELLS)) # Room for the kernel's tails around the edge billboards
+    origin_lat, origin_lon = lat.min() - pad * cell_deg, lon.min() - pad * cell_deg
+    rows = np.floor((lat - origin_lat) / cell_deg).astype(np.int64)
+    cols = np.floor((lon - origin_lon) / cell_deg).astype(np.int64)
+    n_rows, n_cols = rows.max() + pad + 1, cols.max() + pad + 1
+    grid = np.bincount(rows * n_cols + cols, weights=weights, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+
+    offsets = np.arange(-pad, pad + 1)
+    kernel = np.exp(-0.5 * (offsets / HEATMAP_SMOOTHING_CELLS) ** 2)
+    kernel /= kernel.sum()
+    for axis in (0, 1):
+        padded = np.pad(grid, [(pad, pad) if a == axis else (0, 0) for a in (0, 1)])
+        size = grid.shape[axis]
+        grid = sum(k * padded.take(np.arange(pad + o, pad + o + size), axis=axis) for o, k in zip(offsets, kernel))
+
+    grid /= grid.max()
+    cell_rows, cell_cols = np.nonzero(grid >= HEATMAP_MIN_DENSITY)
+    return np.column_stack([(origin_lat + (cell_rows + 0.5) * cell_deg).round(5),
+                            (origin_lon + (cell_cols + 0.5) * cell_deg).round(5),
+                            grid[cell_rows, cell_cols].round(4)]).tolist()
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def billboard_heatmap(fingerprint, weight_col, _merged_df, boundaries_key='', _boundaries=None, plan_key='', _plan=None):
+    """Builds the folium heatmap of billboard density (weighted by weight_col) once per dataset and weight."""
+    m = billboard_base_map(fingerprint, _merged_df)
+    HeatMap(billboard_density_grid(fingerprint, weight_col, _merged_df),
+            name="Billboard density", min_opacity=0.3, radius=18, blur=15).add_to(m)
+    add_overlay_layers(m, fingerprint, boundaries_key, _merged_df, _boundaries, _plan)
+    return m
+
+
+# --- Merged billboard export (generated on click, streamed a slice at a time) ---
+EXPORT_CHUNK_ROWS = 50_000
+EXCEL_AVAILABLE = any(importlib.util.find_spec(module) is not None for module in ("openpyxl", "xlsxwriter"))
+
+BILLBOARD_EXPORT_FORMATS = {
+    "CSV (gzip)": ("merged_billboard_data.csv.gz", "application/gzip"),
+    "CSV": ("merged_billboard_data.csv", "text/csv"),
+}
+if PYARROW_AVAILABLE:
+    BILLBOARD_EXPORT_FORMATS["Parquet"] = ("merged_billboard_data.parquet", "application/vnd.apache.parquet")
+if EXCEL_AVAILABLE:
+    BILLBOARD_EXPORT_FORMATS["Excel"] = ("merged_billboard_data.xlsx",
+                                         "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+def write_csv_chunks(df, stream, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Writes df as UTF-8 CSV into a binary stream one slice of rows at a time (no whole-file string)."""
+    for start in range(0, max(len(df), 1), chunk_rows):
+        stream.write(df.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0).encode('utf-8'))
+
+def export_billboard_data(export_format, df):
+    """Serialises a billboard frame in one of BILLBOARD_EXPORT_FORMATS into an anonymous temporary file.
+
+    Called by the download button only when it is clicked. The export is written to disk a slice at a
+    time and handed over as a read-only file object, so the only in-memory copy is the one Streamlit
+    reads to serve the download; nothing is kept once it has been sent.
+    """
+    with tempfile.TemporaryFile() as buffer:
+        if export_format == "CSV (gzip)":
+            with gzip.GzipFile(fileobj=buffer, mode='wb') as compressed:
+                write_csv_chunks(df, compressed)
+        elif export_format == "CSV":
+            write_csv_chunks(df, buffer)
+        elif export_format == "Parquet":
+            try:
+                df.to_parquet(buffer, index=False)
+            except Exception:
+                # Mixed-type object columns can't always be written as Parquet, write them as text
+                buffer.seek(0)
+                buffer.truncate()
+                object_cols = df.select_dtypes(include='object').columns
+                df.astype({col: str for col in object_cols}).to_parquet(buffer, index=False)
+        else:
+            df.to_excel(buffer, index=False)
+        buffer.flush()
+        # A reader of its own over the same file (Streamlit accepts io.BufferedReader); the file is
+        # deleted once both are closed
+        reader = os.fdopen(os.dup(buffer.fileno()), 'rb')
+    reader.seek(0)
+    return reader
+
+
+# --- Command-line mode (python app.py --warm-cache / --report); skipped under `streamlit run` ---
+# and when the report runs this script headless (both execute it inside a script-run context)
+if __name__ == "__main__" and get_script_run_ctx(suppress_warning=True) is None:
+    sys.exit(run_cli(sys.argv[1:]))
+
 
 # --- Sidebar (Empty or for other controls if needed) ---
 st.sidebar.header("Sidebar")
 st.sidebar.write("Use the main content area to upload files and interact with the dashboards.")
 
+# Pre-warm caches for the dataset library in the background (once per server process)
+if os.environ.get("MULTIBRANDING_WARM_CACHE", "1") != "0":
+    warmup_thread = start_cache_warmup()
+    st.sidebar.caption("⏳ Warming dataset caches…" if warmup_thread.is_alive() else "✅ Dataset caches warm")
+
 
 # --- Main Content Columns ---
 # Adjust the width ratio [left_column_width, right_column_width] as needed
@@ -104,34 +2441,85 @@ with col_insights:
        "Chocolate", "Phones", "Coca-Cola", "Mudah", "KFC", "Panasonic"
     ]
 
-    # Use distinct keys for uploaders now that they are not in sidebar
-    airasia_file = st.file_uploader("AirAsia Data", type="csv", key="main_airasia_uploader")
-    cheetos_file = st.file_uploader("Cheetos Data", type="csv", key="main_cheetos_uploader")
-    mucilion_file = st.file_uploader("Mucilion Data", type="csv", key="main_mucilion_uploader")
-    rtd_file = st.file_uploader("RTD Data", type="csv", key="main_rtd_uploader")
-    fried_file = st.file_uploader("Fried Chicken Data", type="csv", key="main_fried_uploader")
-    choco_file = st.file_uploader("Chocolate Data (March)", type="csv", key="main_choco_uploader")
-    phone_file = st.file_uploader("Samsung Phone Data", type="csv", key="main_phone_uploader")
-    cola_file = st.file_uploader("Coca-Cola Data", type = "csv", key="main_cola_uploader")
-    mudah_file = st.file_uploader("Mudah Data", type="csv", key="main_mudah_uploader")
-    kfc_file = st.file_uploader("KFC Data", type="csv", key="main_kfc_uploader")
-    panasonic_file = st.file_uploader("Panasonic Data", type="csv", key="main_panasonic_uploader")
-
-    # Map file variables to brand names for the Overall tab loader
-    brand_file_map = {
-        "AirAsia": airasia_file,
-        "Cheetos": cheetos_file,
-        "Mucilion": mucilion_file,
-        "RTD Drinks": rtd_file,
-        "Fried Chicken": fried_file,
-        "Chocolate": choco_file,
-        "Phones": phone_file,
-        "Coca-Cola": cola_file,
-        "Mudah": mudah_file,
-        "KFC": kfc_file,
-        "Panasonic": panasonic_file,
+    # Labels and widget keys for each brand's data source
+    brand_uploader_config = {
+        "AirAsia": ("AirAsia Data", "airasia"),
+        "Cheetos": ("Cheetos Data", "cheetos"),
+        "Mucilion": ("Mucilion Data", "mucilion"),
+        "RTD Drinks": ("RTD Data", "rtd"),
+        "Fried Chicken": ("Fried Chicken Data", "fried"),
+        "Chocolate": ("Chocolate Data (March)", "choco"),
+        "Phones": ("Samsung Phone Data", "phone"),
+        "Coca-Cola": ("Coca-Cola Data", "cola"),
+        "Mudah": ("Mudah Data", "mudah"),
+        "KFC": ("KFC Data", "kfc"),
+        "Panasonic": ("Panasonic Data", "panasonic"),
     }
 
+    # Files already on the server can be picked instead of uploaded
+    dataset_library = list_dataset_library()
+    brand_source_mode = st.radio(
+        "Brand data source",
+        ["Upload files", "Choose from library"],
+        index=1 if dataset_library["brands"] else 0,
+        horizontal=True,
+        key="brand_source_mode",
+        disabled=not dataset_library["brands"],
+        help=f"Library folder: {DATASET_LIBRARY_DIR}"
+    )
+
+    # Map brand names to an uploaded file or a library path (used by tabs and the Overall tab loader)
+    brand_file_map = {}
+    for brand_name, (label, key_slug) in brand_uploader_config.items():
+        if brand_source_mode == "Choose from library":
+            library_files = dataset_library["brands"]
+            # Pre-select the first library file whose name matches the brand keyword
+            matching = [i for i, path in enumerate(library_files) if library_brand_for(path) == brand_name]
+            selected_path = st.selectbox(
+                label,
+                [None] + library_files,
+                index=matching[0] + 1 if matching else 0,
+                format_func=lambda path: "-- None --" if path is None else os.path.basename(path),
+                key=f"main_{key_slug}_library"
+            )
+            brand_file_map[brand_name] = selected_path
+        else:
+            # Use distinct keys for uploaders now that they are not in sidebar
+            brand_file_map[brand_name] = st.file_uploader(label, type="csv", key=f"main_{key_slug}_uploader")
+
+    airasia_file = brand_file_map["AirAsia"]
+    cheetos_file = brand_file_map["Cheetos"]
+    mucilion_file = brand_file_map["Mucilion"]
+    rtd_file = brand_file_map["RTD Drinks"]
+    fried_file = brand_file_map["Fried Chicken"]
+    choco_file = brand_file_map["Chocolate"]
+    phone_file = brand_file_map["Phones"]
+    cola_file = brand_file_map["Coca-Cola"]
+    mudah_file = brand_file_map["Mudah"]
+    kfc_file = brand_file_map["KFC"]
+    panasonic_file = brand_file_map["Panasonic"]
+
+    # --- Weighting (respondent weight column or raking to target margins) ---
+    weighting_mode = st.radio(
+        "Weighting",
+        WEIGHTING_MODES,
+        horizontal=True,
+        key="weighting_mode",
+        help=f"Raking targets file: {WEIGHTING_TARGETS_FILE}"
+    )
+    weighting_targets = None
+    if weighting_mode == "Rake to targets":
+        if os.path.exists(WEIGHTING_TARGETS_FILE):
+            try:
+                weighting_targets = load_weighting_targets(WEIGHTING_TARGETS_FILE, os.stat(WEIGHTING_TARGETS_FILE).st_mtime_ns)
+                st.caption("Raking to targets for: " + ", ".join(dim.replace('_', ' ').title() for dim in weighting_targets))
+            except (OSError, ValueError, AttributeError) as e:
+                st.error(f"Could not read weighting targets: {e}")
+        else:
+            st.warning(f"No weighting targets file found at {WEIGHTING_TARGETS_FILE}; showing unweighted counts.")
+    elif weighting_mode == "Weight column":
+        st.caption("Uses the first of these columns found in each dataset: " + ", ".join(WEIGHT_COLUMNS))
+
     # --- Overall Dashboard Selection (Moved to Main Page Column) ---
     st.subheader("📋 Overall Dashboard Selection")
     include_brands_overall = {}
@@ -157,7 +2545,7 @@ with col_insights:
              include_brands_overall[brand_name] = False # Fallback
 
     # --- Data Loading for Multi-Brand Overall Tab (Now depends on main page uploaders) ---
-    @st.cache_data # Cache this function for performance
+    @st.cache_data(max_entries=4) # Cache this function for performance (a few brand selections)
     def load_selected_data_for_overall_cached_main(file_map, include_selection):
         """Loads and preprocesses only the selected AND uploaded files."""
         loaded_dataframes = {}
@@ -165,8 +2553,8 @@ with col_insights:
             # Check if the brand is selected for overall AND the file is uploaded
             if include_selection.get(brand_name, False) and file_obj is not None:
                  try:
-                     df = pd.read_csv(file_obj)
-                     df = preprocess(df) # Apply preprocessing
+                     # Parsed and preprocessed (cached), only the columns this tab uses
+                     df = load_dataset(file_obj, overall_column_spec(brand_name))
                      # Ensure basic demo columns exist for overall tab before storing
                      # Relax this check slightly, maybe just check if df is not empty after preprocess
                      if not df.empty:
@@ -183,7 +2571,33 @@ with col_insights:
     loaded_dataframes_overall = load_selected_data_for_overall_cached_main(
         brand_file_map, include_brands_overall
     )
-
+    loaded_dataframes_overall = {brand_name: apply_weighting(df, weighting_mode, weighting_targets)
+                                 for brand_name, df in loaded_dataframes_overall.items()}
+    if loaded_dataframes_overall:
+        st.caption("Parsed with: " + "; ".join(
+            f"{brand_name} – {parse_engine_label(df)}" for brand_name, df in loaded_dataframes_overall.items()
+        ))
+
+
+    # --- Segment Filter (applies to every brand tab; categories harmonised across brands) ---
+    st.subheader("🎯 Segment Filter")
+    segment_bitmap_sets = []
+    for brand_name, source in brand_file_map.items():
+        if source is None:
+            continue
+        try:
+            brand_df = apply_weighting(load_dataset(source, BRAND_COLUMN_SPECS[brand_name]), weighting_mode, weighting_targets)
+        except Exception:
+            continue # The brand tab reports load errors
+        if not brand_df.empty:
+            segment_bitmap_sets.append(segment_bitmaps(dataset_fingerprint(brand_df), brand_df))
+    segment_selection = {}
+    for segment_col, dim in zip(st.columns(len(SEGMENT_DIMENSIONS)), SEGMENT_DIMENSIONS):
+        options = sorted(set().union(*(bitmaps.options(dim) for bitmaps in segment_bitmap_sets)))
+        with segment_col:
+            segment_selection[dim] = st.multiselect(
+                dim.replace('_', ' ').title(), options, key=f"segment_{dim}", disabled=not options
+            )
 
     # --- Create ALL possible tabs (Overall + Originals) (Nested within col_insights) ---
     brand_insight_tab_names = [
@@ -199,7 +2613,8 @@ with col_insights:
     brand_insight_tab_map = {name: obj for name, obj in zip(brand_insight_tab_names, brand_insight_tabs)}
 
     # --- Overall Insights Tab Content (Nested within col_insights) ---
-    with brand_insight_tab_map["💡 Overall Insights"]:
+    @st.fragment # Widgets in this tab rerun only this tab
+    def overall_insights_section():
         st.header("💡 Cross-Brand Insights")
         st.write("This tab provides a high-level overview and comparison across the **selected and uploaded** brand datasets.")
 
@@ -208,78 +2623,59 @@ with col_insights:
         else:
             st.subheader("Combined Respondent Demographics")
 
-            combined_demographics = pd.DataFrame()
-            # Identify common demographic columns based on likely preprocessed names
-            # Use a broad list to catch columns present in different datasets
-            demo_cols_to_combine = ['age_group', 'gender', 'monthly_income',
-                               'household_income', 'location', 'city', 'region',
-                               'marital_status', 'children_under_5',
-                               'please_select_the_age_group_based_on_your_age', # Panasonic age col
-                               'please_select_your_gender'] # Panasonic gender col
-
-            found_common_demo_cols = []
-            # First pass: find which of the common demo cols actually exist in *any* loaded dataframe
-            # Check existence *after* preprocessing
-            for col in demo_cols_to_combine:
-                if any(col in df.columns for df in loaded_dataframes_overall.values()):
-                     found_common_demo_cols.append(col)
+            # Distributions are roll-ups of each brand's response cube (built once per dataset)
+            overall_cubes = {brand_name: overall_response_cube(brand_name, df)
+                             for brand_name, df in loaded_dataframes_overall.items()}
+            # Only the common demo cols that exist in *any* loaded dataframe (Panasonic age/gender cols included)
+            found_common_demo_cols = [col for col in OVERALL_DEMOGRAPHIC_COLUMNS
+                                      if any(col in cube.tables for cube in overall_cubes.values())]
+            demo_brands = [brand_name for brand_name, cube in overall_cubes.items()
+                           if any(col in cube.tables for col in found_common_demo_cols)]
 
             if found_common_demo_cols:
-                for brand_name, df in loaded_dataframes_overall.items():
-                    temp_df = pd.DataFrame()
-                    has_demo_data = False
-                    for col in found_common_demo_cols:
-                        # Check if the column exists in the current dataframe *after* loading
-                        if col in df.columns:
-                             # Use .copy() and convert to string to handle potential mixed types
-                            temp_df[col] = df[col].astype(str).str.strip().copy()
-                            has_demo_data = True
-
-                    if has_demo_data:
-                        # Add source brand column only if we added some demographic data
-                        temp_df['Source Brand'] = brand_name
-                        combined_demographics = pd.concat([combined_demographics, temp_df], ignore_index=True)
-
-
-            if not combined_demographics.empty:
                 st.write("Distribution of combined respondents across all selected datasets:")
 
-                # Now, iterate through the demographic columns that were actually found and combined
                 for col in found_common_demo_cols:
-                    if col in combined_demographics.columns: # Double check it was successfully combined
-                         st.markdown(f"**{col.replace('_', ' ').title()} Distribution**")
-                         # Exclude empty strings and 'nan' strings from value counts for charts
-                         # Convert NaNs from concat to string 'nan' first
-                         valid_data = combined_demographics[col].fillna('nan').astype(str).loc[~combined_demographics[col].isin(['', 'nan', 'nan ', ' none', 'None'])] # Added more clean
-                         if not valid_data.empty:
-                             chart_data = valid_data.value_counts().reset_index()
-                             chart_data.columns = ['Category', 'Count']
-                             # Limit categories if too many for a readable bar chart
-                             if len(chart_data) > 20: # Arbitrary limit
-                                 st.info(f"(Showing top 20 categories for {col.replace('_', ' ').title()})")
-                                 chart_data = chart_data.head(20)
-
-
-                             st.altair_chart(
-                                 alt.Chart(chart_data).mark_bar().encode(
-                                     x=alt.X('Category', sort='-y', title=col.replace('_', ' ').title()),
-                                     y=alt.Y('Count', title='Count'),
-                                     tooltip=['Category', 'Count']
-                                 ).properties(title=f"Combined {col.replace('_', ' ').title()}"),
-                                 use_container_width=True
-                             )
-                         else:
-                              st.info(f"No valid data for '{col.replace('_', ' ').title()}' across loaded datasets.")
+                     st.markdown(f"**{col.replace('_', ' ').title()} Distribution**")
+                     combined_counts = pd.concat(
+                         [cube.rollup(col) for cube in overall_cubes.values() if col in cube.tables]
+                     ).groupby(level=0, sort=False).sum().sort_values(ascending=False)
+                     # Exclude empty strings and 'nan'/'None' labels from the charts
+                     combined_counts = combined_counts[~combined_counts.index.isin(['', 'nan', 'None'])]
+                     if not combined_counts.empty:
+                         chart_data = combined_counts.reset_index()
+                         chart_data.columns = ['Category', 'Count']
+                         # Limit categories if too many for a readable bar chart
+                         other_caption(chart_data, BAR_CHART_MAX_CATEGORIES, f"categories for {col.replace('_', ' ').title()}")
+                         chart_data = top_n_with_other(chart_data, 'Category', 'Count', BAR_CHART_MAX_CATEGORIES)
+
+
+                         st.altair_chart(
+                             alt.Chart(chart_data).mark_bar().encode(
+                                 x=alt.X('Category', sort=list(chart_data['Category']), title=col.replace('_', ' ').title()),
+                                 y=alt.Y('Count', title='Count'),
+                                 tooltip=['Category', 'Count']
+                             ).properties(title=f"Combined {col.replace('_', ' ').title()}"),
+                             use_container_width=True
+                         )
+                     else:
+                          st.info(f"No valid data for '{col.replace('_', ' ').title()}' across loaded datasets.")
 
 
                 # Distribution by Source Brand (to see how many respondents each dataset contributed)
-                st.markdown("**Respondent Count by Source Brand**")
-                source_counts = combined_demographics['Source Brand'].value_counts().reset_index()
-                source_counts.columns = ['Source Brand', 'Count']
+                # Bars use the same (weighted) base as the distributions above; the raw count stays in the tooltip
+                weighted_sources = any(overall_cubes[brand_name].weighted for brand_name in demo_brands)
+                count_label = 'Weighted Base' if weighted_sources else 'Respondents'
+                st.markdown(f"**{'Weighted Base' if weighted_sources else 'Respondent Count'} by Source Brand**")
+                source_counts = pd.DataFrame({
+                    'Source Brand': demo_brands,
+                    count_label: [overall_cubes[brand_name].base() for brand_name in demo_brands],
+                    'Unweighted Respondents': [overall_cubes[brand_name].n_rows for brand_name in demo_brands]
+                }).sort_values(count_label, ascending=False)
                 st.altair_chart(
                      alt.Chart(source_counts).mark_bar().encode(
-                         x='Source Brand', y='Count', tooltip=['Source Brand', 'Count']
-                     ).properties(title="Respondents per Source Dataset"),
+                         x='Source Brand', y=count_label, tooltip=['Source Brand', count_label, 'Unweighted Respondents']
+                     ).properties(title="Respondents per Source Dataset" + (" (weighted)" if weighted_sources else "")),
                      use_container_width=True
                 )
 
@@ -287,24 +2683,72 @@ with col_insights:
                  st.info("No common demographic data (Age Group, Gender, Income, Location, Region, Marital Status, Children under 5) found across the selected and uploaded datasets.")
 
 
+            # --- Cross-Brand Comparison (aligned columns and harmonised categories) ---
+            st.subheader("Cross-Brand Comparison")
+            st.write("Share of each brand's respondents per category, with equivalent columns aligned across surveys.")
+            brands_key = tuple((brand_name, dataset_fingerprint(df)) for brand_name, df in sorted(loaded_dataframes_overall.items()))
+            share_matrices = cross_brand_share_matrices(brands_key, loaded_dataframes_overall)
+            if share_matrices:
+                comparison_dim = st.selectbox(
+                    "Compare brands by:",
+                    list(share_matrices),
+                    format_func=lambda dim: dim.replace('_', ' ').title(),
+                    key='overall_comparison_dim'
+                )
+                share_matrix = share_matrices[comparison_dim]
+                share_long = share_matrix.reset_index().melt(id_vars='Brand', var_name='Category', value_name='Share')
+                heatmap = alt.Chart(share_long).mark_rect().encode(
+                    x=alt.X('Category:N', title=comparison_dim.replace('_', ' ').title()),
+                    y=alt.Y('Brand:N', title='Brand'),
+                    color=alt.Color('Share:Q', title='Share of Respondents', scale=alt.Scale(scheme='blues')),
+                    tooltip=['Brand', 'Category', alt.Tooltip('Share:Q', format='.1%')]
+                )
+                labels = heatmap.mark_text(baseline='middle').encode(
+                    text=alt.Text('Share:Q', format='.0%'),
+                    color=alt.value('black')
+                )
+                st.altair_chart((heatmap + labels).properties(title=f"Share of Respondents by {comparison_dim.replace('_', ' ').title()}"), use_container_width=True)
+                st.dataframe(share_matrix.style.format('{:.1%}'), use_container_width=True)
+            else:
+                st.info("No comparable demographic columns found across the selected datasets.")
+
+
+            # --- Key Metric by Demographic (crosstabs rolled up from the response cubes) ---
+            st.subheader("Key Metric by Demographic")
+            breakdown_dims = [dim for dim in SEGMENT_DIMENSIONS if any(dim in cube.dims for cube in overall_cubes.values())]
+            if breakdown_dims:
+                breakdown_dim = st.selectbox(
+                    "Break key metrics down by:",
+                    breakdown_dims,
+                    format_func=lambda dim: dim.replace('_', ' ').title(),
+                    key='overall_breakdown_dim'
+                )
+                for brand_name, cube in sorted(overall_cubes.items()):
+                    metric_col = BRAND_REPRESENTATIVE_METRICS.get(brand_name)
+                    if metric_col not in cube.tables or breakdown_dim not in cube.dims:
+                        continue
+                    breakdown = cube.rollup(metric_col, by=[breakdown_dim]).reset_index()
+                    breakdown = breakdown[(breakdown[breakdown_dim] != 'nan') & (breakdown['answer'] != 'nan')]
+                    if breakdown.empty:
+                        continue
+                    st.altair_chart(
+                        alt.Chart(breakdown).mark_bar().encode(
+                            x=alt.X('count:Q', stack='normalize', title='Share of Respondents'),
+                            y=alt.Y(f'{breakdown_dim}:N', title=breakdown_dim.replace('_', ' ').title()),
+                            color=alt.Color('answer:N', title=metric_col.replace('_', ' ').title()),
+                            tooltip=[breakdown_dim, 'answer', 'count']
+                        ).properties(title=f"{brand_name}: {metric_col.replace('_', ' ').title()} by {breakdown_dim.replace('_', ' ').title()}"),
+                        use_container_width=True
+                    )
+            else:
+                st.info("No segment dimensions (Gender, Age Group, Income, Region) found in the selected datasets.")
+
+
             st.subheader("Key Insights by Brand")
             st.write("Below are value counts for a representative key metric identified for each uploaded dataset.")
 
-            # Define a mapping of brand names to ONE representative key column for display
-            # Use the preprocessed column names (lowercase, snake_case)
-            brand_representative_metrics = {
-                'AirAsia': 'brand', # Example: Airline Brand Selected
-                'Cheetos': 'preferred_snack_brand', # Example: Preferred Snack Brand
-                'Mucilion': 'purchased_brand', # Example: Purchased Brand
-                'RTD Drinks': 'brand_aware_coca_cola', # Example: Awareness of Coke (Adjust if Coke is not the focus)
-                'Fried Chicken': 'brand_you_visit_the_most', # Example: Most Visited Brand (Check if this column exists after preprocess)
-                'Chocolate': 'prefer_kitkat', # Example: Preference for Kitkat (Adjust if Kitkat is not the focus)
-                'Phones': 'current_phone_samsung', # Example: Own Samsung Phone
-                'Coca-Cola': 'best_choice_softdrink', # Example: Favorite Soft Drink Brand (Check if this column exists after preprocess)
-                'Mudah': 'likelihood_to_purchase_via_mudah_next_6_months', # Example: Purchase Intent (Check if this column exists after preprocess)
-                'KFC': 'brand_you_visit_the_most', # Example: Most Visited Fast Food Brand (Check if this column exists after preprocess)
-                'Panasonic': 'panasonic', # Example: Own Panasonic Hairdryer (Check if this column exists after preprocess)
-            }
+            # ONE representative key column per brand (defined with the column specs)
+            brand_representative_metrics = BRAND_REPRESENTATIVE_METRICS
 
             # Filter out metrics for brands that weren't loaded
             available_metrics = {brand: col_key for brand, col_key in brand_representative_metrics.items() if brand in loaded_dataframes_overall}
@@ -333,15 +2777,14 @@ with col_insights:
                              st.markdown(f"#### {brand_name}: {col_key.replace('_', ' ').title()}")
                               # Get value counts, including NaN for completeness unless explicitly dropped
                               # Convert column to string first to handle mixed types and NaNs gracefully
-                             data_counts = df[col_key].astype(str).value_counts(dropna=False).reset_index()
+                             data_counts = overall_cubes[brand_name].rollup(col_key).reset_index()
                              data_counts.columns = ['Response', 'Count']
                               # Replace 'nan' string with something more readable
                              data_counts['Response'] = data_counts['Response'].replace('nan', 'No Response / N/A')
 
                               # Limit responses shown if too many categories
-                             if len(data_counts) > 15: # Arbitrary limit for summary table
-                                   st.write("(Showing top 15 responses)")
-                                   data_counts = data_counts.head(15)
+                             other_caption(data_counts, PIE_CHART_MAX_CATEGORIES, "responses")
+                             data_counts = top_n_with_other(data_counts, 'Response', 'Count', PIE_CHART_MAX_CATEGORIES)
 
                              if not data_counts.empty:
                                    st.dataframe(data_counts, use_container_width=True, height=300) # Fixed height for consistency
@@ -365,6 +2808,9 @@ with col_insights:
             else:
                  st.info("Could not identify or find representative key metrics for the selected and uploaded datasets.")
 
+    with brand_insight_tab_map["💡 Overall Insights"]:
+        overall_insights_section()
+
     # --- Individual Brand Tabs Content (Original Code Structure - Nested within col_insights) ---
     # Need to map original tab variables to the new nested tab objects
     # Overall tab is index 0, so original tabs start from index 1
@@ -388,10 +2834,13 @@ with col_insights:
 
     # AIRASIA TAB
     if airasia_tab:
-        with airasia_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def airasia_section():
             st.header("📋 AirAsia ")
             if airasia_file:
-                df = preprocess(pd.read_csv(airasia_file))
+                df = load_dataset(airasia_file, BRAND_COLUMN_SPECS["AirAsia"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
 
                 if not df.empty:
                     # --- Key Fields (auto-detected/defined) ---
@@ -401,8 +2850,8 @@ with col_insights:
                     brand_col = 'brand' # Example, verify actual column name
 
                     if seen_ads_col in df.columns:
-                        bar_chart(df.astype(str).value_counts([seen_ads_col]).reset_index(),
-                                  seen_ads_col, 0, # Use index 0 for the count column name
+                        bar_chart(count_values(df, seen_ads_col).reset_index(),
+                                  seen_ads_col, 'count',
                                   "🪧 Seen Airline Billboard Ads") # Added title and icon
                     else:
                          st.info(f"Column '{seen_ads_col}' not found in AirAsia data.")
@@ -411,7 +2860,7 @@ with col_insights:
                     st.subheader("👤 Demographics")
                     for col in demographic_cols:
                         if col in df.columns:
-                             chart_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                             chart_data = count_values(df, col).reset_index()
                              chart_data.columns = [col, 'count']
                              bar_chart(chart_data, col, 'count', col.replace('_', ' ').title())
                         else:
@@ -420,8 +2869,8 @@ with col_insights:
 
                     # --- Brand Preference ---
                     if brand_col in df.columns:
-                        pie_chart(df.astype(str).value_counts([brand_col]).reset_index(),
-                                  brand_col, 0, # Use index 0 for the count column name
+                        pie_chart(count_values(df, brand_col).reset_index(),
+                                  brand_col, 'count',
                                   "✈️ Airline Brand Selected") # Added title and icon
                     else:
                         st.info(f"Brand column '{brand_col}' not found in AirAsia data.")
@@ -431,20 +2880,27 @@ with col_insights:
             else:
                 st.info("Please upload the AirAsia CSV file above.")
 
+        with airasia_tab:
+            airasia_section()
+
 
     # CHEETOS TAB
     if cheetos_tab:
-        with cheetos_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def cheetos_section():
             st.header("🧀 Cheetos")
             if cheetos_file:
-                df = preprocess(pd.read_csv(cheetos_file))
+                df = load_dataset(cheetos_file, BRAND_COLUMN_SPECS["Cheetos"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # Section 1: Demographics
                     st.header("👥 Demographics")
                     for col in ['age_group', 'gender', 'city']:
                         if col in df.columns:
-                            data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = [col.title().replace('_', ' '), 'Count']
                             bar_chart(data, data.columns[0], 'Count', data.columns[0])
                         else:
@@ -455,7 +2911,7 @@ with col_insights:
                     st.header("📢 Ad Exposure & Recall")
                     for col in ['seen_snack_ads', 'recall_snack_ads']:
                         if col in df.columns:
-                            data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = [col.title().replace('_', ' '), 'Count']
                             pie_chart(data, data.columns[0], 'Count', data.columns[0])
                         else:
@@ -466,7 +2922,7 @@ with col_insights:
                     st.header("🏷️ Ad Brand and Slogan")
                     for col in ['ad_brand_snack', 'ad_slogan_snack']:
                          if col in df.columns:
-                            data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = [col.title().replace('_', ' '), 'Count']
                             bar_chart(data, data.columns[0], 'Count', data.columns[0])
                          else:
@@ -475,17 +2931,14 @@ with col_insights:
 
                     # Section 4: Brand Familiarity
                     st.header("🔍 Familiarity with Snack Brands")
-                    fam_cols = [col for col in df.columns if col.startswith('familiar_')]
-                    # Filter to columns that actually exist in the dataframe
-                    existing_fam_cols = [col for col in fam_cols if col in df.columns]
+                    existing_fam_cols = col_idx.startswith('familiar_')
 
                     if existing_fam_cols:
-                        fam_data = df[existing_fam_cols].astype(str).melt(var_name='Brand_Col', value_name='Response')
-                        fam_data = fam_data[fam_data['Response'].str.strip().str.lower() != 'nan'] # Filter out NaNs turned to string
+                        fam_counts = count_block_mentions(df, existing_fam_cols) # Missing answers left out
 
-                        if not fam_data.empty:
+                        if not fam_counts.empty:
                             # Use Response directly for counting as multiple brands might have "Cheetos" etc.
-                            brand_counts = fam_data['Response'].str.strip().value_counts().reset_index()
+                            brand_counts = fam_counts.reset_index()
                             brand_counts.columns = ['Brand', 'Count']
                             bar_chart(brand_counts, 'Brand', 'Count', "Familiarity Mentions by Brand")
                         else:
@@ -497,7 +2950,7 @@ with col_insights:
                     # Section 5: Preferred Brand
                     st.header("⭐ Preferred Snack Brand")
                     if 'preferred_snack_brand' in df.columns:
-                        pref = df['preferred_snack_brand'].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                        pref = count_values(df, 'preferred_snack_brand').reset_index()
                         pref.columns = ['Brand', 'Count']
                         bar_chart(pref, 'Brand', 'Count', "Preferred Snack Brand")
                     else:
@@ -507,7 +2960,7 @@ with col_insights:
                     # Section 6: Likelihood to Buy Cheetos
                     st.header("🛒 Likelihood to Buy Cheetos")
                     if 'likelihood_buy_cheetos' in df.columns:
-                        like = df['likelihood_buy_cheetos'].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                        like = count_values(df, 'likelihood_buy_cheetos').reset_index()
                         like.columns = ['Likelihood', 'Count']
                         pie_chart(like, 'Likelihood', 'Count', "Likelihood to Buy Cheetos")
                     else:
@@ -517,7 +2970,7 @@ with col_insights:
                     # Section 7: Feelings about Cheetos
                     st.header("💬 Feelings about Cheetos")
                     if 'feelings_cheetos' in df.columns:
-                        feeling = df['feelings_cheetos'].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                        feeling = count_values(df, 'feelings_cheetos').reset_index()
                         feeling.columns = ['Feeling', 'Count']
                         bar_chart(feeling, 'Feeling', 'Count', "Feelings about Cheetos")
                     else:
@@ -528,12 +2981,19 @@ with col_insights:
             else:
                 st.info("Please upload the Cheetos CSV file above.")
 
+        with cheetos_tab:
+            cheetos_section()
+
     # MUCILION TAB
     if mucilion_tab:
-        with mucilion_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def mucilion_section():
             st.header("🟡 Mucilion")
             if mucilion_file:
-                df = preprocess(pd.read_csv(mucilion_file))
+                df = load_dataset(mucilion_file, BRAND_COLUMN_SPECS["Mucilion"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # Section 1: Demographics
@@ -541,7 +3001,7 @@ with col_insights:
                     demo_cols = ['age_group', 'gender', 'marital_status', 'region', 'children_under_5']
                     for col in demo_cols:
                         if col in df.columns:
-                            data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = [col.title().replace('_', ' '), 'Count']
                             bar_chart(data, data.columns[0], 'Count', data.columns[0])
                         else:
@@ -552,7 +3012,7 @@ with col_insights:
                     st.header("📢 Ad Exposure & Recall")
                     for col in ['seen_ad', 'recall_ad']:
                         if col in df.columns:
-                            data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = [col.title().replace('_', ' '), 'Count']
                             pie_chart(data, data.columns[0], 'Count', data.columns[0])
                         else:
@@ -563,7 +3023,7 @@ with col_insights:
                     st.header("🏷️ Ad Brand and Message Breakdown")
                     for col in ['ad_brand', 'ad_message']:
                          if col in df.columns:
-                            data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = [col.title().replace('_', ' '), 'Count']
                             bar_chart(data, data.columns[0], 'Count', data.columns[0])
                          else:
@@ -572,14 +3032,12 @@ with col_insights:
 
                     # Section 4: Brand Awareness
                     st.header("📌 Brand Awareness")
-                    awareness_cols = [col for col in df.columns if col.startswith('aware_brand')]
-                    existing_awareness_cols = [col for col in awareness_cols if col in df.columns]
+                    existing_awareness_cols = col_idx.startswith('aware_brand')
                     if existing_awareness_cols:
-                        awareness_data = df[existing_awareness_cols].astype(str).melt(var_name='Brand_Slot', value_name='Brand')
-                        awareness_data = awareness_data[awareness_data['Brand'].str.strip().str.lower() != 'nan'] # Filter out NaNs
+                        awareness_counts = count_block_mentions(df, existing_awareness_cols) # Missing answers left out
 
-                        if not awareness_data.empty:
-                            brand_counts = awareness_data['Brand'].str.strip().value_counts().reset_index()
+                        if not awareness_counts.empty:
+                            brand_counts = awareness_counts.reset_index()
                             brand_counts.columns = ['Brand', 'Count']
                             bar_chart(brand_counts, 'Brand', 'Count', "Brand Awareness Mentions")
                         else:
@@ -590,7 +3048,7 @@ with col_insights:
                     # Section 5: Purchased Brand
                     st.header("🛒 Purchased Brand")
                     if 'purchased_brand' in df.columns:
-                        purchased = df['purchased_brand'].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                        purchased = count_values(df, 'purchased_brand').reset_index()
                         purchased.columns = ['Brand', 'Count']
                         pie_chart(purchased, 'Brand', 'Count', "Purchased Brand")
                     else:
@@ -599,14 +3057,12 @@ with col_insights:
 
                     # Section 6: Future Purchase Intent
                     st.header("🔮 Likely Future Brand Purchase")
-                    likely_cols = [col for col in df.columns if col.startswith('likely_buy_')]
-                    existing_likely_cols = [col for col in likely_cols if col in df.columns]
+                    existing_likely_cols = col_idx.startswith('likely_buy_')
                     if existing_likely_cols:
-                        future_data = df[existing_likely_cols].astype(str).melt(var_name='Intent_Slot', value_name='Brand')
-                        future_data = future_data[future_data['Brand'].str.strip().str.lower() != 'nan'] # Filter out NaNs
+                        future_mentions = count_block_mentions(df, existing_likely_cols) # Missing answers left out
 
-                        if not future_data.empty:
-                            future_counts = future_data['Brand'].str.strip().value_counts().reset_index()
+                        if not future_mentions.empty:
+                            future_counts = future_mentions.reset_index()
                             future_counts.columns = ['Brand', 'Count']
                             bar_chart(future_counts, 'Brand', 'Count', "Likely Future Brand Purchase Mentions")
                         else:
@@ -618,12 +3074,19 @@ with col_insights:
             else:
                 st.info("Please upload the Mucilion CSV file above.")
 
+        with mucilion_tab:
+            mucilion_section()
+
     # RTD DRINKS TAB
     if rtd_tab:
-        with rtd_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def rtd_section():
             st.header("🥤 RTD Drinks")
             if rtd_file:
-                df = preprocess(pd.read_csv(rtd_file))
+                df = load_dataset(rtd_file, BRAND_COLUMN_SPECS["RTD Drinks"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # ---- DEMOGRAPHICS ----
@@ -632,7 +3095,7 @@ with col_insights:
                     demo_cols = ['gender', 'age', 'household_income', 'location']
                     for col in demo_cols:
                         if col in df.columns:
-                            chart_data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            chart_data = count_values(df, col).reset_index()
                             chart_data.columns = ['Category', 'Count']
                             bar_chart(chart_data, 'Category', 'Count', col.replace('_', ' ').title())
                         else:
@@ -641,41 +3104,36 @@ with col_insights:
                     # ---- BRAND AWARENESS ----
                     st.subheader("🔎 Brand Awareness (Pie Chart)")
                     # Use preprocessed column names
-                    brand_aware_cols = [col for col in df.columns if col.startswith('brand_aware_') and 'none' not in col]
-                    existing_brand_aware_cols = [col for col in brand_aware_cols if col in df.columns]
+                    aware_block = multi_response_block(df, 'brand_aware')
+                    existing_brand_aware_cols = [col for col in aware_block.options if 'none' not in col] if aware_block else []
                     if existing_brand_aware_cols:
                         for col in existing_brand_aware_cols:
                             # Extract brand name from preprocessed column
-                            brand = col.replace('brand_aware_', '', regex=False).replace('_', ' ').title()
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
-                            data.columns = ['Response', 'Count']
+                            brand = col.replace('brand_aware_', '').replace('_', ' ').title()
+                            data = ticked_counts(aware_block, col) # Popcount of the packed awareness block
                             st.markdown(f"**{brand}**") # Use markdown for smaller title within subheader
                             pie_chart(data, 'Response', 'Count', f"{brand} Awareness")
+                        if len(existing_brand_aware_cols) > 1:
+                            co_occurrence_chart(aware_block, existing_brand_aware_cols, 'Aware Of', "🔗 Aware of Both Brands", strip='^brand_aware_')
                     else:
                          st.info("No brand awareness columns found (e.g., 'brand_aware_coca_cola').")
 
                     # ---- OVERALL AD RECALL PERFORMANCE ----
                     st.subheader("📢 Overall Brand Ad Recall Performance (Yes Responses)")
                     # Use preprocessed column names
-                    recall_cols = [col for col in df.columns if col.startswith('brand_ad_aware_')]
-                    existing_recall_cols = [col for col in recall_cols if col in df.columns]
-
-                    if existing_recall_cols:
-                        recall_melted = df[existing_recall_cols].astype(str).melt(var_name='Brand_Col', value_name='Response')
-                        # Filter out non-response entries (like 'nan', 'None', etc.) and keep only 'Yes'
-                        recall_melted = recall_melted[recall_melted['Response'].str.strip().str.lower() == 'yes'] # Assuming responses are 'Yes'/'No'
-
-                        if not recall_melted.empty:
-                             # Extract Brand Name from the column name like 'brand_ad_aware_coca_cola_c1'
-                             # Need a more robust way to get brand name
-                             # Let's just use the full column name for grouping initially if structure is complex
-                             # Or assume brand is between brand_ad_aware_ and _c1/c2
-                            recall_melted['Brand'] = recall_melted['Brand_Col'].str.replace('brand_ad_aware_', '', regex=False).str.replace('_c[0-9]+', '', regex=True).str.replace('_', ' ').str.title()
-
-                            # Count 'Yes' responses per brand
-                            yes_recall_counts = recall_melted.groupby('Brand').size().reset_index(name='Yes Count')
-
-                            bar_chart(yes_recall_counts, 'Brand', 'Yes Count', "Brand Ad Recall (Yes Responses)")
+                    recall_block = multi_response_block(df, 'brand_ad_aware')
+
+                    if recall_block is not None:
+                        # Brand from column names like 'brand_ad_aware_coca_cola_c1' (several columns per brand)
+                        recall_brands = [re.sub('_c[0-9]+', '', col.replace('brand_ad_aware_', '')).replace('_', ' ').title()
+                                         for col in recall_block.options]
+                        recall_stats, recall_p_values = block_share_stats(recall_block, recall_brands) # Popcounts of the packed recall block
+
+                        if recall_stats['Yes Count'].sum() > 0:
+                            share_chart(recall_stats, recall_p_values, 'Brand', "Brand Ad Recall (Yes Responses)")
+                            recall_c1_cols = [col for col in recall_block.options if col.endswith('_c1')]
+                            if len(recall_c1_cols) > 1:
+                                co_occurrence_chart(recall_block, recall_c1_cols, 'Recalled', "🔗 Recalled Ads for Both Brands (C1)", strip='^brand_ad_aware_|_c1$')
                         else:
                             st.info("No 'Yes' responses found for ad recall across brands.")
                     else:
@@ -685,14 +3143,13 @@ with col_insights:
                     # ---- HOT WEATHER BRAND PREFERENCE ----
                     st.subheader("🌞 Brand Preference in Hot Weather")
                     # Use preprocessed column names
-                    hot_weather_cols = [col for col in df.columns if col.startswith('hot_weather_purchase')]
-                    existing_hot_weather_cols = [col for col in hot_weather_cols if col in df.columns]
+                    existing_hot_weather_cols = col_idx.startswith('hot_weather_purchase')
 
                     if existing_hot_weather_cols:
                         for col in existing_hot_weather_cols:
                             # Extract brand name from preprocessed column
                             brand = col.replace('hot_weather_purchase_', '').replace('_', ' ').title()
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = ['Response', 'Count']
 
                             # Skip if no data points exist after value_counts (can happen if column is all NaN)
@@ -715,12 +3172,19 @@ with col_insights:
             else:
                 st.info("Please upload the RTD Drinks CSV file above.")
 
+        with rtd_tab:
+            rtd_section()
+
     # FRIED CHICKEN TAB
     if fried_tab:
-        with fried_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def fried_section():
             st.header("🍗 Fried Chicken")
             if fried_file:
-                df = preprocess(pd.read_csv(fried_file))
+                df = load_dataset(fried_file, BRAND_COLUMN_SPECS["Fried Chicken"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # ---- DEMOGRAPHICS ----
@@ -729,7 +3193,7 @@ with col_insights:
                     demo_cols = ['gender', 'age_group', 'household_income', 'location']
                     for col in demo_cols:
                         if col in df.columns:
-                            chart_data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            chart_data = count_values(df, col).reset_index()
                             chart_data.columns = ['Category', 'Count']
                             bar_chart(chart_data, 'Category', 'Count', col.replace('_', ' ').title())
                         else:
@@ -738,15 +3202,13 @@ with col_insights:
                     # ---- TOP OF MIND ----
                     st.subheader("💭 Top of Mind Awareness")
                     # Use preprocessed column names
-                    mind_cols = [col for col in df.columns if col.startswith('mind_')]
-                    existing_mind_cols = [col for col in mind_cols if col in df.columns]
+                    existing_mind_cols = col_idx.startswith('mind_')
                     if existing_mind_cols:
-                        mind_melted = df[existing_mind_cols].astype(str).melt(var_name='Mind_Col', value_name='Response')
-                        mind_melted = mind_melted[mind_melted['Response'].str.strip().str.lower() != 'nan']
+                        mind_mentions = count_block_mentions(df, existing_mind_cols)
 
-                        if not mind_melted.empty:
+                        if not mind_mentions.empty:
                             # Count occurrences of each unique response across all 'mind_' columns
-                            mind_counts = mind_melted['Response'].str.strip().value_counts().reset_index()
+                            mind_counts = mind_mentions.reset_index()
                             mind_counts.columns = ['Brand / Response', 'Count']
                             bar_chart(mind_counts, 'Brand / Response', 'Count', "Top of Mind Mentions")
                         else:
@@ -760,7 +3222,7 @@ with col_insights:
                     # Use preprocessed column names
                     if 'recall_fried_chicken_ad' in df.columns:
                         st.markdown("**Recall Seeing a Fried Chicken Ad**")
-                        recall_data = df['recall_fried_chicken_ad'].astype(str).value_counts(dropna=False).reset_index()
+                        recall_data = count_values(df, 'recall_fried_chicken_ad').reset_index()
                         recall_data.columns = ['Response', 'Count']
                         pie_chart(recall_data, 'Response', 'Count', "Recall Seeing Fried Chicken Ad")
                     else:
@@ -768,7 +3230,7 @@ with col_insights:
 
                     if 'ad_fried_chicken_brand' in df.columns:
                         st.markdown("**Ad Brand Recalled**")
-                        ad_brand_data = df['ad_fried_chicken_brand'].astype(str).value_counts(dropna=False).reset_index()
+                        ad_brand_data = count_values(df, 'ad_fried_chicken_brand').reset_index()
                         ad_brand_data.columns = ['Brand', 'Count']
                         bar_chart(ad_brand_data, 'Brand', 'Count', "Ad Brand Recalled", sort_order='-y')
                     else:
@@ -778,14 +3240,12 @@ with col_insights:
                     # ---- BIGGEST BRAND PERCEPTION ----
                     st.subheader("🏆 Biggest Fried Chicken Brand Perception")
                     # Use preprocessed column names
-                    biggest_cols = [col for col in df.columns if col.startswith('biggest_')]
-                    existing_biggest_cols = [col for col in biggest_cols if col in df.columns]
+                    existing_biggest_cols = col_idx.startswith('biggest_')
                     if existing_biggest_cols:
-                        biggest_melted = df[existing_biggest_cols].astype(str).melt(var_name='Biggest_Col', value_name='Response')
-                        biggest_melted = biggest_melted[biggest_melted['Response'].str.strip().str.lower() != 'nan']
+                        biggest_mentions = count_block_mentions(df, existing_biggest_cols)
 
-                        if not biggest_melted.empty:
-                            biggest_counts = biggest_melted['Response'].str.strip().value_counts().reset_index()
+                        if not biggest_mentions.empty:
+                            biggest_counts = biggest_mentions.reset_index()
                             biggest_counts.columns = ['Brand / Response', 'Count']
                             bar_chart(biggest_counts, 'Brand / Response', 'Count', "Perception: Biggest Fried Chicken Brand")
                         else:
@@ -797,14 +3257,12 @@ with col_insights:
                     # ---- TASTE PERCEPTION ----
                     st.subheader("😋 Tastiest Fried Chicken Perception")
                     # Use preprocessed column names
-                    tastiest_cols = [col for col in df.columns if col.startswith('tastiest_')]
-                    existing_tastiest_cols = [col for col in tastiest_cols if col in df.columns]
+                    existing_tastiest_cols = col_idx.startswith('tastiest_')
                     if existing_tastiest_cols:
-                        tastiest_melted = df[existing_tastiest_cols].astype(str).melt(var_name='Tastiest_Col', value_name='Response')
-                        tastiest_melted = tastiest_melted[tastiest_melted['Response'].str.strip().str.lower() != 'nan']
+                        tastiest_mentions = count_block_mentions(df, existing_tastiest_cols)
 
-                        if not tastiest_melted.empty:
-                            tastiest_counts = tastiest_melted['Response'].str.strip().value_counts().reset_index()
+                        if not tastiest_mentions.empty:
+                            tastiest_counts = tastiest_mentions.reset_index()
                             tastiest_counts.columns = ['Brand / Response', 'Count']
                             bar_chart(tastiest_counts, 'Brand / Response', 'Count', "Perception: Tastiest Fried Chicken Brand")
                         else:
@@ -816,13 +3274,17 @@ with col_insights:
                     # ---- NEXT PURCHASE ----
                     st.subheader("🛒 Next Purchase Intent")
                     # Use preprocessed column names
-                    buy_cols = [col for col in df.columns if col.startswith('next_buy_')]
-                    existing_buy_cols = [col for col in buy_cols if col in df.columns]
+                    existing_buy_cols = col_idx.startswith('next_buy_')
                     if existing_buy_cols:
+                        likert_buy_cols = likert_columns(df, existing_buy_cols)
+                        if likert_buy_cols:
+                            likert_summary_chart(likert_summary(df, likert_buy_cols, [col.replace('next_buy_', '').replace('_', ' ').title() for col in likert_buy_cols]),
+                                                 'Brand', "Next Purchase Intent Scores")
+                        unscored_ratings_caption(df, existing_buy_cols, likert_buy_cols)
                         for col in existing_buy_cols:
                             # Extract brand name from preprocessed column
                             brand = col.replace('next_buy_', '').replace('_', ' ').title()
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = ['Response', 'Count']
 
                              # Skip if no data points exist after value_counts
@@ -845,12 +3307,19 @@ with col_insights:
             else:
                 st.info("Please upload the Fried Chicken CSV file above.")
 
+        with fried_tab:
+            fried_section()
+
     # CHOCOLATE TAB
     if choco_tab:
-        with choco_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def choco_section():
             st.header("🍫 Chocolate")
             if choco_file:
-                df = preprocess(pd.read_csv(choco_file))
+                df = load_dataset(choco_file, BRAND_COLUMN_SPECS["Chocolate"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # --- DEMOGRAPHICS ---
@@ -858,11 +3327,11 @@ with col_insights:
                     # Use preprocessed column names
                     demo_cols = ['gender', 'age', 'household_income', 'location']
                     # Filter to columns that actually exist
-                    existing_demo_cols = [col for col in demo_cols if col in df.columns]
+                    existing_demo_cols = col_idx.existing(demo_cols)
                     if existing_demo_cols:
                         cols = st.columns(len(existing_demo_cols))
                         for i, col in enumerate(existing_demo_cols):
-                             chart_data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                             chart_data = count_values(df, col).reset_index()
                              chart_data.columns = ['Category', 'Count']
                              with cols[i]:
                                 bar_chart(chart_data, 'Category', 'Count', col.replace('_', ' ').title())
@@ -873,7 +3342,7 @@ with col_insights:
                     # Use preprocessed column names
                     if 'seen_chocolate_ad' in df.columns:
                         st.subheader("📺 Seen Chocolate Ads")
-                        seen_ads = df['seen_chocolate_ad'].astype(str).value_counts(dropna=False).reset_index()
+                        seen_ads = count_values(df, 'seen_chocolate_ad').reset_index()
                         seen_ads.columns = ['Seen', 'Count']
                         pie_chart(seen_ads, 'Seen', 'Count', "Seen Chocolate Ads")
                     else:
@@ -883,20 +3352,14 @@ with col_insights:
                     # --- AD RECALL ---
                     st.subheader("🔁 Ad Recall per Brand (Yes Responses)")
                     # Use preprocessed column names
-                    ad_cols = [col for col in df.columns if col.startswith('ad_') and col not in ['ad_others_1', 'ad_others_2']]
-                    existing_ad_cols = [col for col in ad_cols if col in df.columns]
+                    existing_ad_cols = [col for col in col_idx.startswith('ad_') if col not in ['ad_others_1', 'ad_others_2']]
                     if existing_ad_cols:
-                        ad_melted = df[existing_ad_cols].astype(str).melt(var_name='Ad_Col', value_name='Response')
-                        # Filter out non-response entries and keep only 'Yes'
-                        ad_melted = ad_melted[ad_melted['Response'].str.strip().str.lower() == 'yes']
-
-                        if not ad_melted.empty:
-                             # Extract Brand Name from column names like 'ad_kitkat', 'ad_cadbury'
-                            ad_melted['Brand'] = ad_melted['Ad_Col'].str.replace('ad_', '', regex=False).str.replace('_', ' ').str.title()
-                            # Count 'Yes' responses per brand
-                            yes_recall_counts = ad_melted.groupby('Brand').size().reset_index(name='Yes Count')
+                        # Brand from column names like 'ad_kitkat', 'ad_cadbury'
+                        ad_brands = [col.replace('ad_', '', 1).replace('_', ' ').title() for col in existing_ad_cols]
+                        ad_stats, ad_p_values = yes_share_stats(df, existing_ad_cols, ad_brands)
 
-                            bar_chart(yes_recall_counts, 'Brand', 'Yes Count', "Ad Recall (Yes Responses) by Brand")
+                        if ad_stats['Yes Count'].sum() > 0:
+                            share_chart(ad_stats, ad_p_values, 'Brand', "Ad Recall (Yes Responses) by Brand")
                         else:
                              st.info("No 'Yes' responses found for ad recall across brands.")
                     else:
@@ -905,20 +3368,14 @@ with col_insights:
                     # --- PREFERENCE ---
                     st.subheader("💖 Brand Preference (Yes Responses)")
                     # Use preprocessed column names
-                    prefer_cols = [col for col in df.columns if col.startswith('prefer_')]
-                    existing_prefer_cols = [col for col in prefer_cols if col in df.columns]
+                    existing_prefer_cols = col_idx.startswith('prefer_')
                     if existing_prefer_cols:
-                        prefer_melted = df[existing_prefer_cols].astype(str).melt(var_name='Prefer_Col', value_name='Response')
-                        # Filter out non-response entries and keep only 'Yes'
-                        prefer_melted = prefer_melted[prefer_melted['Response'].str.strip().str.lower() == 'yes']
+                        # Brand from column names like 'prefer_kitkat', 'prefer_cadbury'
+                        prefer_brands = [col.replace('prefer_', '', 1).replace('_', ' ').title() for col in existing_prefer_cols]
+                        prefer_stats, prefer_p_values = yes_share_stats(df, existing_prefer_cols, prefer_brands)
 
-                        if not prefer_melted.empty:
-                             # Extract Brand Name from column names like 'prefer_kitkat', 'prefer_cadbury'
-                            prefer_melted['Brand'] = prefer_melted['Prefer_Col'].str.replace('prefer_', '', regex=False).str.replace('_', ' ').str.title()
-                            # Count 'Yes' responses per brand
-                            yes_prefer_counts = prefer_melted.groupby('Brand').size().reset_index(name='Yes Count')
-
-                            bar_chart(yes_prefer_counts, 'Brand', 'Yes Count', "Brand Preference (Yes Responses)")
+                        if prefer_stats['Yes Count'].sum() > 0:
+                            share_chart(prefer_stats, prefer_p_values, 'Brand', "Brand Preference (Yes Responses)")
                         else:
                             st.info("No 'Yes' responses found for brand preference across brands.")
                     else:
@@ -928,13 +3385,17 @@ with col_insights:
                     # --- LIKELY TO BUY ---
                     st.subheader("🛒 Likely to Buy")
                     # Use preprocessed column names
-                    likely_cols = [col for col in df.columns if col.startswith('likely_buy_')]
-                    existing_likely_cols = [col for col in likely_cols if col in df.columns]
+                    existing_likely_cols = col_idx.startswith('likely_buy_')
                     if existing_likely_cols:
+                        likert_likely_cols = likert_columns(df, existing_likely_cols)
+                        if likert_likely_cols:
+                            likert_summary_chart(likert_summary(df, likert_likely_cols, [col.replace('likely_buy_', '').replace('_', ' ').title() for col in likert_likely_cols]),
+                                                 'Brand', "Likely to Buy Scores")
+                        unscored_ratings_caption(df, existing_likely_cols, likert_likely_cols)
                         for col in existing_likely_cols:
                             # Extract brand name from preprocessed column
                             brand = col.replace('_likely_to_buy', '').replace('_', ' ').title()
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = ['Response', 'Count']
 
                             # Skip if no data points exist
@@ -957,23 +3418,30 @@ with col_insights:
             else:
                 st.info("Please upload the Chocolate CSV file above.")
 
+        with choco_tab:
+            choco_section()
+
     # PHONES TAB
     if phone_tab:
-        with phone_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def phone_section():
             st.header("📱 Phone Brands")
             if phone_file:
-                df = preprocess(pd.read_csv(phone_file))
+                df = load_dataset(phone_file, BRAND_COLUMN_SPECS["Phones"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # Preview
                     st.subheader("📄 Data Preview")
-                    st.dataframe(df.head(), use_container_width=True)
+                    data_grid(df, 'phone_grid')
 
                     # Demographics
                     st.subheader("👥 Demographics")
                     for col in ['age_group', 'gender']:
                         if col in df.columns:
-                             chart_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                             chart_data = count_values(df, col).reset_index()
                              chart_data.columns = ['Category', 'Count']
                              bar_chart(chart_data, 'Category', 'Count', col.replace('_', ' ').title())
                         else:
@@ -983,17 +3451,17 @@ with col_insights:
                     # Current Phone Ownership
                     st.subheader("📱 Current Phone Ownership")
                     # Use preprocessed column names
-                    current_phone_cols = [col for col in df.columns if 'current_phone_' in col]
-                    existing_current_phone_cols = [col for col in current_phone_cols if col in df.columns]
+                    phone_block = multi_response_block(df, 'current_phone')
+                    existing_current_phone_cols = phone_block.options if phone_block else []
                     if existing_current_phone_cols:
-                        # Melt the columns for a combined view if needed, or loop individually
-                        # Let's loop individually as in the original code
+                        # Let's loop individually as in the original code, counting from the packed block
                         for col in existing_current_phone_cols:
                             brand = col.replace('current_phone_', '').replace('_', ' ').title()
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
-                            data.columns = ['Response', 'Count']
+                            data = ticked_counts(phone_block, col)
                             st.markdown(f"**{brand}**") # Use markdown for smaller title within subheader
                             pie_chart(data, 'Response', 'Count', f"{brand} Ownership")
+                        if len(existing_current_phone_cols) > 1:
+                            co_occurrence_chart(phone_block, existing_current_phone_cols, 'Owns', "🔗 Owns Both Brands", strip='^current_phone_')
                     else:
                          st.info("No current phone ownership columns found (e.g., 'current_phone_samsung').")
 
@@ -1001,12 +3469,11 @@ with col_insights:
                     # Next Phone Purchase Intent
                     st.subheader("🛒 Next Phone Purchase Intent")
                     # Use preprocessed column names
-                    purchase_cols = [col for col in df.columns if 'next_purchase_' in col]
-                    existing_purchase_cols = [col for col in purchase_cols if col in df.columns]
+                    existing_purchase_cols = col_idx.containing('next_purchase_')
                     if existing_purchase_cols:
                         for col in existing_purchase_cols:
                             brand = col.replace('next_purchase_', '').replace('_', ' ').title()
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = ['Response', 'Count']
                             st.markdown(f"**{brand}**") # Use markdown for smaller title within subheader
                             pie_chart(data, 'Response', 'Count', f"{brand} Next Purchase Intent")
@@ -1017,11 +3484,10 @@ with col_insights:
                     # Ad Recall
                     st.subheader("📢 Ad Recall")
                     # Use preprocessed column names
-                    recall_cols = [col for col in df.columns if 'recall_ads' in col]
-                    existing_recall_cols = [col for col in recall_cols if col in df.columns]
+                    existing_recall_cols = col_idx.containing('recall_ads')
                     if existing_recall_cols:
                         for col in existing_recall_cols:
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = ['Response', 'Count']
                             st.markdown(f"**{col.replace('_', ' ').title()}**") # Use markdown for smaller title within subheader
                             pie_chart(data, 'Response', 'Count', f"{col.replace('_', ' ').title()} Ad Recall")
@@ -1032,20 +3498,27 @@ with col_insights:
             else:
                 st.info("Please upload the Samsung Phone CSV file above.")
 
+        with phone_tab:
+            phone_section()
+
 
     # COCA-COLA TAB
     if cola_tab:
-        with cola_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def cola_section():
             st.header("🥤 Coca-Cola ")
             if cola_file:
-                df=preprocess(pd.read_csv(cola_file))
+                df = load_dataset(cola_file, BRAND_COLUMN_SPECS["Coca-Cola"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # Demographics
                     st.subheader("👥 Demographics")
                     for col in ['age_group', 'gender']:
                         if col in df.columns:
-                             chart_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                             chart_data = count_values(df, col).reset_index()
                              chart_data.columns = ['Category', 'Count']
                              bar_chart(chart_data, 'Category', 'Count', col.replace('_', ' ').title())
                         else:
@@ -1054,11 +3527,10 @@ with col_insights:
                     # Location Visit Frequency
                     st.subheader("📍 Visited Locations")
                     # Use preprocessed column names
-                    visit_cols = [col for col in df.columns if col.startswith('visit_')]
-                    existing_visit_cols = [col for col in visit_cols if col in df.columns]
+                    existing_visit_cols = col_idx.startswith('visit_')
                     if existing_visit_cols:
                         for col in existing_visit_cols:
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = ['Visited', 'Count']
                             st.markdown(f"**{col.replace('visit_', '').replace('_', ' ').title()}**")
                             bar_chart(data, 'Visited', 'Count', f"{col.replace('visit_', '').replace('_', ' ').title()} Visit Frequency")
@@ -1068,11 +3540,10 @@ with col_insights:
                     # Ad Recall
                     st.subheader("📢 Ad Recall")
                     # Use preprocessed column names
-                    recall_cols = [col for col in df.columns if 'recall' in col or 'advertisement' in col]
-                    existing_recall_cols = [col for col in recall_cols if col in df.columns]
+                    existing_recall_cols = col_idx.containing('recall', 'advertisement')
                     if existing_recall_cols:
                         for col in existing_recall_cols:
-                             data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                             data = count_values(df, col).reset_index()
                              data.columns = ['Response', 'Count']
                              st.markdown(f"**{col.replace('_', ' ').title()}**")
                              bar_chart(data, 'Response', 'Count', f"{col.replace('_', ' ').title()} Ad Recall")
@@ -1082,12 +3553,11 @@ with col_insights:
                     # Brand Preference
                     st.subheader("🏆 Favorite Soft Drink Brand")
                     # Use preprocessed column names
-                    brand_cols = [col for col in df.columns if col.startswith('best_choice_')]
-                    existing_brand_cols = [col for col in brand_cols if col in df.columns]
+                    existing_brand_cols = col_idx.startswith('best_choice_')
                     if existing_brand_cols:
                         for col in existing_brand_cols:
                             if df[col].dropna().nunique() > 0: # Ensure column has non-NaN data
-                                chart_data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                                chart_data = count_values(df, col).reset_index()
                                 chart_data.columns = ['Brand', 'Count']
                                 st.markdown(f"**{col.replace('best_choice_', '').replace('_', ' ').title()}**")
                                 bar_chart(chart_data, 'Brand', 'Count', f"{col.replace('best_choice_', '').replace('_', ' ').title()} Preference")
@@ -1099,11 +3569,10 @@ with col_insights:
                     # Enjoyment
                     st.subheader("😋 Soft Drink Enjoyment")
                     # Use preprocessed column names
-                    enjoy_cols = [col for col in df.columns if col.startswith('enjoy_')]
-                    existing_enjoy_cols = [col for col in enjoy_cols if col in df.columns]
+                    existing_enjoy_cols = col_idx.startswith('enjoy_')
                     if existing_enjoy_cols:
                         for col in existing_enjoy_cols:
-                             data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                             data = count_values(df, col).reset_index()
                              data.columns = ['Response', 'Count']
                              st.markdown(f"**{col.replace('enjoy_', '').replace('_', ' ').title()}**")
                              bar_chart(data, 'Response', 'Count', f"{col.replace('enjoy_', '').replace('_', ' ').title()} Enjoyment")
@@ -1113,11 +3582,10 @@ with col_insights:
                     # Next Purchase Intent
                     st.subheader("🛒 Next Soft Drink Purchase")
                     # Use preprocessed column names
-                    next_cols = [col for col in df.columns if col.startswith('next_purchase')]
-                    existing_next_cols = [col for col in next_cols if col in df.columns]
+                    existing_next_cols = col_idx.startswith('next_purchase')
                     if existing_next_cols:
                         for col in existing_next_cols:
-                             data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                             data = count_values(df, col).reset_index()
                              data.columns = ['Response', 'Count']
                              st.markdown(f"**{col.replace('_', ' ').title()}**")
                              bar_chart(data, 'Response', 'Count', f"{col.replace('_', ' ').title()} Next Purchase")
@@ -1127,29 +3595,22 @@ with col_insights:
                     # Media Usage
                     st.subheader("📺 Media Usage Frequency")
                     # Use preprocessed column names that start with the specific pattern
-                    media_cols = [col for col in df.columns if col.startswith('how_often_do_you_use_the_following_media')]
-                    existing_media_cols = [col for col in media_cols if col in df.columns]
+                    existing_media_cols = col_idx.startswith('how_often_do_you_use_the_following_media')
                     if existing_media_cols:
-                        media_melted = df[existing_media_cols].astype(str).melt(var_name='Media_Col', value_name='Frequency')
-                        media_melted = media_melted[~media_melted['Frequency'].str.strip().str.lower().isin(['nan', 'none', ''])]
-
-                        if not media_melted.empty:
-                            # Extract media type - assuming format like '...__media_type' or '..._media_type'
-                            media_melted['Media Type'] = media_melted['Media_Col'].apply(lambda x: x.split('__')[-1].replace('_', ' ').title()) # Use split __ first
-                            # Fallback if no __
-                            # This fallback logic might be complex, ensure it works or simplify pattern match
-                            # Let's stick to the startswith pattern 'how_often_do_you_use_the_following_media'
-                            # and assume the rest is the media type name separated by underscores
-                            media_melted['Media Type'] = media_melted['Media_Col'].str.replace('how_often_do_you_use_the_following_media', '', regex=False).str.replace('__', '', regex=False).str.replace('_', ' ').str.strip().title()
-                            # Handle cases where the full string is the media type itself if no other pattern works
-                            if '' in media_melted['Media Type'].unique(): # If we ended up with empty strings after replacing prefix
-                                media_melted['Media Type'] = media_melted.apply(
-                                     lambda row: row['Media_Col'].replace('_', ' ').title() if row['Media Type'] == '' else row['Media Type'], axis=1
-                                )
+                        media_block = count_block_values(df, existing_media_cols, drop=('nan', 'none', ''))
 
+                        if not media_block.empty:
+                            # Media type is the rest of the column name after the 'how_often_do_you_use_the_following_media' prefix
+                            media_types = {}
+                            for col in existing_media_cols:
+                                media_type = col.replace('how_often_do_you_use_the_following_media', '').replace('__', '').replace('_', ' ').strip().title()
+                                # Handle cases where the full string is the media type itself
+                                media_types[col] = media_type or col.replace('_', ' ').title()
 
-                            # Count frequencies per media type
-                            media_counts = media_melted.groupby(['Media Type', 'Frequency']).size().reset_index(name='Count')
+                            # Count frequencies per media type (columns naming the same type are added up)
+                            media_counts = media_block.assign(**{'Media Type': media_block['column'].map(media_types)}).groupby(
+                                ['Media Type', 'answer'], sort=False)['count'].sum().reset_index()
+                            media_counts.columns = ['Media Type', 'Frequency', 'Count']
 
                             # Define order for frequency if known (optional)
                             frequency_order = ['Daily', 'Weekly', 'Monthly', 'Less often', 'Never', 'Prefer not to say'] # Example order
@@ -1181,13 +3642,20 @@ with col_insights:
             else:
                 st.info("Please upload the Coca-Cola CSV file above.")
 
+        with cola_tab:
+            cola_section()
+
 
     # MUDAH TAB
     if mudah_tab:
-        with mudah_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def mudah_section():
             st.header("🛒 Mudah")
             if mudah_file:
-                df = preprocess(pd.read_csv(mudah_file))
+                df = load_dataset(mudah_file, BRAND_COLUMN_SPECS["Mudah"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # --- Standard Column Groupings ---
@@ -1195,11 +3663,11 @@ with col_insights:
                     # monthly_household_incom seems like a typo from original code? Assume that's the intended name after cleaning.
                     demographic_cols = ['age_group', 'gender', 'monthly_household_incom']
                     browsing_freq_col = 'property_automotive_browsing_frequency_past_month' # Assuming this cleaned name
-                    mudah_platform_cols = [col for col in df.columns if 'used_platform' in col] # Assuming pattern matches preprocessed
+                    mudah_platform_cols = col_idx.containing('used_platform') # Assuming pattern matches preprocessed
                     ad_rounds = ['r1', 'r2', 'r3', 'r4']
                     # Media use pattern similar to Coca-Cola/Mudah
                     # Assuming pattern like 'how_often_do_you_use__media_type'
-                    media_use_cols = [col for col in df.columns if col.startswith('how_often_do_you_use__')]
+                    media_use_cols = col_idx.startswith('how_often_do_you_use__')
                     purchase_intent_col = 'likelihood_to_purchase_via_mudah_next_6_months' # Assuming this cleaned name
 
                     # --- Summary ---
@@ -1207,13 +3675,13 @@ with col_insights:
                     col1, col2 = st.columns(2)
                     col1.metric("Total Responses", f"{len(df):,}")
                     # Recalculate platforms tracked based on found columns
-                    col2.metric("Platforms Tracked (in survey)", len([c for c in mudah_platform_cols if c in df.columns])) # Only count if found after preprocess
+                    col2.metric("Platforms Tracked (in survey)", len(mudah_platform_cols)) # Resolved from the column index
 
                     # --- Demographics ---
                     st.subheader("👥 Demographics Distribution")
                     for col in demographic_cols:
                         if col in df.columns:
-                            chart_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            chart_data = count_values(df, col).reset_index()
                             chart_data.columns = [col.replace('_', ' ').title(), 'Count'] # Use user-friendly title
                             bar_chart(chart_data, chart_data.columns[0], 'Count', chart_data.columns[0])
                         else:
@@ -1223,25 +3691,27 @@ with col_insights:
                     # --- Browsing Frequency ---
                     if browsing_freq_col in df.columns:
                         st.subheader("🚗 Property/Automotive Browsing Frequency")
-                        freq_counts = df[browsing_freq_col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                        freq_counts = count_values(df, browsing_freq_col).reset_index()
                         freq_counts.columns = ['Frequency', 'Count']
                         bar_chart(freq_counts, 'Frequency', 'Count', "Property/Automotive Browsing Frequency")
                     else:
                          st.info(f"Browsing frequency column '{browsing_freq_col.replace('_', ' ').title()}' not found.")
 
                     # --- Used Platform Analysis ---
-                    if mudah_platform_cols and any(c in df.columns for c in mudah_platform_cols):
+                    if mudah_platform_cols:
                         st.subheader("📱 Platforms Used for Property/Auto Browsing")
-                        # Select only the columns that actually exist in the dataframe
-                        existing_platform_cols = [c for c in mudah_platform_cols if c in df.columns]
+                        # Columns come from the column index, so they all exist in the dataframe
+                        existing_platform_cols = mudah_platform_cols
                         if existing_platform_cols:
-                            used_platforms = df[existing_platform_cols].astype(str).apply(lambda col: col.str.strip()).stack().reset_index(drop=True)
-                            used_platforms = used_platforms[~used_platforms.str.lower().isin(['', 'nan', 'none'])]
-
-                            if not used_platforms.empty:
-                                platform_counts = used_platforms.value_counts().reset_index()
-                                platform_counts.columns = ['Platform', 'Mentions']
-                                bar_chart(platform_counts, 'Platform', 'Mentions', "Platforms Used for Property/Auto Browsing")
+                            platform_block = multi_response_block(df, 'used_platform')
+
+                            if platform_block is not None and platform_block.options:
+                                # Respondents per platform (each counted once however many slots name it)
+                                platform_counts = platform_block.counts().reset_index()
+                                platform_counts.columns = ['Platform', 'Respondents']
+                                bar_chart(platform_counts, 'Platform', 'Respondents', "Platforms Used for Property/Auto Browsing")
+                                if len(platform_block.options) > 1:
+                                    co_occurrence_chart(platform_block, list(platform_counts['Platform']), 'Uses', "🔗 Platforms Used Together")
                             else:
                                 st.info("No valid data found for platforms used.")
                         else:
@@ -1256,10 +3726,9 @@ with col_insights:
                     for round_ in ad_rounds:
                         recall_col = f'ad_recall_{round_}'
                         # Adjust finding impact columns based on preprocessed names
-                        impact_cols = [col for col in df.columns if col.endswith(f'_{round_}') and col != recall_col] # Assume other metrics end with _rX
-                        impact_cols = [col for col in impact_cols if 'info' in col or 'unique' in col or 'relevance' in col or 'engaging' in col] # Refine search
-
-                        existing_impact_cols_round = [c for c in impact_cols if c in df.columns]
+                        # Assume other metrics end with _rX and mention info/unique/relevance/engaging
+                        impact_candidates = set(col_idx.containing('info', 'unique', 'relevance', 'engaging'))
+                        existing_impact_cols_round = [col for col in col_idx.endswith(f'_{round_}') if col != recall_col and col in impact_candidates]
 
                         if recall_col in df.columns or existing_impact_cols_round:
                             st.markdown(f"### 🎯 Round {round_.upper()}")
@@ -1268,7 +3737,7 @@ with col_insights:
                             # Ad Recall
                             if recall_col in df.columns:
                                 st.markdown(f"**{recall_col.replace('_', ' ').title()}**")
-                                recall_counts = df[recall_col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                                recall_counts = count_values(df, recall_col).reset_index()
                                 recall_counts.columns = ['Recall', 'Count']
                                 bar_chart(recall_counts, 'Recall', 'Count', f"Ad Recall Round {round_.upper()}")
                             else:
@@ -1277,9 +3746,18 @@ with col_insights:
 
                             # Other Metrics (Info, Uniqueness, Relevance, etc.)
                             if existing_impact_cols_round:
+                                # Ratings scored together (mean, top-2-box, net) in one summary per round
+                                likert_impact_cols = likert_columns(df, existing_impact_cols_round)
+                                if likert_impact_cols:
+                                    impact_labels = [col.replace('_', ' ').replace(f' {round_}', '').title() for col in likert_impact_cols]
+                                    likert_summary_chart(likert_summary(df, likert_impact_cols, impact_labels),
+                                                         'Metric', f"Ad Impact Scores Round {round_.upper()}")
+                                unscored_ratings_caption(df, existing_impact_cols_round, likert_impact_cols)
                                 for col in existing_impact_cols_round:
+                                    if col in likert_impact_cols:
+                                        continue
                                     label = col.replace('_', ' ').replace(f' {round_}', '').title() # Remove round suffix for label
-                                    chart_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                                    chart_data = count_values(df, col).reset_index()
                                     chart_data.columns = [label, 'Count']
                                     st.markdown(f"**{label}**")
                                     bar_chart(chart_data, label, 'Count', f"{label} Round {round_.upper()}")
@@ -1293,7 +3771,7 @@ with col_insights:
                     # --- Purchase Intent ---
                     if purchase_intent_col in df.columns:
                         st.subheader("🛍️ Likelihood to Purchase via Mudah (Next 6 Months)")
-                        purchase_counts = df[purchase_intent_col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                        purchase_counts = count_values(df, purchase_intent_col).reset_index()
                         purchase_counts.columns = ['Intent', 'Count']
                         bar_chart(purchase_counts, 'Intent', 'Count', "Likelihood to Purchase via Mudah (Next 6 Months)")
                     else:
@@ -1301,20 +3779,21 @@ with col_insights:
 
 
                     # --- Media Usage ---
-                    if media_use_cols and any(c in df.columns for c in media_use_cols):
+                    if media_use_cols:
                         st.subheader("📡 Media Usage Frequency")
-                        # Select only columns that actually exist
-                        existing_media_cols = [c for c in media_use_cols if c in df.columns]
+                        # Columns come from the column index, so they all exist
+                        existing_media_cols = media_use_cols
                         if existing_media_cols:
-                            media_melted = df[existing_media_cols].astype(str).melt(var_name='Media_Col', value_name='Frequency')
-                            media_melted = media_melted[~media_melted['Frequency'].str.strip().str.lower().isin(['nan', 'none', ''])]
+                            media_block = count_block_values(df, existing_media_cols, drop=('nan', 'none', ''))
 
-                            if not media_melted.empty:
+                            if not media_block.empty:
                                 # Extract media type - assuming format like 'how_often_do_you_use__media_type'
-                                media_melted['Media Type'] = media_melted['Media_Col'].apply(lambda x: x.split('__')[-1].replace('_', ' ').title())
+                                media_types = {col: col.split('__')[-1].replace('_', ' ').title() for col in existing_media_cols}
 
                                 # Count frequencies per media type
-                                media_counts = media_melted.groupby(['Media Type', 'Frequency']).size().reset_index(name='Count')
+                                media_counts = media_block.assign(**{'Media Type': media_block['column'].map(media_types)}).groupby(
+                                    ['Media Type', 'answer'], sort=False)['count'].sum().reset_index()
+                                media_counts.columns = ['Media Type', 'Frequency', 'Count']
 
                                 # Define order for frequency if known (optional)
                                 frequency_order = ['Daily', 'Weekly', 'Monthly', 'Less often', 'Never', 'Prefer not to say'] # Example order
@@ -1341,36 +3820,43 @@ with col_insights:
             else:
                 st.info("Please upload the Mudah CSV file above.")
 
+        with mudah_tab:
+            mudah_section()
+
     # KFC TAB
     if kfc_tab:
-        with kfc_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def kfc_section():
             st.header("🍗 KFC Brand Study Dashboard")
             if kfc_file:
-                df=preprocess(pd.read_csv(kfc_file))
+                df = load_dataset(kfc_file, BRAND_COLUMN_SPECS["KFC"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # Identify sections - Use preprocessed names
-                    demographics = [col for col in df.columns if 'age' in col or 'gender' in col or 'income' in col]
-                    fast_food_freq_cols = [col for col in df.columns if 'eat_out' in col] # Plural for safety
-                    brand_visit_cols = [col for col in df.columns if 'brand_you_visit_the_most' in col and 'other' not in col]
-                    decision_factors_cols = [col for col in df.columns if 'important_to_you_when_choosing' in col] # Plural for safety
+                    demographics = col_idx.containing('age', 'gender', 'income')
+                    fast_food_freq_cols = col_idx.containing('eat_out') # Plural for safety
+                    brand_visit_cols = [col for col in col_idx.containing('brand_you_visit_the_most') if 'other' not in col]
+                    decision_factors_cols = col_idx.containing('important_to_you_when_choosing') # Plural for safety
                     # This psychographics column name is very long, need to verify after preprocess
                     psychographics_prefix = 'how_agree_or_disagree_are_you_with_these_following_statements'
-                    psychographics_cols = [col for col in df.columns if col.startswith(psychographics_prefix)] # Look for columns starting with this
-                    ad_recall_cols = [col for col in df.columns if 'recall_seeing_these_ads' in col or 'advertisement_for' in col] # Plural for safety
+                    psychographics_cols = col_idx.startswith(psychographics_prefix) # Look for columns starting with this
+                    ad_recall_cols = col_idx.containing('recall_seeing_these_ads', 'advertisement_for') # Plural for safety
                     # Media use pattern similar to Coca-Cola/Mudah
-                    media_use_cols = [col for col in df.columns if col.startswith('how_often_do_you_use_the_following_media')] # Adjusted pattern
+                    media_use_cols = col_idx.startswith('how_often_do_you_use_the_following_media') # Adjusted pattern
 
                     # Preview
                     st.subheader("📄 Data Preview")
-                    st.dataframe(df.head(), use_container_width=True)
+                    data_grid(df, 'kfc_grid')
 
                     # Demographics
                     st.subheader("👥 Demographics")
                     for col in demographics:
                          if col in df.columns:
                             col_name = col.replace('_', ' ').title()
-                            chart_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            chart_data = count_values(df, col).reset_index()
                             chart_data.columns = [col_name, 'Count']
                             bar_chart(chart_data, col_name, 'Count', col_name)
                          else:
@@ -1379,14 +3865,14 @@ with col_insights:
 
                     # Fast Food Habits
                     st.subheader("🍔 Fast Food Dining Frequency")
-                    if fast_food_freq_cols and any(c in df.columns for c in fast_food_freq_cols):
+                    if fast_food_freq_cols:
                         # Assuming there's one main frequency column or we combine them
                         # Let's assume there's one key one like 'how_often_do_you_eat_out'
                         main_freq_col = [c for c in fast_food_freq_cols if 'how_often' in c or 'frequency' in c]
                         if main_freq_col:
                             col = main_freq_col[0] # Take the first one found that exists
                             if col in df.columns:
-                                chart_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                                chart_data = count_values(df, col).reset_index()
                                 chart_data.columns = ['Frequency', 'Count']
                                 bar_chart(chart_data, 'Frequency', 'Count', col.replace('_', ' ').title())
                             else:
@@ -1399,12 +3885,12 @@ with col_insights:
 
                     # Most Visited Brand
                     st.subheader("🏪 Most Visited Fast Food Brand")
-                    if brand_visit_cols and any(c in df.columns for c in brand_visit_cols):
-                        # Assume there's one main 'most visited' column
-                        existing_visit_cols = [c for c in brand_visit_cols if c in df.columns]
+                    if brand_visit_cols:
+                        # Columns come from the column index, so they all exist
+                        existing_visit_cols = brand_visit_cols
                         if existing_visit_cols:
                             col = existing_visit_cols[0] # Take the first existing one
-                            chart_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            chart_data = count_values(df, col).reset_index()
                             chart_data.columns = ['Brand', 'Count']
                             bar_chart(chart_data, 'Brand', 'Count', col.replace('_', ' ').title())
                         else:
@@ -1420,26 +3906,27 @@ with col_insights:
                     # Let's re-evaluate based on expected preprocessed names. Maybe they start with the factor name?
                     # E.g., 'price_important_to_you_when_choosing', 'taste_important_to_you_when_choosing'
                     factor_cols_pattern = '_important_to_you_when_choosing'
-                    decision_factors_cols = [col for col in df.columns if factor_cols_pattern in col]
+                    decision_factors_cols = col_idx.containing(factor_cols_pattern)
 
-                    if decision_factors_cols and any(c in df.columns for c in decision_factors_cols):
-                        # Filter to existing columns
-                        existing_factor_cols = [c for c in decision_factors_cols if c in df.columns]
+                    if decision_factors_cols:
+                        # Columns come from the column index, so they all exist
+                        existing_factor_cols = decision_factors_cols
                         # Melt to combine data
-                        factor_melted = df[existing_factor_cols].astype(str).melt(var_name='Factor_Col', value_name='Response')
-                        factor_melted = factor_melted[~factor_melted['Response'].str.strip().str.lower().isin(['nan', 'none', ''])]
+                        factor_block = count_block_values(df, existing_factor_cols, drop=('nan', 'none', ''))
 
-                        if not factor_melted.empty:
+                        if not factor_block.empty:
                             # Extract Factor Name from column name (e.g., 'price' from 'price_important_...')
-                            factor_melted['Factor'] = factor_melted['Factor_Col'].str.replace(factor_cols_pattern, '', regex=False).str.replace('_', ' ').str.title()
+                            factors = {col: col.replace(factor_cols_pattern, '').replace('_', ' ').title() for col in existing_factor_cols}
 
                             # Count responses for each factor/response combination
-                            factor_counts = factor_melted.groupby(['Factor', 'Response']).size().reset_index(name='Count')
+                            factor_counts = factor_block.assign(Factor=factor_block['column'].map(factors)).groupby(
+                                ['Factor', 'answer'], sort=False)['count'].sum().reset_index()
+                            factor_counts.columns = ['Factor', 'Response', 'Count']
 
                             # Attempt to infer if it's a ranking question (1st, 2nd, etc.) or agreement (Agree, Disagree)
                             # If Responses look like ranks (1, 2, 3 or '1st', '2nd'), treat as ranking
                             possible_ranks = ['1', '2', '3', '4', '5', '1st', '2nd', '3rd', '4th', '5th']
-                            # Check if *any* response in the melted data looks like a rank
+                            # Check if *any* response in the counted data looks like a rank
                             is_ranking = factor_counts['Response'].astype(str).str.contains('|'.join(possible_ranks), na=False).any()
 
                             if is_ranking:
@@ -1483,19 +3970,25 @@ with col_insights:
 
                     # Psychographic Agreement
                     st.subheader("🧠 Psychographic Agreement")
-                    if psychographics_cols and any(c in df.columns for c in psychographics_cols):
-                        # Filter to existing columns
-                        existing_psycho_cols = [c for c in psychographics_cols if c in df.columns]
-                        # Melt to combine data
-                        agreement_melted = df[existing_psycho_cols].astype(str).melt(var_name='Statement_Col', value_name='Response')
-                        agreement_melted = agreement_melted[~agreement_melted['Response'].str.strip().str.lower().isin(['nan', 'none', ''])]
-
-                        if not agreement_melted.empty:
-                             # Extract Statement from column name (e.g., 'i_like_to_try_new_things' from 'how_agree_..._i_like_to_try_new_things')
-                            agreement_melted['Statement'] = agreement_melted['Statement_Col'].str.replace(f'{psychographics_prefix}__', '', regex=False).str.replace('_', ' ').str.title() # Assuming __ separator after prefix
-
+                    if psychographics_cols:
+                        # Columns come from the column index, so they all exist
+                        existing_psycho_cols = psychographics_cols
+                        # Extract Statement from column name (e.g., 'i_like_to_try_new_things' from 'how_agree_..._i_like_to_try_new_things')
+                        statements = {col: col.replace(f'{psychographics_prefix}__', '').replace('_', ' ').title() # Assuming __ separator after prefix
+                                      for col in existing_psycho_cols}
+                        likert_psycho_cols = likert_columns(df, existing_psycho_cols)
+                        # Count every statement at once
+                        agreement_block = count_block_values(df, existing_psycho_cols, drop=('nan', 'none', ''))
+
+                        if likert_psycho_cols == existing_psycho_cols:
+                            # Agreement scale encoded at ingestion: one scored summary across all statements
+                            likert_summary_chart(likert_summary(df, likert_psycho_cols, [statements[col] for col in likert_psycho_cols]),
+                                                 'Statement', "Psychographic Agreement by Statement")
+                        elif not agreement_block.empty:
                             # Count responses per statement
-                            agreement_counts = agreement_melted.groupby(['Statement', 'Response']).size().reset_index(name='Count')
+                            agreement_counts = agreement_block.assign(Statement=agreement_block['column'].map(statements)).groupby(
+                                ['Statement', 'answer'], sort=False)['count'].sum().reset_index()
+                            agreement_counts.columns = ['Statement', 'Response', 'Count']
 
                             # Define order for agreement scale if known (optional)
                             agreement_order = ['Strongly Disagree', 'Disagree', 'Neutral', 'Agree', 'Strongly Agree'] # Example order
@@ -1518,11 +4011,11 @@ with col_insights:
 
                     # Ad Recall
                     st.subheader("📢 Ad Recall & Brand Mention")
-                    if ad_recall_cols and any(c in df.columns for c in ad_recall_cols):
+                    if ad_recall_cols:
                         for col in ad_recall_cols:
                              if col in df.columns:
                                 st.markdown(f"**{col.replace('_', ' ').title()}**")
-                                ad_data = df[col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                                ad_data = count_values(df, col).reset_index()
                                 ad_data.columns = ['Response', 'Count']
                                 bar_chart(ad_data, 'Response', 'Count', col.replace('_', ' ').title())
                              else:
@@ -1533,19 +4026,21 @@ with col_insights:
 
                     # Media Use
                     st.subheader("📺 Media Consumption")
-                    if media_use_cols and any(c in df.columns for c in media_use_cols):
-                        # Filter to existing columns
-                        existing_media_cols = [c for c in media_use_cols if c in df.columns]
+                    if media_use_cols:
+                        # Columns come from the column index, so they all exist
+                        existing_media_cols = media_use_cols
                         if existing_media_cols:
-                            media_melted = df[existing_media_cols].astype(str).melt(var_name='Media_Col', value_name='Frequency')
-                            media_melted = media_melted[~media_melted['Frequency'].str.strip().str.lower().isin(['nan', 'none', ''])]
+                            media_block = count_block_values(df, existing_media_cols, drop=('nan', 'none', ''))
 
-                            if not media_melted.empty:
+                            if not media_block.empty:
                                 # Extract media type - assuming format like 'how_often_do_you_use_the_following_media__media_type'
-                                media_melted['Media Type'] = media_melted['Media_Col'].str.replace('how_often_do_you_use_the_following_media__', '', regex=False).str.replace('_', ' ').str.title()
+                                media_types = {col: col.replace('how_often_do_you_use_the_following_media__', '').replace('_', ' ').title()
+                                               for col in existing_media_cols}
 
                                 # Count frequencies per media type
-                                media_counts = media_melted.groupby(['Media Type', 'Frequency']).size().reset_index(name='Count')
+                                media_counts = media_block.assign(**{'Media Type': media_block['column'].map(media_types)}).groupby(
+                                    ['Media Type', 'answer'], sort=False)['count'].sum().reset_index()
+                                media_counts.columns = ['Media Type', 'Frequency', 'Count']
 
                                 # Define order for frequency if known (optional)
                                 frequency_order = ['Daily', 'Weekly', 'Monthly', 'Less often', 'Never', 'Prefer not to say'] # Example order
@@ -1573,17 +4068,24 @@ with col_insights:
             else:
                 st.info("Please upload the KFC CSV file above.")
 
+        with kfc_tab:
+            kfc_section()
+
     # PANASONIC TAB
     if panasonic_tab:
-        with panasonic_tab:
+        @st.fragment # Widgets in this tab rerun only this tab
+        def panasonic_section():
             st.header("💨 Panasonic Hairdryer Consumer")
             if panasonic_file:
-                df=preprocess(pd.read_csv(panasonic_file))
+                df = load_dataset(panasonic_file, BRAND_COLUMN_SPECS["Panasonic"])
+                df = apply_weighting(df, weighting_mode, weighting_targets)
+                df = apply_segment_filter(df, segment_selection)
+                col_idx = column_index(df) # Column groups resolved once per dataset
 
                 if not df.empty:
                     # Preview
                     st.subheader("📄 Data Preview")
-                    st.dataframe(df.head(), use_container_width=True)
+                    data_grid(df, 'panasonic_grid')
 
                     # Demographics: Bar Chart for Age and Gender
                     st.subheader("👥 Demographics")
@@ -1595,7 +4097,7 @@ with col_insights:
 
                     with col1:
                         if age_col in df.columns:
-                            chart_data = df[age_col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            chart_data = count_values(df, age_col).reset_index()
                             chart_data.columns = ['Category', 'Count']
                             bar_chart(chart_data, 'Category', 'Count', age_col.replace('_', ' ').title())
                         else:
@@ -1603,7 +4105,7 @@ with col_insights:
 
                     with col2:
                         if gender_col in df.columns:
-                            chart_data = df[gender_col].astype(str).str.strip().value_counts(dropna=False).reset_index()
+                            chart_data = count_values(df, gender_col).reset_index()
                             chart_data.columns = ['Category', 'Count']
                             bar_chart(chart_data, 'Category', 'Count', gender_col.replace('_', ' ').title())
                         else:
@@ -1613,15 +4115,14 @@ with col_insights:
                     # Brand Ownership - Pie Chart + Bar Chart (for Current Hairdryer Brand)
                     st.subheader("💨 Current Hairdryer Brand Ownership")
                     # Use preprocessed column names
-                    brand_cols = ['dyson', 'philips', 'laifen', 'khind', 'panasonic', 'dreame', 'xiaomi', 'revlon', 'vidal_sassoon']
-                    existing_brand_cols = [col for col in brand_cols if col in df.columns]
+                    hairdryer_block = multi_response_block(df, 'hairdryer_brand')
+                    existing_brand_cols = hairdryer_block.options if hairdryer_block else []
 
                     if existing_brand_cols:
                         cols1, cols2 = st.columns(2) # Two columns for side-by-side charts
 
                         for brand in existing_brand_cols:
-                             data = df[brand].astype(str).value_counts(dropna=False).reset_index()
-                             data.columns = ['Response', 'Count']
+                             data = ticked_counts(hairdryer_block, brand) # Popcount of the packed ownership block
 
                              # Skip if no data points exist
                              if not data.empty:
@@ -1636,6 +4137,8 @@ with col_insights:
                                     bar_chart(data, 'Response', 'Count', f"{brand.replace('_', ' ').title()} Ownership")
                              else:
                                  st.info(f"No data for '{brand.replace('_', ' ').title()}' Ownership column.")
+                        if len(existing_brand_cols) > 1:
+                            co_occurrence_chart(hairdryer_block, existing_brand_cols, 'Owns', "🔗 Owns Both Brands")
                     else:
                          st.info("No brand ownership columns found matching expected patterns.")
 
@@ -1646,14 +4149,19 @@ with col_insights:
                     purchase_cols = ['dyson_likely_to_buy', 'philips_likely_to_buy', 'laifen_likely_to_buy', 'khind_likely_to_buy',
                                      'panasonic_likely_to_buy', 'dreame_likely_to_buy', 'xiaomi_likely_to_buy', 'revlon_likely_to_buy',
                                      'vidal_sassoon_likely_to_buy']
-                    existing_purchase_cols = [col for col in purchase_cols if col in df.columns]
+                    existing_purchase_cols = col_idx.existing(purchase_cols)
 
                     if existing_purchase_cols:
+                        likert_purchase_cols = likert_columns(df, existing_purchase_cols)
+                        if likert_purchase_cols:
+                            likert_summary_chart(likert_summary(df, likert_purchase_cols, [col.replace('_likely_to_buy', '').replace('_', ' ').title() for col in likert_purchase_cols]),
+                                                 'Brand', "Likely to Buy Scores by Brand")
+                        unscored_ratings_caption(df, existing_purchase_cols, likert_purchase_cols)
                         cols1, cols2 = st.columns(2) # Two columns for side-by-side charts
 
                         for col in existing_purchase_cols:
                             brand = col.replace('_likely_to_buy', '').replace('_', ' ').title()
-                            data = df[col].astype(str).value_counts(dropna=False).reset_index()
+                            data = count_values(df, col).reset_index()
                             data.columns = ['Response', 'Count']
 
                             # Skip if no data points exist
@@ -1676,6 +4184,9 @@ with col_insights:
             else:
                 st.info("Please upload the Panasonic CSV file above.")
 
+        with panasonic_tab:
+            panasonic_section()
+
 
 # --- Column 2: Billboard Merger & Map ---
 with col_billboard:
@@ -1692,62 +4203,67 @@ with col_billboard:
         key="main_billboard_uploader" # Changed key since it's no longer in sidebar
     )
 
+    # Billboard files already in the dataset library can be picked instead of uploaded
+    library_billboard_files = []
+    if dataset_library["billboards"]:
+        library_billboard_files = st.multiselect(
+            "Or choose billboard files from the library",
+            dataset_library["billboards"],
+            default=dataset_library["billboards"] if REPORT_MODE else None, # The report includes every file
+            format_func=os.path.basename,
+            key="main_billboard_library"
+        )
+
     # --- Billboard Data Loading and Preprocessing (Now depends on main page column uploader) ---
     merged_billboard_df = None # Re-initialize within the column scope
-    if uploaded_billboard_files:
-        if len(uploaded_billboard_files) > 20:
-            st.warning(f"You uploaded {len(uploaded_billboard_files)} billboard files. Only the first 20 will be used.")
-            billboard_files_to_process = uploaded_billboard_files[:20]
+    billboard_duplicates = None # Clusters of boards listed more than once (when merging duplicates)
+    selected_billboard_files = list(uploaded_billboard_files or []) + library_billboard_files
+    if selected_billboard_files:
+        if len(selected_billboard_files) > 20:
+            st.warning(f"You selected {len(selected_billboard_files)} billboard files. Only the first 20 will be used.")
+            billboard_files_to_process = selected_billboard_files[:20]
         else:
-            billboard_files_to_process = uploaded_billboard_files
-            st.success(f"✅ {len(billboard_files_to_process)} billboard file(s) uploaded.") # Changed to st.success
+            billboard_files_to_process = selected_billboard_files
+            st.success(f"✅ {len(billboard_files_to_process)} billboard file(s) selected.") # Changed to st.success
 
         all_billboard_dataframes = []
+        billboard_parse_engines = []
         for file in billboard_files_to_process:
+            file_name = dataset_display_name(file)
             try:
-                # Use preprocess function here too for consistency
-                # Read directly from the file-like object
-                df = preprocess(pd.read_csv(file)) # Use preprocess on read
+                # Parsed and preprocessed through the shared (cached) loader
+                df = load_dataset(file)
                 # Store original file name BEFORE column preprocessing modifies it
-                df['source_file'] = file.name.replace('.', '_').lower() # Clean source file name
+                df['source_file'] = file_name.replace('.', '_').lower() # Clean source file name
                 all_billboard_dataframes.append(df)
+                billboard_parse_engines.append(f"{file_name} – {parse_engine_label(df)}")
             except Exception as e:
-                st.error(f"❌ Error reading or processing `{file.name}`: {e}") # Changed to st.error
+                st.error(f"❌ Error reading or processing `{file_name}`: {e}") # Changed to st.error
 
-        if all_billboard_dataframes:
-            # Concatenate all billboard dataframes
-            merged_billboard_df = pd.concat(all_billboard_dataframes, ignore_index=True, sort=False)
+        if billboard_parse_engines:
+            st.caption("Parsed with: " + "; ".join(billboard_parse_engines))
 
-            # --- Billboard Data Cleaning (after concat) ---
-            # Use preprocessed column names (lowercase, snake_case)
-            lat_col = 'latitude'
-            lon_col = 'longitude'
-            views_col = 'potential_views'
-            reach_col = 'reach'
-
-            if lat_col in merged_billboard_df.columns and lon_col in merged_billboard_df.columns:
-                merged_billboard_df[lat_col] = pd.to_numeric(merged_billboard_df[lat_col], errors='coerce')
-                merged_billboard_df[lon_col] = pd.to_numeric(merged_billboard_df[lon_col], errors='coerce')
-                # Filter rows with invalid lat/lon early
-                merged_billboard_df = merged_billboard_df.dropna(subset=[lat_col, lon_col]).reset_index(drop=True)
-
-                if views_col in merged_billboard_df.columns and reach_col in merged_billboard_df.columns:
-                    # Custom cleaning function for potential thousands separators
-                    def clean_numeric_string_billboard(val):
-                        if pd.isna(val):
-                            return pd.NA
-                        # Handle numbers stored as strings like "1,234"
-                        return str(val).replace(',', '').replace(' ', '').strip() or pd.NA
-
-                    # Apply cleaning to the relevant columns *after* preprocessing
-                    merged_billboard_df[views_col] = pd.to_numeric(merged_billboard_df[views_col].apply(clean_numeric_string_billboard), errors='coerce')
-                    merged_billboard_df[reach_col] = pd.to_numeric(merged_billboard_df[reach_col].apply(clean_numeric_string_billboard), errors='coerce')
-
-                    merged_billboard_df['reach_pct'] = pd.NA # New column for percentage
-                    valid_mask = merged_billboard_df[views_col].notna() & (merged_billboard_df[views_col] != 0) & merged_billboard_df[reach_col].notna()
-                    merged_billboard_df.loc[valid_mask, 'reach_pct'] = (merged_billboard_df.loc[valid_mask, reach_col] / merged_billboard_df.loc[valid_mask, views_col]) * 100
-                    merged_billboard_df['reach_pct'] = merged_billboard_df['reach_pct'].clip(upper=100) # Cap percentage at 100%
-            else:
+        if all_billboard_dataframes:
+            # Concatenate and clean all billboard dataframes (cached per selection of files)
+            merged_billboard_df = merge_billboard_frames(
+                billboard_merge_key(all_billboard_dataframes), all_billboard_dataframes
+            )
+            if 'latitude' in merged_billboard_df.columns and 'longitude' in merged_billboard_df.columns:
+                # Collapse the same physical board listed by several vendor files (cached per radius)
+                dedupe_col1, dedupe_col2 = st.columns([2, 1])
+                dedupe_enabled = dedupe_col1.checkbox("Merge near-duplicate billboards", value=True, key="billboard_dedupe")
+                dedupe_radius_m = dedupe_col2.number_input(
+                    "Duplicate radius (m)", min_value=1, max_value=1000, value=BILLBOARD_DEDUP_RADIUS_M, step=5,
+                    key="billboard_dedupe_radius_m", disabled=not dedupe_enabled
+                )
+                if dedupe_enabled:
+                    raw_billboard_rows = len(merged_billboard_df)
+                    merged_billboard_df, billboard_duplicates = dedupe_billboards(
+                        dataset_fingerprint(merged_billboard_df), int(dedupe_radius_m), merged_billboard_df
+                    )
+                    st.caption(f"🧬 {raw_billboard_rows:,} rows → {len(merged_billboard_df):,} billboards "
+                               f"({len(billboard_duplicates):,} listed more than once)")
+            if 'latitude' not in merged_billboard_df.columns or 'longitude' not in merged_billboard_df.columns:
                  st.warning("Latitude or Longitude columns not found or invalid in billboard data. Cannot plot map.")
 
 
@@ -1755,10 +4271,17 @@ with col_billboard:
     billboard_tabs = st.tabs(["📍 Data & Map", "📊 Charts"])
 
     # --- Billboard Data & Map Tab (Nested within col_billboard) ---
-    with billboard_tabs[0]:
+    @st.fragment # Widgets in this tab rerun only this tab
+    def billboard_map_section():
         st.subheader("📋 Merged Data Preview")
         if merged_billboard_df is not None and not merged_billboard_df.empty:
-            st.dataframe(merged_billboard_df.head(10), use_container_width=True)
+            data_grid(merged_billboard_df, 'billboard_grid')
+
+            if billboard_duplicates is not None and not billboard_duplicates.empty:
+                with st.expander(f"🧬 Near-Duplicate Billboards ({len(billboard_duplicates):,} boards listed more than once)"):
+                    st.caption(f"Rows within {int(st.session_state.get('billboard_dedupe_radius_m', BILLBOARD_DEDUP_RADIUS_M))} m of each other, "
+                               f"or with the same reference ID within {BILLBOARD_REF_MATCH_RADIUS_M} m, are counted once (first listing kept).")
+                    st.dataframe(billboard_duplicates, use_container_width=True)
 
             # --- Summary Metrics ---
             with st.expander("📈 Key Metrics Summary", expanded=True):
@@ -1777,6 +4300,55 @@ with col_billboard:
                 col4.metric("Avg. Reach (%)", f"{avg_pct:.2f}%" if pd.notna(avg_pct) else "N/A")
 
 
+            # --- Reach optimiser (its picks are ringed on the map below) ---
+            billboard_plan, plan_key = None, ''
+            if {'latitude', 'longitude', 'reach'} <= set(merged_billboard_df.columns):
+                with st.expander("🎯 Reach Optimiser"):
+                    if st.checkbox("Plan a billboard selection for maximum reach", key='billboard_optimise'):
+                        costs = billboard_costs(merged_billboard_df)
+                        budget_types = OPTIMISER_BUDGET_TYPES if costs.gt(0).any() else OPTIMISER_BUDGET_TYPES[:1]
+                        opt_col1, opt_col2 = st.columns(2)
+                        budget_type = opt_col1.radio("Budget:", budget_types, horizontal=True, key='billboard_budget_type')
+                        if budget_type == "Total cost":
+                            budget = opt_col2.number_input("Maximum total cost:", min_value=0.0, value=float(round(costs.sum(skipna=True) / 10)),
+                                                           step=1000.0, key='billboard_budget_cost')
+                        else:
+                            budget = opt_col2.number_input("Number of billboards:", min_value=1, max_value=len(merged_billboard_df),
+                                                           value=min(20, len(merged_billboard_df)), step=1, key='billboard_budget_count')
+                        opt_col3, opt_col4 = st.columns(2)
+                        radius_m = opt_col3.number_input("Overlap radius (m):", min_value=0, value=OPTIMISER_OVERLAP_RADIUS_M,
+                                                         step=50, key='billboard_overlap_radius_m')
+                        overlap_share = opt_col4.slider("Audience shared by two billboards at the same spot:", 0.0, 1.0,
+                                                        OPTIMISER_OVERLAP_SHARE, 0.05, key='billboard_overlap_share')
+                        st.caption("Picks billboards greedily by reach gained (per unit cost with a cost budget). Billboards within "
+                                   "the overlap radius of an earlier pick count only the reach they don't share with it.")
+
+                        billboard_plan = billboard_selection_plan(dataset_fingerprint(merged_billboard_df), budget_type, float(budget),
+                                                                  float(radius_m), float(overlap_share), merged_billboard_df)
+                        plan_key = dataset_fingerprint(billboard_plan)
+                        if billboard_plan.empty:
+                            st.info("No billboard with a known reach fits this budget.")
+                        else:
+                            plan_col1, plan_col2, plan_col3 = st.columns(3)
+                            plan_col1.metric("Billboards Chosen", f"{len(billboard_plan):,}")
+                            plan_col2.metric("Net Reach", f"{billboard_plan['cumulative_net_reach'].iat[-1]:,.0f}",
+                                             help="Total reach minus the audience shared by nearby picks")
+                            if 'cumulative_cost' in billboard_plan.columns:
+                                plan_col3.metric("Total Cost", f"{billboard_plan['cumulative_cost'].iat[-1]:,.0f}")
+                            else:
+                                plan_col3.metric("Gross Reach", f"{billboard_plan['reach'].sum():,.0f}")
+                            data_grid(billboard_plan, 'billboard_plan_grid')
+
+                            plan_format = st.selectbox("Download format:", list(BILLBOARD_EXPORT_FORMATS), key='billboard_plan_export_format')
+                            plan_file_name, plan_mime = BILLBOARD_EXPORT_FORMATS[plan_format]
+                            st.download_button(
+                                label="⬇️ Download Optimised Selection",
+                                data=functools.partial(export_billboard_data, plan_format, billboard_plan),
+                                file_name=plan_file_name.replace("merged_billboard_data", "optimised_billboard_selection"),
+                                mime=plan_mime,
+                                key='billboard_plan_download'
+                            )
+
             st.subheader("📍 Billboard Locations Map")
 
             # Use preprocessed column names for map
@@ -1787,127 +4359,107 @@ with col_billboard:
             # Ensure we have Lat/Lon and at least one valid row before proceeding with map
             if lat_col in merged_billboard_df.columns and lon_col in merged_billboard_df.columns and not merged_billboard_df.dropna(subset=[lat_col, lon_col]).empty:
                 try:
-                    # Filter out rows with invalid Lat/Lon before calculating center and iterating
-                    map_df = merged_billboard_df.dropna(subset=[lat_col, lon_col]).copy()
-
-                    center_lat = map_df[lat_col].mean()
-                    center_lon = map_df[lon_col].mean()
-                    # Adjust zoom start if needed for a wider view
-                    m = folium.Map(location=[center_lat, center_lon], zoom_start=5)
-
-                    def get_marker_color(reach_pct_val):
-                        if pd.isna(reach_pct_val):
-                            return "gray"
-                        elif reach_pct_val >= 75:
-                            return "green"
-                        elif reach_pct_val >= 40:
-                            return "orange"
-                        else:
-                            return "red"
-
-                    # Iterate only over rows with valid Lat/Lon from map_df
-                    for _, row in map_df.iterrows():
-
-                        # Use the safe_display_string function for potentially missing/non-string data
-                        location_raw = row.get('location', row.get('country'))
-                        location_display = safe_display_string(location_raw)
-
-                        district_raw = row.get('district')
-                        district_display = safe_display_string(district_raw)
-
-                        reference_id_raw = row.get('reference_id')
-                        reference_id_display = safe_display_string(reference_id_raw)
-
-                        source_file_raw = row.get('source_file') # Get the preprocessed source file name
-                        source_file_display = safe_display_string(source_file_raw, default_display='Unknown File')
-
-                        potential_views_display = f"{row.get('potential_views', pd.NA):,.0f}" if pd.notna(row.get('potential_views')) else "N/A"
-                        reach_display = f"{row.get('reach', pd.NA):,.0f}" if pd.notna(row.get('reach')) else "N/A"
-                        reach_percent_val = row.get(reach_pct_col, pd.NA)
-                        reach_percent_display = f"{reach_percent_val:.2f}%" if pd.notna(reach_percent_val) else "N/A"
-
-                        tooltip = f"""
-                            <strong>File:</strong> {source_file_display}<br>
-                            <strong>Location:</strong> {location_display}<br>
-                            <strong>District:</strong> {district_display}<br>
-                            <strong>Reference ID:</strong> {reference_id_display}<br>
-                            <strong>Lat:</strong> {row[lat_col]}<br>
-                            <strong>Lon:</strong> {row[lon_col]}<br>
-                            <strong>Potential Views:</strong> {potential_views_display}<br>
-                            <strong>Reach:</strong> {reach_display}<br>
-                            <strong>Reach %:</strong> {reach_percent_display}
-                        """
-
-                        folium.Marker(
-                            location=[row[lat_col], row[lon_col]],
-                            popup=folium.Popup(tooltip, max_width=300),
-                            icon=folium.Icon(color=get_marker_color(reach_percent_val), icon="info-sign")
-                        ).add_to(m)
+                    # Markers and popups are built once per merged dataset (cached), not on every rerun
+                    boundaries_key = boundaries_cache_key()
+                    boundaries = load_boundaries(BOUNDARIES_FILE, boundaries_key) if boundaries_key else None
+                    mode_col, weight_col = st.columns(2)
+                    map_mode = mode_col.radio(
+                        "Map view:", BILLBOARD_MAP_MODES, horizontal=True, key='billboard_map_mode',
+                        index=BILLBOARD_MAP_MODES.index("Heatmap") if len(merged_billboard_df) > HEATMAP_DEFAULT_MIN_ROWS else 0
+                    )
+                    if map_mode == "Heatmap":
+                        heatmap_weights = [label for label, col in HEATMAP_WEIGHTS.items()
+                                           if col is None or col in merged_billboard_df.columns]
+                        heatmap_weight = weight_col.selectbox("Weight by:", heatmap_weights, key='billboard_heatmap_weight')
+                        m = billboard_heatmap(dataset_fingerprint(merged_billboard_df), HEATMAP_WEIGHTS[heatmap_weight],
+                                              merged_billboard_df, boundaries_key, boundaries, plan_key, billboard_plan)
+                    else:
+                        m = billboard_map(dataset_fingerprint(merged_billboard_df), merged_billboard_df,
+                                          boundaries_key, boundaries, plan_key, billboard_plan)
 
                     # Use st_folium with use_container_width=True to fit the column
                     st_folium(m, width=None, height=600, use_container_width=True)
 
+                    if boundaries is not None and boundaries['features']:
+                        area_summary = billboard_area_summary(dataset_fingerprint(merged_billboard_df), boundaries_key,
+                                                              merged_billboard_df, boundaries)
+                        with st.expander(f"🗺️ Billboards by Area ({len(area_summary):,} areas)"):
+                            if area_summary.attrs.get('outside'):
+                                st.caption(f"{area_summary.attrs['outside']:,} billboards fall outside every area in {os.path.basename(BOUNDARIES_FILE)}.")
+                            st.dataframe(area_summary, use_container_width=True)
+                    else:
+                        st.caption(f"Add district/region polygons as {BOUNDARIES_FILE} to shade the map by area.")
+
                 except Exception as map_e:
                     st.error(f"❌ Could not plot map: {map_e}")
             else:
                 st.info("No valid Latitude and Longitude data found in the uploaded billboard files to plot the map.")
 
 
-            # --- Download ---
+            # --- Download (file is generated only when clicked, cached per merged dataset and format) ---
             if merged_billboard_df is not None and not merged_billboard_df.empty:
+                export_format = st.selectbox(
+                    "Download format:",
+                    list(BILLBOARD_EXPORT_FORMATS),
+                    key='billboard_export_format'
+                )
+                export_file_name, export_mime = BILLBOARD_EXPORT_FORMATS[export_format]
                  # Include the calculated 'reach_pct' column in the download
-                csv = merged_billboard_df.to_csv(index=False).encode('utf-8')
                 st.download_button(
-                    label="⬇️ Download Merged Billboard CSV",
-                    data=csv,
-                    file_name="merged_billboard_data.csv",
-                    mime="text/csv"
+                    label="⬇️ Download Merged Billboard Data",
+                    data=functools.partial(export_billboard_data, export_format, merged_billboard_df),
+                    file_name=export_file_name,
+                    mime=export_mime
                 )
 
         else:
             st.info("Upload Billboard CSV files using the file uploader below to see the merged data and map.")
 
+    with billboard_tabs[0]:
+        billboard_map_section()
+
     # --- Billboard Charts Tab (Nested within col_billboard) ---
-    with billboard_tabs[1]:
+    @st.fragment # Widgets in this tab rerun only this tab
+    def billboard_charts_section(choices=None):
         st.header("📊 Billboard Data Charts")
         if merged_billboard_df is not None and not merged_billboard_df.empty:
             st.write("Analyze distributions and key metrics from the merged billboard data.")
 
             # --- Select Chart Type ---
-            chart_type = st.selectbox(
+            chart_type = billboard_chart_choice(
                 "Select chart type:",
-                ["-- Select a chart type --", "Bar Chart (Counts)", "Pie Chart (Counts)", "Distribution (Views/Reach)", "Gauge (Avg. Reach %)"],
-                key='billboard_chart_selector' # Add a unique key
+                ["-- Select a chart type --"] + BILLBOARD_CHART_TYPES,
+                'billboard_chart_selector', # Add a unique key
+                choices
             )
 
             # Use preprocessed column names for chart options
-            potential_category_cols = ['location', 'country', 'district', 'category', 'media_owner', 'format', 'venue_type', 'schedule', 'source_file']
-            chartable_categorical_cols = [col for col in potential_category_cols if col in merged_billboard_df.columns]
+            chartable_categorical_cols = [col for col in BILLBOARD_CATEGORY_COLUMNS if col in merged_billboard_df.columns]
 
             if chart_type == "Bar Chart (Counts)":
                 if chartable_categorical_cols:
-                    selected_category_col = st.selectbox(
+                    selected_category_col = billboard_chart_choice(
                         "Select a column for category count:",
                         ["-- Select a column --"] + chartable_categorical_cols,
-                        key='billboard_bar_col'
+                        'billboard_bar_col',
+                        choices
                     )
 
                     if selected_category_col != "-- Select a column --":
                          st.subheader(f"Count of Billboards by '{selected_category_col.replace('_', ' ').title()}'")
 
-                         count_data = merged_billboard_df[selected_category_col].astype(str).value_counts(dropna=False).reset_index()
+                         count_data = count_values(merged_billboard_df, selected_category_col).reset_index()
                          count_data.columns = [selected_category_col, 'Count']
                          # Filter out 'nan' if it exists
                          count_data = count_data[count_data[selected_category_col].str.lower() != 'nan']
 
 
                          if not count_data.empty:
-                             if len(count_data) > 20:
-                                 st.info(f"Showing top 20 {selected_category_col.replace('_', ' ').title()} values.")
-                                 count_data = count_data.head(20)
+                             other_caption(count_data, BAR_CHART_MAX_CATEGORIES, f"{selected_category_col.replace('_', ' ').title()} values")
+                             count_data = top_n_with_other(count_data, selected_category_col, 'Count', BAR_CHART_MAX_CATEGORIES)
 
                              chart = alt.Chart(count_data).mark_bar().encode(
-                                 x=alt.X(selected_category_col, sort='-y', axis=alt.Axis(labelAngle=-45), title=selected_category_col.replace('_', ' ').title()),
+                                 x=alt.X(selected_category_col, sort=list(count_data[selected_category_col]), axis=alt.Axis(labelAngle=-45), title=selected_category_col.replace('_', ' ').title()),
                                  y=alt.Y('Count', title='Count'),
                                  tooltip=[selected_category_col, 'Count']
                              ).properties(title=f"Count by {selected_category_col.replace('_', ' ').title()}").interactive()
@@ -1921,16 +4473,17 @@ with col_billboard:
 
             elif chart_type == "Pie Chart (Counts)":
                 if chartable_categorical_cols:
-                    selected_category_col = st.selectbox(
+                    selected_category_col = billboard_chart_choice(
                         "Select a column for pie chart:",
                         ["-- Select a column --"] + chartable_categorical_cols,
-                        key='billboard_pie_col'
+                        'billboard_pie_col',
+                        choices
                     )
 
                     if selected_category_col != "-- Select a column --":
                         st.subheader(f"Pie Chart of Billboards by '{selected_category_col.replace('_', ' ').title()}'")
 
-                        count_data = merged_billboard_df[selected_category_col].astype(str).value_counts(dropna=False).reset_index()
+                        count_data = count_values(merged_billboard_df, selected_category_col).reset_index()
                         count_data.columns = [selected_category_col, 'Count']
                         # Filter out 'nan'
                         count_data = count_data[count_data[selected_category_col].str.lower() != 'nan']
@@ -1938,9 +4491,8 @@ with col_billboard:
 
                         if not count_data.empty:
                             # Limit categories if too many for a readable pie chart
-                            if len(count_data) > 15:
-                                st.info(f"Showing top 15 {selected_category_col.replace('_', ' ').title()} values.")
-                                count_data = count_data.head(15)
+                            other_caption(count_data, PIE_CHART_MAX_CATEGORIES, f"{selected_category_col.replace('_', ' ').title()} values")
+                            count_data = top_n_with_other(count_data, selected_category_col, 'Count', PIE_CHART_MAX_CATEGORIES)
 
 
                             pie_chart = alt.Chart(count_data).mark_arc(outerRadius=120, innerRadius=40).encode( # Added inner/outer radius
@@ -1958,14 +4510,14 @@ with col_billboard:
 
             elif chart_type == "Distribution (Views/Reach)":
                  # Use preprocessed column names
-                 numeric_cols = ['potential_views', 'reach', 'reach_pct']
-                 chartable_numeric_cols = [col for col in numeric_cols if col in merged_billboard_df.columns and pd.api.types.is_numeric_dtype(merged_billboard_df[col])]
+                 chartable_numeric_cols = [col for col in BILLBOARD_NUMERIC_COLUMNS if col in merged_billboard_df.columns and pd.api.types.is_numeric_dtype(merged_billboard_df[col])]
 
                  if chartable_numeric_cols:
-                     selected_numeric_col = st.selectbox(
+                     selected_numeric_col = billboard_chart_choice(
                          "Select a numeric column for distribution:",
                          ["-- Select a column --"] + chartable_numeric_cols,
-                         key='billboard_numeric_col'
+                         'billboard_numeric_col',
+                         choices
                      )
 
                      if selected_numeric_col != "-- Select a column --":
@@ -2013,10 +4565,9 @@ with col_billboard:
                                        {'range': [40, 75], 'color': 'orange'},
                                        {'range': [75, 100], 'color': 'green'}
                                    ],
-                                   'threshold': {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': gauge_value}} # Show current value line
-                            ),
+                                   'threshold': {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': gauge_value}}, # Show current value line
                             number={'suffix': "%", 'font': {'size': 24}},
-                        )
+                        ))
                         # Add a layout to ensure full range is visible and fits column
                         gauge_fig.update_layout(height=300, margin=dict(t=0, b=0, l=0, r=0))
 
@@ -2031,6 +4582,14 @@ with col_billboard:
         else:
             st.info("Upload and process Billboard CSV files using the file uploader above to see charts.")
 
+    with billboard_tabs[1]:
+        if REPORT_MODE and merged_billboard_df is not None:
+            # Static report: every chart variant, one after another, instead of the selectors
+            for report_choices in billboard_report_variants(merged_billboard_df):
+                billboard_charts_section(report_choices)
+        else:
+            billboard_charts_section()
+
 
 # --- Footer ---
 st.markdown("---")
@@ -0,0 +1,17 @@
+"""Loads app.py's helpers (everything above the command-line and dashboard sections) for the tests."""
+import os
+import types
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+UI_MARKER = "# --- Command-line mode"
+
+
+@pytest.fixture(scope="session")
+def app():
+    with open(APP_PATH, encoding="utf-8") as f:
+        source = f.read()
+    namespace = {"__name__": "app_helpers", "__file__": APP_PATH}
+    exec(compile(source[:source.index(UI_MARKER)], APP_PATH, "exec"), namespace)
+    return types.SimpleNamespace(**namespace)
@@ -0,0 +1,74 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_placeholder_reference_ids_are_missing(app):
+    keys = app.normalise_reference_ids(pd.Series(['N/A', 'none', ' n.a ', 'TBC', '0', '000', None, 'bb-0012']))
+    assert keys.iloc[:-1].isna().all()
+    assert keys.iloc[-1] == 'BB12'
+
+
+def test_placeholder_reference_ids_do_not_merge_boards(app):
+    # Two separate boards 55 m apart, both listed with the placeholder 'N/A'
+    df = pd.DataFrame({'latitude': [3.0, 3.0005], 'longitude': [101.0, 101.0],
+                       'reference_id': ['N/A', 'N/A'], 'source_file': ['a', 'b']})
+    assert list(app.billboard_duplicate_clusters(df)) == [0, 1]
+
+
+def test_shared_reference_id_merges_boards_within_radius(app):
+    df = pd.DataFrame({'latitude': [3.0, 3.001, 3.1], 'longitude': [101.0, 101.0, 101.0],
+                       'reference_id': ['BB-7', 'bb7', 'BB 007'], 'source_file': ['a', 'b', 'c']})
+    # 111 m apart: one board; 11 km away: a different board despite the same ID
+    assert list(app.billboard_duplicate_clusters(df)) == [0, 0, 2]
+
+
+def test_many_rows_sharing_a_placeholder_stay_separate(app):
+    rng = np.random.default_rng(0)
+    n = 20_000
+    df = pd.DataFrame({'latitude': rng.uniform(3, 3.2, n), 'longitude': rng.uniform(101, 101.2, n),
+                       'reference_id': 'N/A', 'source_file': 'a'})
+    labels = app.billboard_duplicate_clusters(df)
+    # Only boards within the 25 m dedupe radius of each other merge
+    assert len(np.unique(labels)) > 0.9 * n
+
+
+def square(lon, lat, size):
+    return [[[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]]
+
+
+def test_area_summary_pools_features_with_the_same_name(app):
+    geojson = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'boundary_name': 'Klang'}, 'geometry': {'type': 'Polygon', 'coordinates': square(101.0, 3.0, 0.1)}},
+        {'type': 'Feature', 'properties': {'boundary_name': 'Klang'}, 'geometry': {'type': 'Polygon', 'coordinates': square(101.5, 3.0, 0.1)}},
+        {'type': 'Feature', 'properties': {'boundary_name': 'Gombak'}, 'geometry': {'type': 'Polygon', 'coordinates': square(102.0, 3.0, 0.1)}},
+    ]}
+    df = pd.DataFrame({'latitude': [3.05, 3.05, 3.05, 3.05, 3.05, 5.0],
+                       'longitude': [101.05, 101.55, 101.56, 101.57, 102.05, 101.0],
+                       'potential_views': [100, 200, 300, 400, 500, 600],
+                       'reach_pct': [10.0, 50.0, 50.0, 50.0, 20.0, 90.0]})
+    summary = app.billboard_area_summary('area-test', 'area-test', df, geojson).set_index('Area')
+    assert summary.loc['Klang', 'Billboards'] == 4
+    assert summary.loc['Klang', 'Total Potential Views'] == 1000
+    # Mean over Klang's four billboards, not the mean of its two features' means (30%)
+    assert summary.loc['Klang', 'Avg. Reach (%)'] == 40.0
+    assert summary.loc['Gombak', 'Avg. Reach (%)'] == 20.0
+    assert summary.attrs['outside'] == 1
+
+
+@pytest.mark.parametrize("export_format", ["CSV", "CSV (gzip)", "Parquet"])
+def test_export_is_a_readable_file_of_the_whole_frame(app, export_format):
+    if export_format not in app.BILLBOARD_EXPORT_FORMATS:
+        pytest.skip(f"{export_format} export not available")
+    df = pd.DataFrame({'reference_id': [f'BB-{i}' for i in range(1200)], 'reach': np.arange(1200.0)})
+    export = app.export_billboard_data(export_format, df)
+    assert isinstance(export, io.BufferedReader)
+    data = export.read()
+    export.close()
+    if export_format == "Parquet":
+        round_trip = pd.read_parquet(io.BytesIO(data))
+    else:
+        round_trip = pd.read_csv(io.BytesIO(data), compression='gzip' if export_format == "CSV (gzip)" else None)
+    pd.testing.assert_frame_equal(round_trip, df, check_dtype=False)
@@ -0,0 +1,23 @@
+import pandas as pd
+
+
+def grid_values(app, df, col, **kwargs):
+    grid = app.DataGridIndex(df)
+    return df[col].iloc[grid.rows(col, **kwargs)].tolist()
+
+
+def test_likert_column_sorts_in_scale_order(app):
+    scale = app.LIKERT_SCALES['agreement']
+    answers = ['Agree', None, 'Strongly Disagree', 'Strongly Agree', 'Neutral', 'Disagree']
+    df = pd.DataFrame({'q': pd.Categorical(answers, categories=scale, ordered=True)})
+    assert grid_values(app, df, 'q')[:-1] == scale
+    assert grid_values(app, df, 'q', descending=True)[:-1] == scale[::-1]
+    # Missing answers go last either way
+    assert pd.isna(grid_values(app, df, 'q', descending=True)[-1])
+
+
+def test_text_column_sorts_and_filters(app):
+    df = pd.DataFrame({'city': ['Penang', 'Ipoh', None, 'Klang', 'Kuantan']})
+    assert grid_values(app, df, 'city')[:-1] == ['Ipoh', 'Klang', 'Kuantan', 'Penang']
+    rows = app.DataGridIndex(df).rows('city', filter_col='city', filter_text='K')
+    assert df['city'].iloc[rows].tolist() == ['Klang', 'Kuantan']
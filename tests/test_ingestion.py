@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+
+def test_short_cp1252_file_is_sniffed_as_cp1252(app):
+    data = b"name,city\nA,Malm\xf6\n"
+    assert app.sniff_csv_format(data)["encoding"] == "cp1252"
+    df = app.read_csv_projected(io.BytesIO(data))
+    assert df["city"].tolist() == ["Malmö"]
+
+
+def test_utf8_sample_cut_inside_a_character(app):
+    body = b"name,city\n" + "A,Malmö\n".encode("utf-8") * 100
+    # A full-size sample that ends on the first byte of 'ö' is still UTF-8 ...
+    sample = body + b"A," * ((app.SNIFF_BYTES - len(body)) // 2)
+    sample = sample[:app.SNIFF_BYTES - 1] + b"\xc3"
+    assert len(sample) == app.SNIFF_BYTES
+    assert app.sniff_csv_format(sample)["encoding"] == "utf-8"
+    # ... but a whole file ending that way is not
+    assert app.sniff_csv_format(body + b"\xc3")["encoding"] == "cp1252"
+
+
+class UploadedFile(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def test_brand_specs_share_one_ingest_spec(app):
+    brand_spec = app.BRAND_COLUMN_SPECS["Cheetos"]
+    overall_spec = app.overall_column_spec("Cheetos")
+    ingest_spec = app.ingest_column_spec(brand_spec)
+    assert app.ingest_column_spec(overall_spec) == ingest_spec
+    assert set(brand_spec["columns"]) | set(overall_spec["columns"]) <= set(ingest_spec["columns"])
+    assert app.ingest_column_spec(None) is None
+
+
+def test_uploaded_file_is_parsed_once_for_every_tab(app, monkeypatch):
+    parses = []
+    helpers = app.read_csv_projected.__globals__
+    read_csv_projected = helpers["read_csv_projected"]
+    monkeypatch.setitem(helpers, "read_csv_projected", lambda *args: parses.append(args) or read_csv_projected(*args))
+
+    upload = UploadedFile(b"gender,age_group,seen_snack_ads,unused\nF,18-24,Yes,x\nM,25-34,No,y\n", "cheetos_parse_once.csv")
+    brand_df = app.load_dataset(upload, app.BRAND_COLUMN_SPECS["Cheetos"])
+    overall_df = app.load_dataset(upload, app.overall_column_spec("Cheetos"))
+    assert len(parses) == 1
+    for df, spec in [(brand_df, app.BRAND_COLUMN_SPECS["Cheetos"]), (overall_df, app.overall_column_spec("Cheetos"))]:
+        expected = [col for col in ["gender", "age_group", "seen_snack_ads"] if app.column_spec_matches(col, spec)]
+        assert list(df.columns) == expected
+    assert brand_df.attrs["fingerprint"] != overall_df.attrs["fingerprint"]
+
+
+@pytest.mark.parametrize('file_name, brand', [
+    ('kfc_fried_chicken.csv', 'KFC'),
+    ('fried_chicken_kfc_wave2.csv', 'KFC'),
+    ('fried_chicken_2024.csv', 'Fried Chicken'),
+    ('coca_cola_rtd.csv', 'Coca-Cola'),
+    ('billboards.csv', None),
+])
+def test_library_brand_prefers_the_most_specific_keyword(app, file_name, brand):
+    assert app.library_brand_for(f'/library/brands/{file_name}') == brand
+
+
+def test_cli_warm_up_only_fills_the_on_disk_cache(app, monkeypatch, tmp_path):
+    csv_path = tmp_path / 'brands' / 'kfc.csv'
+    csv_path.parent.mkdir()
+    csv_path.write_text("Gender,Age\nMale,25-34\nFemale,18-24\n")
+    helpers = app.ingest_library.__globals__
+    monkeypatch.setitem(helpers, "LIBRARY_CACHE_DIR", str(tmp_path / '.cache'))
+    monkeypatch.setitem(helpers, "list_dataset_library", lambda: {"brands": [str(csv_path)], "billboards": []})
+    for name in ("overall_response_cube", "multi_response_blocks", "count_values", "billboard_map"):
+        monkeypatch.setitem(helpers, name, lambda *args: pytest.fail("built an in-memory cache"))
+
+    messages = []
+    app.ingest_library(log=messages.append)
+    app.ingest_library(log=messages.append)
+    assert messages == ["Ingested kfc.csv (2 rows)", "Already cached kfc.csv"]
+    assert len(list((tmp_path / '.cache').iterdir())) == 1
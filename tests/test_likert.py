@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_rating_scale_is_inferred_from_the_answers(app):
+    assert app.rating_scale(pd.Series([1, 2, 5, np.nan])) == (1, 5)
+    assert app.rating_scale(pd.Series([2, 3, 6])) == (1, 7)
+    assert app.rating_scale(pd.Series([0, 4, 10])) == (0, 10)
+    # 0/1 flags, decimals, counts and negatives are not ratings
+    assert app.rating_scale(pd.Series([0, 1, 1, 0])) is None
+    assert app.rating_scale(pd.Series([1.5, 2, 3])) is None
+    assert app.rating_scale(pd.Series([1, 20, 300])) is None
+    assert app.rating_scale(pd.Series([-1, 0, 1])) is None
+
+
+def test_zero_to_ten_ratings_keep_every_respondent(app):
+    df = pd.DataFrame({'dyson_likely_to_buy': [0, 10, 9, 5, np.nan], 'owns_dyson': [0, 1, 1, 0, 1]})
+    cols = app.likert_columns(df, ['dyson_likely_to_buy', 'owns_dyson'])
+    assert cols == ['dyson_likely_to_buy']
+    summary = app.likert_summary(df, cols, ['Dyson'])
+    row = summary.loc['Dyson']
+    assert row['Base'] == 4
+    assert row['Scale Points'] == 11
+    assert row['Mean Score'] == pytest.approx(6.0)
+    assert row['Top 2 Box'] == pytest.approx(0.5) # 9 and 10
+    assert row['Bottom 2 Box'] == pytest.approx(0.25) # 0
+
+
+def test_encoded_likert_scale_scores(app):
+    scale = app.LIKERT_SCALES['agreement']
+    df = pd.DataFrame({'q': pd.Categorical(['Strongly Agree', 'Agree', 'Disagree', None], categories=scale, ordered=True)})
+    row = app.likert_summary(df, ['q'], ['Q']).loc['Q']
+    assert row['Base'] == 3
+    assert row['Mean Score'] == pytest.approx((5 + 4 + 2) / 3)
+    assert row['Net Score'] == pytest.approx(2 / 3 - 1 / 3)
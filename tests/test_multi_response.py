@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+
+def test_numeric_checkbox_block_counts_non_zero_answers(app):
+    df = pd.DataFrame({'dyson': [1, 0, 1, np.nan], 'philips': [0, 0, 1, 1]})
+    block = app.MultiResponseBlock(df, ['dyson', 'philips'])
+    assert block.counts().to_dict() == {'dyson': 2, 'philips': 2}
+    assert block.co_occurrence().loc['dyson', 'philips'] == 1
+
+
+def test_text_checkbox_block_ignores_negative_and_missing_answers(app):
+    df = pd.DataFrame({'dyson': ['Yes', 'No', 'Dyson', None], 'philips': ['Tidak', '0.0', 'N/A', 'Philips']})
+    block = app.MultiResponseBlock(df, ['dyson', 'philips'])
+    assert block.counts().to_dict() == {'dyson': 2, 'philips': 1}
+
+
+def test_slot_block_options_are_the_answers(app):
+    df = pd.DataFrame({'platform_1': ['Mudah', 'Shopee', None], 'platform_2': ['Shopee ', None, 'Lazada']})
+    block = app.MultiResponseBlock(df, ['platform_1', 'platform_2'], slots=True)
+    assert block.counts().to_dict() == {'Shopee': 2, 'Lazada': 1, 'Mudah': 1}
@@ -0,0 +1,17 @@
+import pandas as pd
+
+
+def test_report_inlines_chart_libraries(app):
+    scripts = app._report_scripts({'vega_lite_chart', 'plotly_chart'})
+    assert '<script src=' not in scripts
+    assert 'window.vegaEmbed' in scripts
+    assert 'Plotly' in scripts
+
+
+def test_reach_pct_is_numeric_for_the_gauge(app):
+    frame = pd.DataFrame({'latitude': ['3.1', '3.2'], 'longitude': ['101.6', '101.7'],
+                          'potential_views': ['1,000', '0'], 'reach': ['250', '10']})
+    merged = app.merge_billboard_frames('test-reach-pct', [frame])
+    assert pd.api.types.is_float_dtype(merged['reach_pct'])
+    assert merged['reach_pct'].tolist()[0] == 25.0
+    assert pd.isna(merged['reach_pct'].iloc[1])
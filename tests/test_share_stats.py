@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+
+def test_checkbox_section_uses_every_respondent_as_base(app):
+    df = pd.DataFrame({'ad_kitkat': ['Yes', None, 'Yes', None], 'ad_cadbury': [None, None, 'Yes', None]})
+    stats, p_values = app.yes_share_stats(df, ['ad_kitkat', 'ad_cadbury'], ['Kitkat', 'Cadbury'])
+    block = app.MultiResponseBlock(df, ['ad_kitkat', 'ad_cadbury'])
+    assert stats['Base'].tolist() == [block.base()] * 2
+    assert stats.loc['Kitkat', 'Share'] == 0.5
+    assert stats.loc['Cadbury', 'Share'] == 0.25
+    assert (stats['CI High'] > stats['CI Low']).all()
+    assert np.isfinite(p_values.loc['Kitkat', 'Cadbury'])
+
+
+def test_yes_no_section_leaves_blanks_out_of_the_base(app):
+    df = pd.DataFrame({'prefer_kitkat': ['Yes', 'No', None, 'Yes'], 'prefer_cadbury': ['No', 'No', 'Yes', None]})
+    stats, _ = app.yes_share_stats(df, ['prefer_kitkat', 'prefer_cadbury'], ['Kitkat', 'Cadbury'])
+    assert stats.loc['Kitkat', 'Base'] == 3
+    assert stats.loc['Cadbury', 'Base'] == 3
+    assert stats.loc['Kitkat', 'Share'] == 2 / 3
+
+
+def test_block_share_stats_match_column_scan(app):
+    rng = np.random.default_rng(7)
+    answers = rng.choice(np.array(['Yes', 'No', None], dtype=object), size=(203, 4), p=[0.4, 0.4, 0.2])
+    cols = ['brand_ad_aware_coca_cola_c1', 'brand_ad_aware_coca_cola_c2', 'brand_ad_aware_pepsi_c1', 'brand_ad_aware_pepsi_c2']
+    brands = ['Coca Cola', 'Coca Cola', 'Pepsi', 'Pepsi']
+    df = pd.DataFrame(answers, columns=cols)
+    weighted = df.assign(**{app.WEIGHT_COLUMN: rng.uniform(0.5, 2.0, len(df))})
+    for frame in (df, weighted, df.replace('No', None)):
+        expected, expected_p = app.yes_share_stats(frame, cols, brands)
+        stats, p_values = app.block_share_stats(app.MultiResponseBlock(frame, cols), brands)
+        pd.testing.assert_frame_equal(stats, expected)
+        pd.testing.assert_frame_equal(p_values, expected_p)
@@ -0,0 +1,24 @@
+import json
+
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('share', [None, 'half', -0.2, True])
+def test_invalid_target_share_raises_value_error(app, tmp_path, share):
+    path = tmp_path / 'weighting_targets.json'
+    path.write_text(json.dumps({'gender': {'Male': 0.5, 'Female': share}}))
+    with pytest.raises(ValueError, match='Female'):
+        app.load_weighting_targets(str(path), path.stat().st_mtime_ns)
+
+
+def test_targets_are_harmonised(app, tmp_path):
+    path = tmp_path / 'weighting_targets.json'
+    path.write_text(json.dumps({'gender': {'male ': 0.4, 'Female': 0.6, '': 0.0}}))
+    assert app.load_weighting_targets(str(path), path.stat().st_mtime_ns) == {'gender': {'Male': 0.4, 'Female': 0.6}}
+
+
+def test_response_cube_base_is_the_weight_total(app):
+    df = pd.DataFrame({'gender': ['Male', 'Female', 'Female'], app.WEIGHT_COLUMN: [0.5, 1.25, 2.0]})
+    assert app.ResponseCube(df, ('gender',)).base() == 3.75
+    assert app.ResponseCube(df.drop(columns=app.WEIGHT_COLUMN), ('gender',)).base() == 3